@@ -0,0 +1,28 @@
+-- ============================================================
+-- MIGRATION: KNOWLEDGE CHUNK CONTENT HASHES
+-- DATE: 2026-01-28
+-- DESCRIPTION: Stores a SHA-256 of each chunk's content so
+--              embed_knowledge_base.py can diff files chunk by
+--              chunk: only new or changed chunks are embedded and
+--              only removed chunks are deleted.
+-- ============================================================
+
+-- 1. Column (hex SHA-256 of content, as computed by Chunk.content_hash())
+ALTER TABLE public.arizona_land_assistant_knowledge
+    ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+-- 2. Backfill existing rows so they are not re-embedded on the next run
+UPDATE public.arizona_land_assistant_knowledge
+    SET content_hash = encode(sha256(convert_to(content, 'UTF8')), 'hex')
+    WHERE content_hash IS NULL;
+
+-- 3. Drop duplicate chunks left by earlier full re-imports
+DELETE FROM public.arizona_land_assistant_knowledge a
+    USING public.arizona_land_assistant_knowledge b
+    WHERE a.source_url = b.source_url
+      AND a.content_hash = b.content_hash
+      AND a.ctid > b.ctid;
+
+-- 4. One row per chunk per file (the upsert target)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_az_knowledge_source_hash
+    ON public.arizona_land_assistant_knowledge (source_url, content_hash);
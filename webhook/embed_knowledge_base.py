@@ -7,8 +7,17 @@ Supports:
 
 Model: all-MiniLM-L6-v2 (Local, Free, 384 dims)
 
+Re-runs are incremental: rows carry a content_hash, so only new or edited
+chunks are embedded and only removed chunks are deleted (--force rewrites all).
+Vectors are looked up in an on-disk cache (embedding_cache.py) before the
+model runs, so the model only ever sees text it has not embedded before; even
+--force rewrites rows from cached vectors unless --no-cache is given.
+
 Usage:
   python embed_knowledge_base.py --dir webhook/Knowledge_Base_Implementation/ --db-url postgresql://...
+  python embed_knowledge_base.py --dir ... --db-url ... --workers 4   # pipelined
+  python embed_knowledge_base.py --dir ... --db-url ... --backend onnx-int8
+  python embed_knowledge_base.py --export-cache kb.npz   # seed CI/replicas with --import-cache kb.npz
 """
 
 import os
@@ -17,13 +26,21 @@ import json
 import hashlib
 import argparse
 import re
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, List, Dict, Set, Tuple
 from dataclasses import dataclass, asdict
 
+import numpy as np
 import psycopg
 import tiktoken
-from sentence_transformers import SentenceTransformer
+
+from embedding_engine import EmbeddingEngine, BACKENDS, vector_space
+from embedding_cache import EmbeddingCache
 
 # ──────────────────────────────────────────────────────────────────
 # Configuration
@@ -32,13 +49,20 @@ from sentence_transformers import SentenceTransformer
 TARGET_TOKENS = 400
 OVERLAP_TOKENS = 50
 BATCH_SIZE = 50
+EMBED_WINDOW = BATCH_SIZE * 8  # Chunks length-sorted together across files
+PIPELINE_QUEUE_SIZE = 16  # Files buffered between pipeline stages
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+DEFAULT_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", str(Path.home() / ".cache" / "knowledge-embeddings"))
 
 # Initialize tokenizer (Approximation for length checks)
 tokenizer = tiktoken.get_encoding("cl100k_base")
 
-# Initialize Model (Lazy load in main)
-model = None
+# Initialize Embedding Engine (Lazy load on the first cache miss)
+engine: Optional[EmbeddingEngine] = None
+engine_options: Dict = {"model_name": EMBEDDING_MODEL_NAME, "backend": "torch", "batch_size": BATCH_SIZE}
+
+# Vectors already computed, by model and content (None = --no-cache)
+cache: Optional[EmbeddingCache] = None
 
 # ──────────────────────────────────────────────────────────────────
 # Data Models
@@ -217,98 +241,345 @@ def process_file_content(file_path: Path, relative_path: str) -> List[Chunk]:
 # 3. Database & Embedding
 # ──────────────────────────────────────────────────────────────────
 
-def get_existing_file_hashes(conn) -> Dict[str, str]:
+# Columns derived from chunk metadata; compared to spot metadata-only edits
+ROW_FIELDS = ("type", "category", "title", "jurisdiction", "authority", "related_statute")
+
+def get_existing_chunks(conn) -> Dict[str, Dict[str, Tuple[str, Tuple]]]:
+    """
+    Chunks already stored, as {source_url: {content_hash: (id, row fields)}}.
+
+    Rows from before the content_hash column (NULL hash) never match a chunk,
+    so they are replaced on the next run.
+    """
+    existing: Dict[str, Dict[str, Tuple[str, Tuple]]] = {}
     try:
-        cur = conn.execute("SELECT source_file FROM knowledge_chunks")
-        rows = cur.fetchall()
-        return {row[0] for row in rows} 
+        cur = conn.execute(f"""
+            SELECT id, source_url, content_hash, {", ".join(ROW_FIELDS)}
+            FROM arizona_land_assistant_knowledge
+        """)
+        for row_id, source_url, content_hash, *fields in cur.fetchall():
+            existing.setdefault(source_url, {})[content_hash or f"legacy:{row_id}"] = (row_id, tuple(fields))
     except psycopg.errors.UndefinedTable:
-        return set()
+        conn.rollback()
+    return existing
+
+def get_engine() -> EmbeddingEngine:
+    global engine
+    if engine is None:
+        print(f"Loading model {engine_options['model_name']} ({engine_options['backend']})...")
+        engine = EmbeddingEngine(**engine_options)
+    return engine
 
 def embed_batch(texts: List[str]) -> List[List[float]]:
     try:
-        # SentenceTransformers runs locally
-        embeddings = model.encode(texts)
+        if cache is None:
+            return get_engine().embed(texts).tolist()
+
+        embeddings, missing = cache.get_many(texts)
+        if missing:
+            # Runs locally, in length-sorted batches
+            fresh = get_engine().embed([texts[i] for i in missing])
+            cache.put_many([texts[i] for i in missing], fresh)
+            if embeddings is None:
+                embeddings = np.zeros((len(texts), fresh.shape[1]), dtype=np.float32)
+            embeddings[missing] = fresh
         return embeddings.tolist()
     except Exception as e:
         print(f"Error embedding batch: {e}")
         return []
 
-def save_chunks(conn, chunks: List[Chunk]):
-    texts = [c.content for c in chunks]
-    total = len(texts)
-    print(f"    Generating embeddings for {total} chunks...")
-    
-    all_embeddings = []
-    for i in range(0, total, BATCH_SIZE):
-        batch = texts[i:i+BATCH_SIZE]
-        embs = embed_batch(batch)
-        all_embeddings.extend(embs)
-        
-    unique_files = {c.source_file for c in chunks}
-    with conn.cursor() as cur:
-        # Note: In production, consider soft-deletes or strictly checking IDs.
-        # For now, we clean up previous entries for these files to avoid duplication.
-        for f in unique_files:
-            # We must delete from the NEW table now
-            # FIXED: logic to use 'source_url' column instead of non-existent jsonb 'metadata'
-            cur.execute("DELETE FROM arizona_land_assistant_knowledge WHERE source_url = %s", (str(f),))
-    
-    data = []
-    for chunk, emb in zip(chunks, all_embeddings):
-        # ─────────────────────────────────────────────────────────────
-        # MAPPING LOGIC: python objects -> postgres row
-        # ─────────────────────────────────────────────────────────────
-        
+def chunk_row_fields(chunk: Chunk) -> Tuple:
+    """
+    MAPPING LOGIC: chunk metadata -> postgres columns (in ROW_FIELDS order).
+    """
+    return (
         # 1. Type (Enum)
         # We try to infer from metadata, default to 'guide' or 'faq' which we added to the enum
-        row_type = chunk.metadata.get('type', 'guide')
-        
+        chunk.metadata.get('type', 'guide'),
         # 2. Category
         # Required field. Default to 'general' if not in frontmatter
-        row_category = chunk.metadata.get('category', 'general')
-        
-        # 3. Jurisdiction
-        # Required field. Default to 'Arizona' since this is an AZ bot
-        row_jurisdiction = chunk.metadata.get('jurisdiction', 'Arizona')
-        
-        # 4. Content & Title
+        chunk.metadata.get('category', 'general'),
+        # 3. Title
         # Title might be in metadata, otherwise use source filename
-        row_title = chunk.metadata.get('title', f"Excerpt from {chunk.source_file}")
-        row_content = chunk.content
-        row_source_url = str(chunk.source_file)
-        
-        # 5. Metadata (Store the rest as JSONB) - DEPRECATED in new schema
-        # We mapped everything to strict columns.
-        
-        # 6. Optional Fields
-        row_authority = chunk.metadata.get('authority', None)
-        row_related_statute = chunk.metadata.get('related_statute', None)
-
-        data.append((
-            row_type,
-            row_category,
-            row_title,
-            row_content,
-            row_source_url,
-            row_jurisdiction,
-            row_authority,
-            row_related_statute,
-            emb  # 384 dim vector
-        ))
-        
-    with conn.cursor() as cur:
+        chunk.metadata.get('title', f"Excerpt from {chunk.source_file}"),
+        # 4. Jurisdiction
+        # Required field. Default to 'Arizona' since this is an AZ bot
+        chunk.metadata.get('jurisdiction', 'Arizona'),
+        # 5. Optional Fields
+        chunk.metadata.get('authority', None),
+        chunk.metadata.get('related_statute', None),
+    )
+
+@dataclass
+class FileChanges:
+    """What one file's chunks need done to its stored rows."""
+    source_url: str
+    total: int
+    to_embed: List[Tuple[str, Chunk]]
+    to_update: List[Tuple[str, Chunk]]
+    to_delete: List[str]
+
+def plan_changes(source_url: str, chunks: List[Chunk],
+                 existing: Dict[str, Tuple[str, Tuple]], force: bool = False) -> FileChanges:
+    """
+    Match a file's chunks to its rows by content hash.
+
+    Only chunks with no stored row are embedded, rows whose chunk disappeared
+    are deleted, and rows whose metadata changed are updated without touching
+    their vectors. With force, every chunk's row is rewritten.
+    """
+    # Identical chunks in one file would only duplicate search hits
+    wanted: Dict[str, Chunk] = {}
+    for chunk in chunks:
+        wanted.setdefault(chunk.content_hash(), chunk)
+
+    return FileChanges(
+        source_url=source_url,
+        total=len(wanted),
+        to_embed=[(h, c) for h, c in wanted.items() if force or h not in existing],
+        to_update=[
+            (h, c) for h, c in wanted.items()
+            if not force and h in existing and existing[h][1] != chunk_row_fields(c)
+        ],
+        to_delete=[row_id for h, (row_id, _) in existing.items() if h not in wanted],
+    )
+
+def write_changes(conn, changes: FileChanges, embeddings: List[List[float]]) -> bool:
+    """Apply a file's changes in one transaction (embeddings align with to_embed). Returns success."""
+    # New and changed rows in one upsert; vector NULL keeps the stored one
+    data = [
+        (*chunk_row_fields(c), c.content, changes.source_url, h, emb)
+        for (h, c), emb in zip(changes.to_embed, embeddings)
+    ] + [
+        (*chunk_row_fields(c), c.content, changes.source_url, h, None)
+        for h, c in changes.to_update
+    ]
+
+    try:
+        with conn.cursor() as cur:
+            if changes.to_delete:
+                cur.execute(
+                    "DELETE FROM arizona_land_assistant_knowledge WHERE id = ANY(%s)", (changes.to_delete,)
+                )
+            if data:
+                cur.executemany(f"""
+                    INSERT INTO arizona_land_assistant_knowledge
+                    ({", ".join(ROW_FIELDS)}, content, source_url, content_hash, content_vector)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (source_url, content_hash) DO UPDATE SET
+                        {", ".join(f"{f} = EXCLUDED.{f}" for f in ROW_FIELDS)},
+                        content_vector = COALESCE(EXCLUDED.content_vector,
+                                                  arizona_land_assistant_knowledge.content_vector)
+                """, data)
+        conn.commit()
+        print(f"    {changes.source_url}: embedded {len(changes.to_embed)}, updated {len(changes.to_update)}, "
+              f"deleted {len(changes.to_delete)} chunks in arizona_land_assistant_knowledge.")
+        return True
+    except Exception as e:
+        print(f"    ERROR saving chunks for {changes.source_url}: {e}")
+        conn.rollback()
+        return False
+
+def delete_missing_files(conn, existing_chunks: Dict[str, Dict[str, Tuple[str, Tuple]]], seen: Set[str]) -> int:
+    """Delete the rows of files no longer in the knowledge base. Returns rows deleted."""
+    gone = [
+        row_id
+        for source_url, rows in existing_chunks.items() if source_url is not None and source_url not in seen
+        for row_id, _ in rows.values()
+    ]
+    if gone:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM arizona_land_assistant_knowledge WHERE id = ANY(%s)", (gone,))
+        conn.commit()
+    return len(gone)
+
+def save_chunks(conn, changes: FileChanges) -> int:
+    """
+    Apply one file's planned changes (no chunks: delete its rows).
+    Returns chunks embedded; raises if the file could not be saved.
+    """
+    if not (changes.to_embed or changes.to_update or changes.to_delete):
+        print(f"    Unchanged ({changes.total} chunks)")
+        return 0
+
+    embeddings: List[List[float]] = []
+    if changes.to_embed:
+        print(f"    Generating embeddings for {len(changes.to_embed)} of {changes.total} chunks...")
+        texts = [c.content for _, c in changes.to_embed]
+        embeddings = embed_batch(texts)
+        if len(embeddings) != len(texts):
+            raise RuntimeError("could not embed chunks; leaving file unchanged")
+
+    if not write_changes(conn, changes, embeddings):
+        raise RuntimeError("could not save chunks")
+    return len(embeddings)
+
+
+# ──────────────────────────────────────────────────────────────────
+# 4. Pipelined Ingestion (--workers)
+# ──────────────────────────────────────────────────────────────────
+
+_DONE = None  # Queue sentinel
+
+def parse_file(f_path: Path, rel_path: str) -> Tuple[str, List[Chunk]]:
+    """Process-pool entry point: parse and chunk one file."""
+    return rel_path, process_file_content(f_path, rel_path)
+
+@dataclass
+class PipelineStats:
+    files: int = 0
+    chunks: int = 0
+    embedded: int = 0
+    failed_files: int = 0
+
+def embed_stage(chunk_queue: "queue.Queue", write_queue: "queue.Queue",
+                existing_chunks: Dict[str, Dict[str, Tuple[str, Tuple]]],
+                force: bool, stats: PipelineStats):
+    """
+    Diff each parsed file, then embed the chunks that need it in windows of
+    EMBED_WINDOW chunks spanning files, which the engine sorts by length. A
+    file moves on to the writer once all of its vectors are ready; a partial
+    window is flushed whenever the parsers fall behind, so the model never
+    waits on a full window that is not coming. If a window fails, its files
+    are retried one at a time, so only the file that fails on its own is
+    left unchanged.
+    """
+    # [changes, vectors, failed] per file awaiting vectors; texts and the file
+    # each belongs to, waiting for the next batch
+    pending: List[list] = []
+    texts: List[str] = []
+    owners: List[list] = []
+
+    def flush(n: int):
+        batch, batch_owners = texts[:n], owners[:n]
+        del texts[:n], owners[:n]
+        embeddings = embed_batch(batch)
+        if len(embeddings) != len(batch):
+            # A file's texts are contiguous and in order within the window
+            by_file: Dict[int, Tuple[list, List[str]]] = {}
+            for entry, text in zip(batch_owners, batch):
+                by_file.setdefault(id(entry), (entry, []))[1].append(text)
+            for entry, file_texts in by_file.values():
+                retried = embed_batch(file_texts)
+                if len(retried) == len(file_texts):
+                    entry[1].extend(retried)
+                else:
+                    entry[2] = True
+            keep = [i for i, entry in enumerate(owners) if not entry[2]]
+            texts[:] = [texts[i] for i in keep]
+            owners[:] = [owners[i] for i in keep]
+        else:
+            for entry, emb in zip(batch_owners, embeddings):
+                entry[1].append(emb)
+
+        for entry in list(pending):
+            changes, vectors, failed = entry
+            if failed:
+                print(f"    ERROR embedding chunks; leaving {changes.source_url} unchanged")
+                stats.failed_files += 1
+            elif len(vectors) == len(changes.to_embed):
+                stats.embedded += len(vectors)
+                write_queue.put((changes, vectors))
+            else:
+                continue
+            pending.remove(entry)
+
+    try:
+        while True:
+            try:
+                item = chunk_queue.get_nowait()
+            except queue.Empty:
+                if texts:
+                    flush(len(texts))
+                item = chunk_queue.get()
+            if item is _DONE:
+                break
+
+            rel_path, chunks = item
+            changes = plan_changes(rel_path, chunks, existing_chunks.get(rel_path, {}), force)
+            stats.files += 1
+            stats.chunks += changes.total
+            if not (changes.to_embed or changes.to_update or changes.to_delete):
+                continue
+            if not changes.to_embed:
+                write_queue.put((changes, []))
+                continue
+
+            entry = [changes, [], False]
+            pending.append(entry)
+            for _, chunk in changes.to_embed:
+                texts.append(chunk.content)
+                owners.append(entry)
+            while len(texts) >= EMBED_WINDOW:
+                flush(EMBED_WINDOW)
+
+        if texts:
+            flush(len(texts))
+    except Exception as e:
+        print(f"    Embedding stage FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        # Nothing after the crash reaches the writer: files still waiting on
+        # vectors and every file drained below go unwritten
+        stats.failed_files += len(pending)
+        # Keep the parsers from blocking on a full queue
+        while chunk_queue.get() is not _DONE:
+            stats.failed_files += 1
+    finally:
+        write_queue.put(_DONE)
+
+def write_stage(conn, write_queue: "queue.Queue", stats: PipelineStats):
+    """
+    Apply finished files to the DB while the next batches embed. Drains the
+    queue until _DONE whatever fails, so the embedder never blocks on it.
+    """
+    while True:
+        item = write_queue.get()
+        if item is _DONE:
+            return
         try:
-            cur.executemany("""
-                INSERT INTO arizona_land_assistant_knowledge 
-                (type, category, title, content, source_url, jurisdiction, authority, related_statute, content_vector)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, data)
-            conn.commit()
-            print(f"    Saved {len(data)} chunks to arizona_land_assistant_knowledge.")
+            saved = write_changes(conn, *item)
         except Exception as e:
-            print(f"    ERROR inserting chunks: {e}")
-            conn.rollback()
+            # e.g. the rollback itself failing on a dropped connection
+            print(f"    ERROR saving chunks for {item[0].source_url}: {e}")
+            saved = False
+        if not saved:
+            stats.failed_files += 1
+
+def run_pipeline(conn, files: List[Tuple[Path, str]],
+                 existing_chunks: Dict[str, Dict[str, Tuple[str, Tuple]]],
+                 force: bool, workers: int) -> PipelineStats:
+    """
+    Parse and chunk files in a process pool, embed on this process, write on
+    a third stage. Queues are bounded so fast parsers cannot pile up chunks
+    ahead of the model.
+    """
+    stats = PipelineStats()
+    chunk_queue: "queue.Queue" = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    write_queue: "queue.Queue" = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    embedder = threading.Thread(
+        target=embed_stage, args=(chunk_queue, write_queue, existing_chunks, force, stats), name="embedder"
+    )
+    writer = threading.Thread(target=write_stage, args=(conn, write_queue, stats), name="writer")
+    embedder.start()
+    writer.start()
+
+    # spawn: forking after torch has started its threads can deadlock the children
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(parse_file, f_path, rel_path) for f_path, rel_path in files]
+        try:
+            for future in as_completed(futures):
+                try:
+                    chunk_queue.put(future.result())
+                except Exception as e:
+                    print(f"    FAILED: {e}")
+                    stats.failed_files += 1
+        finally:
+            chunk_queue.put(_DONE)
+            embedder.join()
+            writer.join()
+    return stats
 
 
 # ──────────────────────────────────────────────────────────────────
@@ -317,15 +588,44 @@ def save_chunks(conn, chunks: List[Chunk]):
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--dir", type=Path, required=True)
-    parser.add_argument("--db-url", required=True)
-    parser.add_argument("--force", action="store_true", help="Reprocess all files")
+    parser.add_argument("--dir", type=Path)
+    parser.add_argument("--db-url")
+    parser.add_argument("--force", action="store_true",
+                        help="Rewrite every chunk's row, changed or not; vectors still come from the "
+                             "embedding cache, so add --no-cache to re-run the model")
+    parser.add_argument("--keep-missing", action="store_true",
+                        help="Keep the rows of files not found under --dir (e.g. when ingesting a subset)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Parse/chunk in this many processes, pipelined with embedding and DB writes "
+                             "(0 = one file at a time)")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="torch",
+                        help="Embedding runtime (onnx/onnx-int8 need sentence-transformers[onnx])")
+    parser.add_argument("--onnx-file", help="ONNX export in the model repo, e.g. onnx/model_qint8_avx512_vnni.onnx")
+    parser.add_argument("--cache-dir", type=Path, default=Path(DEFAULT_CACHE_DIR),
+                        help="Embedding cache (default $EMBEDDING_CACHE_DIR or ~/.cache/knowledge-embeddings)")
+    parser.add_argument("--no-cache", action="store_true", help="Always run the model")
+    parser.add_argument("--import-cache", type=Path, help="Merge an exported cache file before embedding")
+    parser.add_argument("--export-cache", type=Path, help="Write the cache to one file after embedding")
     args = parser.parse_args()
 
-    # Load model
-    print(f"Loading model {EMBEDDING_MODEL_NAME}...")
-    global model
-    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    cache_only = not (args.dir or args.db_url) and (args.import_cache or args.export_cache)
+    if not cache_only and not (args.dir and args.db_url):
+        parser.error("--dir and --db-url are required (unless only importing/exporting the cache)")
+    if args.no_cache and (args.import_cache or args.export_cache):
+        parser.error("--no-cache cannot be combined with --import-cache/--export-cache")
+
+    # The model itself loads on the first chunk the cache cannot supply
+    engine_options.update(backend=args.backend, onnx_file=args.onnx_file)
+    global cache
+    if not args.no_cache:
+        cache = EmbeddingCache(args.cache_dir, vector_space(EMBEDDING_MODEL_NAME, args.backend, args.onnx_file))
+        print(f"Embedding cache {cache.path}: {len(cache)} vectors")
+        if args.import_cache:
+            print(f"Imported {cache.import_file(args.import_cache)} vectors from {args.import_cache}")
+    if cache_only:
+        if args.export_cache:
+            print(f"Exported {cache.export(args.export_cache)} vectors to {args.export_cache}")
+        return
     
     try:
         conn = psycopg.connect(args.db_url)
@@ -335,32 +635,55 @@ def main():
         print(f"DB Connection failed: {e}")
         sys.exit(1)
         
-    processed_files_in_db = get_existing_file_hashes(conn)
+    existing_chunks = get_existing_chunks(conn)
     
     files = sorted(args.dir.rglob("*.md"))
     print(f"Found {len(files)} markdown files.")
-    
-    for f_path in files:
-        rel_path = str(f_path.relative_to(args.dir)).replace("\\", "/")
-        
-        if rel_path in processed_files_in_db and not args.force:
-            print(f"Skipping {rel_path} (already in DB)")
-            continue
-            
-        print(f"Processing {rel_path}...")
-        try:
-            file_chunks = process_file_content(f_path, rel_path)
-            if file_chunks:
-                save_chunks(conn, file_chunks)
-            else:
-                print("    No chunks generated (empty?)")
-        except Exception as e:
-            print(f"    FAILED: {e}")
-            import traceback
-            traceback.print_exc()
-            
+    files = [(f_path, str(f_path.relative_to(args.dir)).replace("\\", "/")) for f_path in files]
+    started = time.perf_counter()
+
+    if args.workers > 0:
+        print(f"Pipelined ingestion with {args.workers} parser processes...")
+        stats = run_pipeline(conn, files, existing_chunks, args.force, args.workers)
+    else:
+        stats = PipelineStats()
+        for f_path, rel_path in files:
+            print(f"Processing {rel_path}...")
+            try:
+                file_chunks = process_file_content(f_path, rel_path)
+                changes = plan_changes(rel_path, file_chunks, existing_chunks.get(rel_path, {}), args.force)
+                stats.files += 1
+                stats.chunks += changes.total
+                if not file_chunks:
+                    print("    No chunks generated (empty?)")
+                stats.embedded += save_chunks(conn, changes)
+            except Exception as e:
+                print(f"    FAILED: {e}")
+                stats.failed_files += 1
+                import traceback
+                traceback.print_exc()
+
+    # Only a run that saw every file intact can tell which ones are gone
+    if stats.failed_files and not args.keep_missing:
+        print(f"Keeping rows of removed files: {stats.failed_files} files failed this run")
+    elif not args.keep_missing:
+        removed = delete_missing_files(conn, existing_chunks, {rel_path for _, rel_path in files})
+        if removed:
+            print(f"Deleted {removed} chunks of files no longer under {args.dir}")
+
+    elapsed = time.perf_counter() - started
     conn.close()
-    print("Done.")
+    if cache is not None:
+        print(f"Embedding cache: {cache.stats['hits']} hits, {cache.stats['misses']} misses, "
+              f"{cache.stats['added']} added")
+        if args.export_cache:
+            print(f"Exported {cache.export(args.export_cache)} vectors to {args.export_cache}")
+    if engine is not None:
+        print(f"Embedded {engine.stats['texts']} chunks in {engine.stats['batches']} batches")
+    print(f"Done. {stats.files} files, {stats.chunks} chunks ({stats.embedded} embedded, "
+          f"{stats.failed_files} files failed) in {elapsed:.1f}s: "
+          f"{stats.chunks / elapsed if elapsed else 0:.1f} chunks/s, "
+          f"{stats.embedded / elapsed if elapsed else 0:.1f} embedded/s")
 
 if __name__ == "__main__":
     main()
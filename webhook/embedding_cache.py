@@ -0,0 +1,164 @@
+"""
+On-disk embedding cache for the knowledge base pipeline.
+
+Vectors are keyed by (vector space, normalized content hash), where the
+vector space is the model name plus any quantized backend (see
+embedding_engine.vector_space), so a re-run, --force or a fresh database only
+runs the model for text it has never seen.
+
+Layout, one directory per vector space under the cache dir:
+
+  meta.json     {"vector_space": ..., "dims": 384}
+  vectors.f32   float32 matrix, one row per entry, memory-mapped for reads
+  index.bin     16-byte BLAKE2b key per row, in row order
+
+Both files are append-only. Vectors are written before their keys and the
+row count is the shorter of the two, so an interrupted run loses at most its
+last unindexed rows.
+
+Export/import move a whole vector space as one .npz file, so CI and new
+replicas can be seeded without running the model:
+  python embed_knowledge_base.py --export-cache kb-embeddings.npz
+  python embed_knowledge_base.py --import-cache kb-embeddings.npz --dir ... --db-url ...
+"""
+
+import hashlib
+import json
+import re
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+KEY_BYTES = 16
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_content(text: str) -> str:
+    """
+    NFC text with whitespace runs collapsed to one space. The model's
+    WordPiece tokenizer splits on whitespace, so this never changes its input.
+    """
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+def content_key(text: str) -> bytes:
+    return hashlib.blake2b(normalize_content(text).encode(), digest_size=KEY_BYTES).digest()
+
+
+class EmbeddingCache:
+    """Append-only, memory-mapped vector store for one vector space."""
+
+    def __init__(self, cache_dir: Path, vector_space: str):
+        """
+        Args:
+            cache_dir: Root holding a directory per vector space
+            vector_space: Model (and backend) the vectors come from
+        """
+        self.vector_space = vector_space
+        self.path = Path(cache_dir) / re.sub(r"[^\w.@-]+", "_", vector_space)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.meta_path = self.path / "meta.json"
+        self.vectors_path = self.path / "vectors.f32"
+        self.index_path = self.path / "index.bin"
+
+        self.dims: Optional[int] = None
+        if self.meta_path.exists():
+            meta = json.loads(self.meta_path.read_text())
+            if meta["vector_space"] != vector_space:
+                raise ValueError(f"{self.path} holds {meta['vector_space']}, not {vector_space}")
+            self.dims = meta["dims"]
+
+        self._rows: Dict[bytes, int] = {}
+        self._matrix: Optional[np.memmap] = None
+        self.count = 0
+        self.stats = {"hits": 0, "misses": 0, "added": 0}
+        self._load_index()
+
+    def _load_index(self):
+        if self.dims is None or not self.index_path.exists():
+            return
+        keys = self.index_path.read_bytes()
+        rows_on_disk = self.vectors_path.stat().st_size // (4 * self.dims) if self.vectors_path.exists() else 0
+        self.count = min(len(keys) // KEY_BYTES, rows_on_disk)
+        for row in range(self.count):
+            self._rows.setdefault(keys[row * KEY_BYTES:(row + 1) * KEY_BYTES], row)
+
+    def _mapped(self) -> np.memmap:
+        """The matrix, remapped when rows were appended since the last read."""
+        if self._matrix is None or len(self._matrix) != self.count:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dims))
+        return self._matrix
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get_many(self, texts: List[str]) -> Tuple[Optional[np.ndarray], List[int]]:
+        """
+        Cached vectors for texts.
+
+        Returns:
+            (vectors, missing): a (len(texts), dims) matrix with the cached
+            rows filled in (None when the cache is empty), and the indexes of
+            texts that still need embedding
+        """
+        rows = [self._rows.get(content_key(text)) for text in texts]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        self.stats["hits"] += len(texts) - len(missing)
+        self.stats["misses"] += len(missing)
+        if not self.count:
+            return None, missing
+
+        vectors = np.zeros((len(texts), self.dims), dtype=np.float32)
+        hits = [i for i, row in enumerate(rows) if row is not None]
+        if hits:
+            vectors[hits] = self._mapped()[[rows[i] for i in hits]]
+        return vectors, missing
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """Store vectors for texts not cached yet."""
+        self._append([content_key(text) for text in texts], np.asarray(vectors, dtype=np.float32))
+
+    def _append(self, keys: List[bytes], vectors: np.ndarray):
+        if self.dims is None:
+            self.dims = int(vectors.shape[1])
+            self.meta_path.write_text(json.dumps({"vector_space": self.vector_space, "dims": self.dims}))
+        elif vectors.shape[1] != self.dims:
+            raise ValueError(f"Expected {self.dims}-dim vectors for {self.vector_space}, got {vectors.shape[1]}")
+
+        new = {}
+        for key, vector in zip(keys, vectors):
+            if key not in self._rows and key not in new:
+                new[key] = vector
+        if not new:
+            return
+
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(self.count * 4 * self.dims)  # Drop rows an interrupted run never indexed
+            f.write(np.ascontiguousarray(list(new.values()), dtype=np.float32).tobytes())
+        with open(self.index_path, "ab") as f:
+            f.truncate(self.count * KEY_BYTES)
+            f.write(b"".join(new))
+        for key in new:
+            self._rows[key] = self.count
+            self.count += 1
+        self.stats["added"] += len(new)
+
+    def export(self, path: Path) -> int:
+        """Write every cached vector to one .npz file. Returns rows written."""
+        keys = np.frombuffer(b"".join(self._rows), dtype=np.uint8).reshape(-1, KEY_BYTES)
+        vectors = self._mapped()[list(self._rows.values())] if self._rows else np.zeros((0, self.dims or 0))
+        with open(path, "wb") as f:
+            np.savez(f, vector_space=np.array(self.vector_space), keys=keys, vectors=vectors.astype(np.float32))
+        return len(keys)
+
+    def import_file(self, path: Path) -> int:
+        """Merge an exported .npz into the cache. Returns rows added."""
+        with np.load(path) as data:
+            source = str(data["vector_space"])
+            if source != self.vector_space:
+                raise ValueError(f"{path} holds {source} vectors, not {self.vector_space}")
+            added = self.stats["added"]
+            if len(data["keys"]):
+                self._append([bytes(key) for key in data["keys"]], data["vectors"])
+            return self.stats["added"] - added
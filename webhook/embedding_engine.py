@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Local embedding engine for the knowledge base pipeline.
+
+Chunks from many files are embedded together in one encode call, which sorts
+them by character length before cutting batches, so each batch pads to a
+similar length instead of to its longest outlier. The model runs on one of:
+
+  torch      SentenceTransformer on PyTorch (the reference)
+  onnx       ONNX Runtime, fp32 export of the same model
+  onnx-int8  ONNX Runtime, int8 dynamically quantized export
+
+The ONNX backends need `pip install "sentence-transformers[onnx]"` (>= 3.2)
+and load the exports published with the model on the Hugging Face Hub.
+
+Benchmark (chunks/s per backend and agreement with torch, which always runs
+first as the reference):
+  python embedding_engine.py --dir webhook/Knowledge_Base_Implementation/
+"""
+
+import argparse
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+BATCH_SIZE = 64
+
+# Backend -> SentenceTransformer kwargs. quint8_avx2 runs on any x86-64 CPU
+# from the last decade; pass onnx_file for the avx512/vnni or arm64 exports.
+BACKENDS: Dict[str, Dict] = {
+    "torch": {},
+    "onnx": {"backend": "onnx", "model_kwargs": {"file_name": "onnx/model.onnx"}},
+    "onnx-int8": {"backend": "onnx", "model_kwargs": {"file_name": "onnx/model_quint8_avx2.onnx"}},
+}
+
+# Lowest cosine similarity to the torch vectors accepted from another backend
+MIN_COSINE = 0.99
+
+
+def vector_space(model_name: str, backend: str = "torch", onnx_file: Optional[str] = None) -> str:
+    """
+    Name for the vectors a configuration produces. torch and the fp32 ONNX
+    export agree to float rounding and share one; quantized exports get their own.
+    """
+    file_name = onnx_file or BACKENDS[backend].get("model_kwargs", {}).get("file_name")
+    if backend == "torch" or file_name == "onnx/model.onnx":
+        return model_name
+    return f"{model_name}@{Path(file_name).stem}"
+
+
+class EmbeddingEngine:
+    """
+    Embeds texts in length-sorted batches on the chosen backend.
+
+    Vectors come back in input order as a float32 matrix, exactly as
+    SentenceTransformer.encode returns them. sentence-transformers (and
+    torch) are only imported here, so the cache tools work without them.
+    """
+
+    def __init__(
+        self,
+        model_name: str = EMBEDDING_MODEL_NAME,
+        backend: str = "torch",
+        batch_size: int = BATCH_SIZE,
+        onnx_file: Optional[str] = None
+    ):
+        """
+        Args:
+            model_name: Sentence-transformers model
+            backend: One of BACKENDS
+            batch_size: Texts per model call
+            onnx_file: ONNX export inside the model repo (overrides the backend's default)
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}; choose from {', '.join(BACKENDS)}")
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        kwargs = {**BACKENDS[backend]}
+        if onnx_file and backend != "torch":
+            kwargs["model_kwargs"] = {"file_name": onnx_file}
+        self.model = SentenceTransformer(model_name, **kwargs)
+        self.vector_space = vector_space(model_name, backend, onnx_file)
+        self.dimensions = self.model.get_sentence_embedding_dimension()
+        self.stats = {"texts": 0, "batches": 0}
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts (any number, from any files) into a (len(texts), dims) matrix."""
+        if not texts:
+            return np.empty((0, self.dimensions), dtype=np.float32)
+
+        # encode sorts by length (longest first) and restores input order itself
+        out = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False)
+        self.stats["texts"] += len(texts)
+        self.stats["batches"] += -(-len(texts) // self.batch_size)
+        return out.astype(np.float32, copy=False)
+
+
+def cosine_agreement(a: np.ndarray, b: np.ndarray) -> float:
+    """Lowest row-wise cosine similarity between two embedding matrices."""
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return float(np.min(np.sum(a * b, axis=1)))
+
+
+# ──────────────────────────────────────────────────────────────────
+# Benchmark
+# ──────────────────────────────────────────────────────────────────
+
+def _knowledge_base_texts(root: Path) -> List[str]:
+    from embed_knowledge_base import process_file_content
+    texts = []
+    for f_path in sorted(root.rglob("*.md")):
+        rel_path = str(f_path.relative_to(root)).replace("\\", "/")
+        texts.extend(c.content for c in process_file_content(f_path, rel_path))
+    return texts
+
+def _fixed_batches(model: "SentenceTransformer", texts: List[str], batch_size: int) -> np.ndarray:
+    """The old per-file path: unsorted BATCH_SIZE slices."""
+    return np.concatenate([
+        model.encode(texts[i:i + batch_size], batch_size=batch_size, show_progress_bar=False)
+        for i in range(0, len(texts), batch_size)
+    ])
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding throughput per backend")
+    parser.add_argument("--dir", type=Path, required=True, help="Knowledge base root")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    texts = _knowledge_base_texts(args.dir)
+    print(f"\n{len(texts)} chunks from {args.dir}, batch size {args.batch_size}, best of {args.repeat}")
+    print(f"{'backend':>10} {'path':>14} {'chunks/s':>10} {'min cos':>8}")
+
+    # Tolerance is measured against torch, whatever order the backends are given in
+    reference = None
+    if "torch" not in args.backends:
+        reference = EmbeddingEngine(backend="torch", batch_size=args.batch_size).embed(texts)
+    for backend in sorted(args.backends, key=lambda b: b != "torch"):
+        engine = EmbeddingEngine(backend=backend, batch_size=args.batch_size)
+        engine.embed(texts[:args.batch_size])  # Warm-up
+
+        runs = [("fixed 50", lambda: _fixed_batches(engine.model, texts, 50)), ("sorted", lambda: engine.embed(texts))]
+        for label, fn in runs:
+            best, vectors = float("inf"), None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                vectors = fn()
+                best = min(best, time.perf_counter() - start)
+            if reference is None:
+                reference = vectors  # torch's first run
+            agreement = cosine_agreement(reference, vectors)
+            flag = "" if agreement >= MIN_COSINE else "  BELOW TOLERANCE"
+            print(f"{backend:>10} {label:>14} {len(texts) / best:>10.1f} {agreement:>8.4f}{flag}")
+
+if __name__ == "__main__":
+    main()
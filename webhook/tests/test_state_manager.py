@@ -0,0 +1,74 @@
+"""
+Call state round-trips through transitions without changing the context.
+
+Run from webhook/: python -m pytest tests
+"""
+
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from vapi_fastapi.state_manager import StateManager
+
+
+class FakeRedisFactory:
+    """Stands in for RedisFactory: every client shares one fake server."""
+
+    def __init__(self):
+        self.server = fakeredis.FakeServer()
+
+    def client(self, subscriber: bool = False):
+        return fakeredis.FakeAsyncRedis(server=self.server, decode_responses=True)
+
+    async def close(self):
+        pass
+
+
+CONTEXT = {
+    "prefs": {},
+    "tags": [],
+    "nested": {"empty_list": [], "empty_object": {}},
+    "lead_id": 123456789012345678,
+}
+
+
+@pytest.mark.parametrize("storage", ["json", "hash"])
+def test_transition_preserves_empty_containers_and_large_ints(storage):
+    async def run():
+        manager = StateManager(storage=storage, local_cache_size=0, redis_factory=FakeRedisFactory())
+        await manager.connect()
+        await manager.init_call("call-1")
+
+        returned = await manager.transition("call-1", "BOOKING", CONTEXT)
+        stored = await manager.get_state("call-1")
+        # A second transition re-reads and re-writes what the first stored
+        await manager.transition("call-1", "CONFIRMATION", {"confirmed": True})
+        final = await manager.get_state("call-1")
+        await manager.disconnect()
+        return returned, stored, final
+
+    returned, stored, final = asyncio.run(run())
+    assert returned.state == stored.state == "BOOKING"
+    assert returned.context == CONTEXT
+    assert stored.context == CONTEXT
+    assert final.state == "CONFIRMATION"
+    assert final.context == {**CONTEXT, "confirmed": True}
+    assert type(final.context["prefs"]) is dict and type(final.context["tags"]) is list
+
+
+def test_transition_rejects_invalid_step_without_writing():
+    async def run():
+        manager = StateManager(storage="json", local_cache_size=0, redis_factory=FakeRedisFactory())
+        await manager.connect()
+        await manager.init_call("call-1")
+        rejected = await manager.transition("call-1", "CONFIRMATION", {"x": 1})
+        state = await manager.get_state("call-1")
+        missing = await manager.transition("unknown", "BOOKING")
+        await manager.disconnect()
+        return rejected, state, missing
+
+    rejected, state, missing = asyncio.run(run())
+    assert rejected is None and missing is None
+    assert state.state == "QUALIFICATION" and state.context == {}
@@ -0,0 +1,440 @@
+from datetime import datetime, timezone as dt_timezone
+from typing import Optional, List, Set, Tuple, Dict, Callable, Awaitable
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+import redis.asyncio as redis
+from redis.exceptions import WatchError
+from .calendar_client import FreeBusyBlock
+from .redis_pool import RedisFactory
+
+Interval = Tuple[float, float]
+FetchFn = Callable[[], Awaitable[List[FreeBusyBlock]]]
+# agent emails -> busy blocks per agent (agents it could not read left out)
+FetchManyFn = Callable[[List[str]], Awaitable[Dict[str, List[FreeBusyBlock]]]]
+
+# Agent emails are published here whenever their calendar changes
+INVALIDATION_CHANNEL = "freebusy:invalidated"
+
+class AvailabilityCache:
+    """
+    Redis-backed free/busy cache shared by every uvicorn worker.
+
+    Each agent has a single key holding the time windows already fetched from
+    Google (merged when they overlap) and the busy blocks inside them, so any
+    request that falls inside a covered window is served without calling the
+    freebusy API. The key expires on a short TTL and is deleted as soon as the
+    agent's calendar changes. Each invalidation also bumps the agent's
+    generation, and a fetch only writes back if the generation it started
+    under is still current, so a lookup that raced a calendar change cannot
+    re-cache the busy list the change made stale.
+
+    Misses are single-flighted per agent and window: a lookup joins any task
+    in flight for that agent inside the worker, whether it came from a
+    single-agent or a batched lookup, and a short Redis lease per agent lets
+    only one worker call Google while the others wait for the result it
+    writes to the cache. The misses of a batched lookup are fetched together.
+    """
+
+    STAT_FIELDS = ("hits", "issued", "coalesced_local", "coalesced_remote")
+
+    def __init__(self, redis_url: Optional[str] = None, ttl_seconds: Optional[int] = None,
+                 redis_factory: Optional[RedisFactory] = None):
+        self.redis_url = redis_url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.redis_factory = redis_factory or RedisFactory(self.redis_url)
+        self._owns_factory = redis_factory is None
+        self.redis_client: Optional[redis.Redis] = None
+        self.ttl_seconds = ttl_seconds or int(os.getenv("FREEBUSY_CACHE_TTL", "30"))
+        self.lease_ms = 3000  # Upper bound on how long followers wait for the leader
+        self.poll_interval = 0.02
+        self._inflight: Dict[Tuple[str, float, float], asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()  # Stat writes, referenced until done
+        self.stats: Dict[str, int] = {field: 0 for field in self.STAT_FIELDS}
+
+    async def connect(self):
+        """Initialize Redis connection."""
+        if not self.redis_client:
+            self.redis_client = self.redis_factory.client()
+
+    async def disconnect(self):
+        """Close Redis connection."""
+        if self.redis_client:
+            await self.redis_client.close()
+        if self._owns_factory:
+            await self.redis_factory.close()
+
+    def _get_key(self, agent_email: str) -> str:
+        """Redis key naming: freebusy:AGENT"""
+        return f"freebusy:{agent_email}"
+
+    def _get_generation_key(self, agent_email: str) -> str:
+        """Redis key naming: freebusy:gen:AGENT (no TTL, so it never resets under a fetch)"""
+        return f"freebusy:gen:{agent_email}"
+
+    def _get_lease_key(self, agent_email: str, start: float, end: float) -> str:
+        """Redis key naming: freebusy:lease:AGENT:START:END"""
+        return f"freebusy:lease:{agent_email}:{int(start)}:{int(end)}"
+
+    @staticmethod
+    def _merge(intervals: List[Interval]) -> List[Interval]:
+        """Sort intervals and merge the ones that overlap or touch."""
+        merged: List[Interval] = []
+        for start, end in sorted(intervals):
+            if merged and start <= merged[-1][1]:
+                if end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
+    async def get(
+        self,
+        agent_email: str,
+        start_date: datetime,
+        end_date: datetime
+    ) -> Optional[List[FreeBusyBlock]]:
+        """
+        Return cached busy blocks for the window, or None on a miss.
+        """
+        if not self.redis_client:
+            await self.connect()
+
+        try:
+            data = await self.redis_client.get(self._get_key(agent_email))
+        except Exception as e:
+            logging.warning(f"Free/busy cache read failed: {e}")
+            return None
+
+        return self._decode(data, start_date, end_date)
+
+    async def get_many(
+        self,
+        agent_emails: List[str],
+        start_date: datetime,
+        end_date: datetime
+    ) -> Dict[str, List[FreeBusyBlock]]:
+        """
+        Cached busy blocks for several agents in one MGET; misses are omitted.
+        """
+        hits = await self._read_many(agent_emails, start_date, end_date)
+        self.stats["hits"] += len(hits)
+        return hits
+
+    async def _read_many(
+        self,
+        agent_emails: List[str],
+        start_date: datetime,
+        end_date: datetime
+    ) -> Dict[str, List[FreeBusyBlock]]:
+        if not self.redis_client:
+            await self.connect()
+
+        try:
+            values = await self.redis_client.mget([self._get_key(a) for a in agent_emails])
+        except Exception as e:
+            logging.warning(f"Free/busy cache read failed: {e}")
+            return {}
+
+        hits: Dict[str, List[FreeBusyBlock]] = {}
+        for agent_email, data in zip(agent_emails, values):
+            blocks = self._decode(data, start_date, end_date)
+            if blocks is not None:
+                hits[agent_email] = blocks
+        return hits
+
+    async def generations(self, agent_emails: List[str]) -> Dict[str, Optional[int]]:
+        """
+        Current invalidation generation per agent, read before fetching so
+        put() can tell whether the calendar changed while the fetch ran.
+        None means unknown (Redis unavailable), and put() will not write.
+        """
+        if not self.redis_client:
+            await self.connect()
+
+        try:
+            values = await self.redis_client.mget([self._get_generation_key(a) for a in agent_emails])
+        except Exception as e:
+            logging.warning(f"Free/busy generation read failed: {e}")
+            return {a: None for a in agent_emails}
+        return {a: int(v or 0) for a, v in zip(agent_emails, values)}
+
+    def _decode(
+        self,
+        data: Optional[str],
+        start_date: datetime,
+        end_date: datetime
+    ) -> Optional[List[FreeBusyBlock]]:
+        """Busy blocks overlapping the window if the entry covers it."""
+        if not data:
+            return None
+
+        entry = json.loads(data)
+        start, end = start_date.timestamp(), end_date.timestamp()
+
+        # Windows are stored merged, so a hit must sit inside a single window
+        if not any(w_start <= start and end <= w_end for w_start, w_end in entry["windows"]):
+            return None
+
+        return [
+            FreeBusyBlock(
+                start=datetime.fromtimestamp(b_start, dt_timezone.utc),
+                end=datetime.fromtimestamp(b_end, dt_timezone.utc),
+            )
+            for b_start, b_end in entry["busy"]
+            if b_start < end and start < b_end
+        ]
+
+    async def put(
+        self,
+        agent_email: str,
+        start_date: datetime,
+        end_date: datetime,
+        busy_blocks: List[FreeBusyBlock],
+        generation: Optional[int]
+    ) -> None:
+        """
+        Merge a freshly fetched window into the agent's cache entry.
+
+        The entry keeps the TTL of its first write, so merged data never
+        outlives the oldest fetch it contains.
+
+        Args:
+            generation: The agent's generation when the fetch started (from
+                generations()); the write is dropped if it has moved on
+        """
+        if generation is None:
+            return
+        if not self.redis_client:
+            await self.connect()
+
+        key = self._get_key(agent_email)
+        generation_key = self._get_generation_key(agent_email)
+        window = (start_date.timestamp(), end_date.timestamp())
+        busy = [(b.start.timestamp(), b.end.timestamp()) for b in busy_blocks]
+
+        try:
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                await pipe.watch(key, generation_key)
+                if int(await pipe.get(generation_key) or 0) != generation:
+                    # Invalidated while we were fetching: this data is stale
+                    return
+                existing = await pipe.get(key)
+
+                if existing:
+                    entry = json.loads(existing)
+                    windows = [tuple(w) for w in entry["windows"]] + [window]
+                    busy = sorted(set(busy) | {tuple(b) for b in entry["busy"]})
+                else:
+                    windows = [window]
+
+                payload = json.dumps({"windows": self._merge(windows), "busy": busy})
+
+                pipe.multi()
+                if existing:
+                    pipe.set(key, payload, keepttl=True)
+                else:
+                    pipe.set(key, payload, ex=self.ttl_seconds)
+                await pipe.execute()
+        except WatchError:
+            # Another worker changed the entry (or invalidated it) first; skip this write
+            pass
+        except Exception as e:
+            logging.warning(f"Free/busy cache write failed: {e}")
+
+    async def invalidate(self, agent_email: str) -> None:
+        """Drop the agent's cached free/busy data after a calendar change (and announce it)."""
+        if not self.redis_client:
+            await self.connect()
+
+        try:
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.incr(self._get_generation_key(agent_email))
+                pipe.delete(self._get_key(agent_email))
+                pipe.publish(INVALIDATION_CHANNEL, agent_email)
+                await pipe.execute()
+        except Exception as e:
+            logging.error(f"Free/busy cache invalidation failed: {e}", exc_info=True)
+
+    async def get_or_fetch(
+        self,
+        agent_email: str,
+        start_date: datetime,
+        end_date: datetime,
+        fetch: FetchFn
+    ) -> List[FreeBusyBlock]:
+        """
+        Serve from cache, otherwise coalesce with any identical lookup in flight.
+        """
+        async def fetch_one(agents: List[str]) -> Dict[str, List[FreeBusyBlock]]:
+            return {agent_email: await fetch()}
+
+        busy_by_agent = await self.get_many_or_fetch([agent_email], start_date, end_date, fetch_one)
+        return busy_by_agent.get(agent_email, [])
+
+    async def get_many_or_fetch(
+        self,
+        agent_emails: List[str],
+        start_date: datetime,
+        end_date: datetime,
+        fetch_many: FetchManyFn
+    ) -> Dict[str, List[FreeBusyBlock]]:
+        """
+        Serve each agent from cache, otherwise coalesce with any lookup of the
+        same agent and window in flight (single-agent or batched), and fetch
+        the remaining agents with one fetch_many call. Agents fetch_many
+        leaves out are left out of the result.
+        """
+        busy_by_agent = await self.get_many(agent_emails, start_date, end_date)
+
+        tasks: Dict[str, asyncio.Future] = {}
+        new: List[str] = []
+        for agent_email in agent_emails:
+            if agent_email in busy_by_agent:
+                continue
+            task = self._inflight.get((agent_email, start_date.timestamp(), end_date.timestamp()))
+            if task:
+                self._count("coalesced_local")
+                tasks[agent_email] = task
+            else:
+                new.append(agent_email)
+
+        if new:
+            batch = asyncio.ensure_future(self._fetch_many_once(new, start_date, end_date, fetch_many))
+            for agent_email in new:
+                flight_key = (agent_email, start_date.timestamp(), end_date.timestamp())
+                task = asyncio.ensure_future(self._pick(batch, agent_email))
+                self._inflight[flight_key] = task
+                task.add_done_callback(lambda _, flight_key=flight_key: self._inflight.pop(flight_key, None))
+                tasks[agent_email] = task
+
+        if tasks:
+            # Shield so one cancelled caller doesn't cancel the lookup for the rest
+            results = await asyncio.shield(asyncio.gather(*tasks.values()))
+            for agent_email, busy_blocks in zip(tasks, results):
+                if busy_blocks is not None:
+                    busy_by_agent[agent_email] = busy_blocks
+        return busy_by_agent
+
+    @staticmethod
+    async def _pick(batch: asyncio.Future, agent_email: str) -> Optional[List[FreeBusyBlock]]:
+        """One agent's share of a batched lookup (None if the batch left it out)."""
+        return (await batch).get(agent_email)
+
+    async def _fetch_many_once(
+        self,
+        agent_emails: List[str],
+        start_date: datetime,
+        end_date: datetime,
+        fetch_many: FetchManyFn
+    ) -> Dict[str, List[FreeBusyBlock]]:
+        """Fetch upstream the agents no other worker holds the lease for; wait for the rest."""
+        lease_keys = {
+            a: self._get_lease_key(a, start_date.timestamp(), end_date.timestamp()) for a in agent_emails
+        }
+        lease_id = str(uuid.uuid4())
+
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for agent_email in agent_emails:
+                    pipe.set(lease_keys[agent_email], lease_id, nx=True, px=self.lease_ms)
+                leases = await pipe.execute()
+        except Exception as e:
+            logging.warning(f"Free/busy lease unavailable, fetching directly: {e}")
+            leases = [True] * len(agent_emails)
+        leaders = [a for a, leased in zip(agent_emails, leases) if leased]
+        followers = [a for a, leased in zip(agent_emails, leases) if not leased]
+
+        async def lead() -> Dict[str, List[FreeBusyBlock]]:
+            if not leaders:
+                return {}
+            try:
+                return await self._fetch_and_put(leaders, start_date, end_date, fetch_many)
+            finally:
+                try:
+                    await self.redis_client.delete(*[lease_keys[a] for a in leaders])
+                except Exception:
+                    pass  # Leases expire on their own
+
+        fetched, followed = await asyncio.gather(
+            lead(), self._await_leaders(followers, start_date, end_date, lease_keys)
+        )
+        # Their leader failed, died or is too slow; fetch those ourselves
+        stragglers = [a for a in followers if a not in followed]
+        if stragglers:
+            fetched.update(await self._fetch_and_put(stragglers, start_date, end_date, fetch_many))
+        return {**followed, **fetched}
+
+    async def _await_leaders(
+        self,
+        agent_emails: List[str],
+        start_date: datetime,
+        end_date: datetime,
+        lease_keys: Dict[str, str]
+    ) -> Dict[str, List[FreeBusyBlock]]:
+        """Wait for other workers' fetches to land in the cache; returns the agents that did."""
+        found: Dict[str, List[FreeBusyBlock]] = {}
+        waiting = list(agent_emails)
+        deadline = time.monotonic() + self.lease_ms / 1000
+        while waiting and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            cached = await self._read_many(waiting, start_date, end_date)
+            for agent_email, busy_blocks in cached.items():
+                self._count("coalesced_remote")
+                found[agent_email] = busy_blocks
+            waiting = [a for a in waiting if a not in cached]
+            if not waiting:
+                break
+            # A leader drops its lease when done; no lease and no entry means
+            # its fetch failed or its write was skipped
+            try:
+                leases = await self.redis_client.mget([lease_keys[a] for a in waiting])
+            except Exception:
+                break
+            waiting = [a for a, lease in zip(waiting, leases) if lease is not None]
+        return found
+
+    async def _fetch_and_put(
+        self,
+        agent_emails: List[str],
+        start_date: datetime,
+        end_date: datetime,
+        fetch_many: FetchManyFn
+    ) -> Dict[str, List[FreeBusyBlock]]:
+        self._count("issued", len(agent_emails))
+        generations = await self.generations(agent_emails)
+        fetched = await fetch_many(agent_emails)
+        await asyncio.gather(*[
+            self.put(agent_email, start_date, end_date, busy_blocks, generations[agent_email])
+            for agent_email, busy_blocks in fetched.items()
+        ])
+        return fetched
+
+    def _count(self, field: str, n: int = 1) -> None:
+        """Bump a local counter and mirror upstream-load counters to Redis."""
+        self.stats[field] += n
+        if field != "hits" and self.redis_client:
+            task = asyncio.ensure_future(self._incr_shared(field, n))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def _incr_shared(self, field: str, n: int) -> None:
+        try:
+            await self.redis_client.hincrby("freebusy:stats", field, n)
+        except Exception:
+            pass  # Metrics are best-effort
+
+    async def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Counters for this worker plus totals across all workers.
+        """
+        shared: Dict[str, int] = {}
+        if self.redis_client:
+            try:
+                raw = await self.redis_client.hgetall("freebusy:stats")
+                shared = {k: int(v) for k, v in raw.items()}
+            except Exception as e:
+                logging.warning(f"Free/busy stats read failed: {e}")
+        return {"worker": dict(self.stats), "cluster": shared}
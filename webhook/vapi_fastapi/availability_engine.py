@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta, time
+from operator import attrgetter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+Interval = Tuple[datetime, datetime]
+# Anything with .start/.end datetimes: TimeSlot, FreeBusyBlock, ...
+Busy = Any
+# Weekday (0=Monday) -> (open, close); missing or None means closed
+BusinessHours = Dict[int, Optional[Tuple[time, time]]]
+
+# Below this many busy blocks a plain early-exit scan beats sorting them
+SCAN_MAX_BUSY = 64
+
+
+def merge_intervals(busy: Iterable[Busy]) -> List[Interval]:
+    """
+    Sort busy blocks once and merge the ones that overlap or touch.
+    """
+    merged: List[Interval] = []
+    for block in sorted(busy, key=attrgetter("start")):
+        if merged and block.start <= merged[-1][1]:
+            if block.end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], block.end)
+        else:
+            merged.append((block.start, block.end))
+    return merged
+
+
+def find_free_slots(
+    busy: Iterable[Busy],
+    search_from: datetime,
+    hours: BusinessHours,
+    count: int = 3,
+    slot_minutes: int = 30,
+    step_minutes: Optional[int] = None,
+    buffer_minutes: int = 0,
+    max_days: int = 14
+) -> List[datetime]:
+    """
+    Start times of the first `count` free slots from `search_from` onward.
+
+    The horizon is searched in runs of days that double in length (1, 2, 4,
+    ...). For each run, only the busy intervals touching it are sorted and
+    merged, then swept alongside the business-hours grid in a single pass.
+    Conflicts jump the grid past the whole block. The usual 3-slot offer is
+    settled on the first day, so it costs one filtering pass over the busy
+    blocks rather than sorting a fortnight of them. A long listing still
+    costs O(busy log busy + slots), not every candidate slot checked against
+    every busy block. Calendars with at most SCAN_MAX_BUSY blocks skip the
+    sort and check each candidate against every block, which is cheaper at
+    that size.
+
+    Args:
+        busy: Busy blocks with .start/.end datetimes, any timezone
+        search_from: Earliest start; its tzinfo is used for the grid
+        hours: Opening hours per weekday
+        count: Number of slots to return
+        slot_minutes: Length of each slot
+        step_minutes: Grid spacing (defaults to slot_minutes)
+        buffer_minutes: Gap required between a slot and any busy block
+        max_days: Calendar days to search, counting search_from's day
+    """
+    duration = timedelta(minutes=slot_minutes)
+    step = timedelta(minutes=step_minutes or slot_minutes)
+    buffer = timedelta(minutes=buffer_minutes)
+    tz = search_from.tzinfo
+    search_from = search_from.replace(second=0, microsecond=0)
+    busy = busy if isinstance(busy, list) else list(busy)
+    if len(busy) <= SCAN_MAX_BUSY:
+        return _scan_free_slots(busy, search_from, hours, count, duration, step, buffer, max_days)
+
+    slots: List[datetime] = []
+    first_day, run = 0, 1
+    while first_day < max_days and len(slots) < count:
+        days = min(run, max_days - first_day)
+        run_start = search_from.date() + timedelta(days=first_day)
+
+        # Only blocks that can touch this run of days need sorting
+        lower = max(search_from, datetime.combine(run_start, time(), tzinfo=tz)) - buffer
+        upper = datetime.combine(run_start + timedelta(days=days), time(), tzinfo=tz) + buffer
+        intervals = merge_intervals([b for b in busy if b.end > lower and b.start < upper])
+        n = len(intervals)
+        i = 0
+
+        for day_offset in range(days):
+            day = run_start + timedelta(days=day_offset)
+            window = hours.get(day.weekday())
+            if not window:
+                continue
+
+            open_dt = datetime.combine(day, window[0], tzinfo=tz)
+            close_dt = datetime.combine(day, window[1], tzinfo=tz)
+
+            # Grid is anchored at opening time; round a mid-day start up onto it
+            candidate = open_dt
+            if search_from > open_dt:
+                candidate += -((open_dt - search_from) // step) * step
+
+            while candidate + duration <= close_dt:
+                # Drop busy intervals that end before this slot (plus buffer) begins
+                while i < n and intervals[i][1] <= candidate - buffer:
+                    i += 1
+
+                if i < n and intervals[i][0] < candidate + duration + buffer:
+                    # Conflict: jump straight to the first grid point after the block
+                    clear_at = intervals[i][1] + buffer
+                    candidate += -((candidate - clear_at) // step) * step
+                    continue
+
+                slots.append(candidate)
+                if len(slots) >= count:
+                    return slots
+                candidate += step
+
+        first_day += days
+        run *= 2
+
+    return slots
+
+
+def _scan_free_slots(
+    busy: List[Busy],
+    search_from: datetime,
+    hours: BusinessHours,
+    count: int,
+    duration: timedelta,
+    step: timedelta,
+    buffer: timedelta,
+    max_days: int
+) -> List[datetime]:
+    """find_free_slots for a handful of busy blocks: same grid, no sorting."""
+    tz = search_from.tzinfo
+    slots: List[datetime] = []
+    for day_offset in range(max_days):
+        day = search_from.date() + timedelta(days=day_offset)
+        window = hours.get(day.weekday())
+        if not window:
+            continue
+
+        open_dt = datetime.combine(day, window[0], tzinfo=tz)
+        close_dt = datetime.combine(day, window[1], tzinfo=tz)
+        candidate = open_dt
+        if search_from > open_dt:
+            candidate += -((open_dt - search_from) // step) * step
+
+        while candidate + duration <= close_dt:
+            slot_start, slot_end = candidate - buffer, candidate + duration + buffer
+            if not any(b.start < slot_end and b.end > slot_start for b in busy):
+                slots.append(candidate)
+                if len(slots) >= count:
+                    return slots
+            candidate += step
+
+    return slots
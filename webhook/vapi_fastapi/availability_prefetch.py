@@ -0,0 +1,170 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import json
+import logging
+import os
+import time
+import redis.asyncio as redis
+from .redis_pool import RedisFactory
+
+# Produces the slots to offer, or None when a prefetch no longer makes sense
+SlotFetch = Callable[[], Awaitable[Optional[List[Dict[str, Any]]]]]
+
+# Stored in place of the slots once the call ends, so a prefetch still
+# finishing on another worker can't write them back
+ENDED = "ended"
+ENDED_TTL_SECONDS = 600  # Well past any fetch still in flight
+
+# KEYS[1] = prefetch key
+# ARGV = ended marker, entry JSON, ttl
+STORE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+class AvailabilityPrefetcher:
+    """
+    Speculative availability fetches for calls that are still qualifying.
+
+    QUALIFICATION almost always leads to BOOKING, so slots are fetched in
+    the background early in the call and stored against it in Redis. The
+    first BOOKING turn then reads a ready answer (from any worker), or
+    briefly joins the fetch if it is still running on this one.
+    """
+
+    def __init__(self, redis_url: Optional[str] = None, max_age_seconds: Optional[float] = None,
+                 redis_factory: Optional[RedisFactory] = None):
+        """
+        Args:
+            redis_url: Redis connection string
+            max_age_seconds: How long prefetched slots may be offered
+                (defaults to PREFETCH_MAX_AGE, 300)
+            redis_factory: Shared Redis connections (defaults to a private one for redis_url)
+        """
+        self.redis_url = redis_url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.redis_factory = redis_factory or RedisFactory(self.redis_url)
+        self._owns_factory = redis_factory is None
+        self.redis_client: Optional[redis.Redis] = None
+        self._store_script = None
+        self.max_age_seconds = float(max_age_seconds or os.getenv("PREFETCH_MAX_AGE", "300"))
+        self.ttl_seconds = 3600  # Matches call state
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.stats = {"started": 0, "skipped": 0, "served": 0, "missed": 0, "failed": 0, "cancelled": 0}
+
+    async def connect(self):
+        """Initialize Redis connection."""
+        if not self.redis_client:
+            self.redis_client = self.redis_factory.client()
+            self._store_script = self.redis_client.register_script(STORE_SCRIPT)
+
+    async def disconnect(self):
+        """Cancel running prefetches and close Redis connection."""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        self._tasks.clear()
+        if self.redis_client:
+            await self.redis_client.close()
+        if self._owns_factory:
+            await self.redis_factory.close()
+
+    def _get_key(self, call_id: str) -> str:
+        """Redis key naming: vapi:prefetch:{call_id}"""
+        return f"vapi:prefetch:{call_id}"
+
+    async def _load(self, call_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Prefetched slots for the call, if fresh enough to offer."""
+        if not self.redis_client:
+            await self.connect()
+        data = await self.redis_client.get(self._get_key(call_id))
+        if not data or data == ENDED:
+            return None
+        entry = json.loads(data)
+        if time.time() - entry["fetched_at"] > self.max_age_seconds:
+            return None
+        return entry["slots"]
+
+    def start(self, call_id: str, fetch: SlotFetch):
+        """
+        Start a background prefetch for the call unless one is running.
+
+        Returns immediately; a fresh stored result makes the task a no-op.
+        """
+        task = self._tasks.get(call_id)
+        if task and not task.done():
+            return
+
+        task = asyncio.create_task(self._run(call_id, fetch))
+        self._tasks[call_id] = task
+        task.add_done_callback(lambda t: self._tasks.pop(call_id, None) if self._tasks.get(call_id) is t else None)
+
+    async def _run(self, call_id: str, fetch: SlotFetch) -> Optional[List[Dict[str, Any]]]:
+        try:
+            slots = await self._load(call_id)
+            if slots is not None:
+                self.stats["skipped"] += 1
+                return slots
+
+            self.stats["started"] += 1
+            slots = await fetch()
+            if slots is None:
+                return None
+
+            stored = await self._store_script(
+                keys=[self._get_key(call_id)],
+                args=[ENDED, json.dumps({"slots": slots, "fetched_at": time.time()}), self.ttl_seconds]
+            )
+            return slots if stored else None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats["failed"] += 1
+            logging.warning(f"Availability prefetch failed for {call_id}: {e}")
+            return None
+
+    async def get(self, call_id: str, wait: float = 1.0) -> Optional[List[Dict[str, Any]]]:
+        """
+        Prefetched slots for the call, or None to fetch them normally.
+
+        Args:
+            call_id: Vapi call id
+            wait: Seconds to wait for a prefetch still running on this worker
+        """
+        slots = None
+        try:
+            task = self._tasks.get(call_id)
+            if task:
+                try:
+                    slots = await asyncio.wait_for(asyncio.shield(task), wait)
+                except asyncio.TimeoutError:
+                    pass
+            if slots is None:
+                slots = await self._load(call_id)
+        except Exception as e:
+            logging.warning(f"Prefetched availability unavailable for {call_id}: {e}")
+
+        self.stats["served" if slots is not None else "missed"] += 1
+        return slots
+
+    async def cancel(self, call_id: str):
+        """
+        Stop any prefetch for the call and replace its stored result with the
+        ended marker, which a prefetch on another worker won't overwrite.
+        """
+        task = self._tasks.pop(call_id, None)
+        if task and not task.done():
+            task.cancel()
+            self.stats["cancelled"] += 1
+        try:
+            if not self.redis_client:
+                await self.connect()
+            await self.redis_client.set(self._get_key(call_id), ENDED, ex=ENDED_TTL_SECONDS)
+        except Exception as e:
+            logging.warning(f"Prefetch cleanup failed for {call_id}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Prefetch counters for /metrics."""
+        return {"running": len(self._tasks), **self.stats}
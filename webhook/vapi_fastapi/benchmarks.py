@@ -0,0 +1,439 @@
+"""
+Micro-benchmarks for the webhook hot paths.
+
+Usage (from webhook/):
+  python -m vapi_fastapi.benchmarks slots
+  python -m vapi_fastapi.benchmarks batch
+  python -m vapi_fastapi.benchmarks state
+  python -m vapi_fastapi.benchmarks cache
+  python -m vapi_fastapi.benchmarks prompts
+  python -m vapi_fastapi.benchmarks webhook
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Union
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from redis.connection import Connection
+
+from .availability_engine import find_free_slots
+from .state_manager import CallContext, StateManager
+from .prompt_templates import PromptRegistry, PromptTemplate, STATE_PROMPTS
+from .vapi_messages import (
+    decode_webhook, VapiAssistantRequestMessage, VapiToolCallListMessage, VapiEndOfCallReportMessage
+)
+from .timezone_utils import (
+    TimeSlot, get_next_available_slots, get_available_slots_batch, busy_to_epoch_arrays, _first_search_time, ARIZONA_TZ,
+    BUSINESS_HOURS, BUSINESS_START_HOUR, BUSINESS_END_HOUR, SLOT_DURATION_MINUTES, MIN_ADVANCE_MINUTES
+)
+
+# ──────────────────────────────────────────────────────────────────
+# Helpers
+# ──────────────────────────────────────────────────────────────────
+
+def _best_ms(fn: Callable, repeat: int) -> float:
+    """Best wall-clock time of `repeat` runs, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def _random_busy(n: int, density: float = 0.6, horizon_days: int = 14, seed: int = 7) -> List[TimeSlot]:
+    """
+    n busy blocks (heavily overlapping, like a merged agent pool) covering
+    `density` of the 30-minute business-hours grid over the horizon.
+    """
+    rng = random.Random(seed)
+    today = datetime.now(ARIZONA_TZ).replace(hour=BUSINESS_START_HOUR, minute=0, second=0, microsecond=0)
+    cells_per_day = (BUSINESS_END_HOUR - BUSINESS_START_HOUR) * 60 // SLOT_DURATION_MINUTES
+    cells = [
+        today + timedelta(days=day, minutes=cell * SLOT_DURATION_MINUTES)
+        for day in range(horizon_days) for cell in range(cells_per_day)
+    ]
+    busy_cells = rng.sample(cells, int(len(cells) * density))
+
+    blocks: List[TimeSlot] = []
+    for _ in range(n):
+        offset = rng.randrange(SLOT_DURATION_MINUTES - 5)
+        duration = rng.randint(5, SLOT_DURATION_MINUTES - offset)
+        blocks.append(TimeSlot(rng.choice(busy_cells) + timedelta(minutes=offset), duration_minutes=duration))
+    return blocks
+
+# ──────────────────────────────────────────────────────────────────
+# Slot generation
+# ──────────────────────────────────────────────────────────────────
+
+def _legacy_next_available_slots(blocked_times: List[TimeSlot], count: int = 3) -> List[TimeSlot]:
+    """The original O(slots x busy) scan, kept as the comparison baseline."""
+    slots: List[TimeSlot] = []
+    search_time = datetime.now(ARIZONA_TZ) + timedelta(minutes=MIN_ADVANCE_MINUTES)
+
+    if search_time.hour < BUSINESS_START_HOUR:
+        search_time = search_time.replace(hour=BUSINESS_START_HOUR, minute=0)
+    elif search_time.hour >= BUSINESS_END_HOUR:
+        search_time = (search_time + timedelta(days=1)).replace(hour=BUSINESS_START_HOUR, minute=0)
+
+    minute_block = (search_time.minute // SLOT_DURATION_MINUTES) * SLOT_DURATION_MINUTES
+    if search_time.minute % SLOT_DURATION_MINUTES != 0:
+        minute_block += SLOT_DURATION_MINUTES
+    if minute_block >= 60:
+        search_time = search_time.replace(hour=search_time.hour + 1, minute=0, second=0, microsecond=0)
+    else:
+        search_time = search_time.replace(minute=minute_block, second=0, microsecond=0)
+
+    days_searched = 0
+    while len(slots) < count and days_searched < 14:
+        current_slot_time = search_time
+        while current_slot_time.hour < BUSINESS_END_HOUR and len(slots) < count:
+            slot = TimeSlot(current_slot_time)
+            if not any(slot.overlaps(blocked) for blocked in blocked_times):
+                slots.append(slot)
+            current_slot_time += timedelta(minutes=SLOT_DURATION_MINUTES)
+        search_time = (search_time + timedelta(days=1)).replace(hour=BUSINESS_START_HOUR, minute=0)
+        days_searched += 1
+    return slots
+
+
+def bench_slots(args):
+    """Legacy scan vs. sweep for a 3-slot offer and a longer slot listing."""
+    print(f"{'busy blocks':>12} {'slots':>6} {'legacy ms':>11} {'sweep ms':>10} {'speedup':>9}  same result")
+    for n in (10, 100, 1_000, 100_000):
+        for count in (3, 40):
+            busy = _random_busy(n, density=args.density)
+            legacy_repeat = 1 if n >= 100_000 else args.repeat
+
+            legacy = _legacy_next_available_slots(busy, count)
+            sweep = get_next_available_slots(busy, count)
+            same = [s.start for s in legacy] == [s.start for s in sweep]
+
+            legacy_ms = _best_ms(lambda: _legacy_next_available_slots(busy, count), legacy_repeat)
+            sweep_ms = _best_ms(lambda: get_next_available_slots(busy, count), args.repeat)
+            print(f"{n:>12,} {count:>6} {legacy_ms:>11.2f} {sweep_ms:>10.2f} {legacy_ms / sweep_ms:>8.1f}x  {same}")
+
+def bench_batch(args):
+    """First 3 slots for 200 agents over 60 days: per-agent sweep vs. NumPy batch."""
+    agents, days = 200, 60
+    busy_by_agent = {
+        f"agent{i}@example.com": _random_busy(args.blocks, density=args.density, horizon_days=days, seed=i)
+        for i in range(agents)
+    }
+    # Same blocks as epoch arrays (busy_to_epoch_arrays), for callers that
+    # convert once and reuse them; block lists take the per-agent sweep
+    arrays_by_agent = {agent: busy_to_epoch_arrays(busy) for agent, busy in busy_by_agent.items()}
+
+    def per_agent():
+        search_from = _first_search_time()
+        return {
+            agent: find_free_slots(busy, search_from, BUSINESS_HOURS, count=3, max_days=days)
+            for agent, busy in busy_by_agent.items()
+        }
+
+    expected = per_agent()
+    print(f"{agents} agents x {days} days, {args.blocks} busy blocks each, density {args.density}")
+    loop_ms = _best_ms(per_agent, args.repeat)
+    print(f"  per-agent sweep:        {loop_ms:8.2f} ms")
+
+    for label, busy in (("batch from blocks", busy_by_agent), ("batch from arrays", arrays_by_agent)):
+        same = all(
+            [slot.start for slot in slots] == expected[agent]
+            for agent, slots in get_available_slots_batch(busy, count=3, days=days).items()
+        )
+        batch_ms = _best_ms(lambda: get_available_slots_batch(busy, count=3, days=days), args.repeat)
+        print(f"  {label + ':':<23} {batch_ms:8.2f} ms  ({loop_ms / batch_ms:.1f}x, same result: {same})")
+
+# ──────────────────────────────────────────────────────────────────
+# Call state storage
+# ──────────────────────────────────────────────────────────────────
+
+def _resp_bytes(value: Any) -> int:
+    """Size of a RESP2 reply as Redis would write it."""
+    if isinstance(value, list):
+        return len(f"*{len(value)}\r\n") + sum(_resp_bytes(v) for v in value)
+    if isinstance(value, int):
+        return len(f":{value}\r\n")
+    data = str(value).encode()
+    return len(f"${len(data)}\r\n") + len(data) + 2
+
+
+def _lead_context(turns: int) -> dict:
+    """Qualification answers plus a transcript and interests that grow per turn."""
+    return {
+        "budget": 450000,
+        "timeline": "3 months",
+        "property_type": "house",
+        "location": "Scottsdale",
+        "transcript": [
+            {"role": "user" if i % 2 else "assistant", "text": "Could we look at something with a pool near good schools? " * 2}
+            for i in range(turns)
+        ],
+        "property_interests": [{"mls": f"6{i:06d}", "price": 400000 + i * 5000} for i in range(turns // 4)],
+    }
+
+
+def bench_state(args):
+    """Bytes on the wire for one transition: JSON document vs. hash fields."""
+    manager = StateManager(storage="json")
+    conn = Connection()
+    sha = "0" * 40
+    update = {"qualified": True}
+    now = datetime.utcnow().isoformat()
+
+    print(f"{'turns':>6} {'ctx bytes':>10} {'json bytes':>11} {'hash bytes':>11} {'saving':>8}")
+    for turns in (0, 10, 50, 200):
+        context = _lead_context(turns)
+        doc = CallContext(state="BOOKING", context={**context, **update}, timestamp=now, last_activity=now)
+
+        # JSON mode reads and rewrites the whole document under WATCH
+        key = manager._get_key("call")
+        json_request = [
+            chunk
+            for command in (
+                ("WATCH", key), ("GET", key), ("MULTI",),
+                ("SET", key, doc.model_dump_json(), "EX", manager.ttl_seconds), ("EXEC",),
+            )
+            for chunk in conn.pack_command(*command)
+        ]
+        json_reply = ["OK", doc.model_dump_json(), "OK", "QUEUED", ["OK"]]
+
+        # Hash mode reads back only what the BOOKING prompt renders
+        fields = ["budget", "timeline"]
+        hash_request = conn.pack_command(
+            "EVALSHA", sha, 2, *manager._hash_keys("call"), manager._TRANSITIONS_JSON,
+            json.dumps([{"state": "BOOKING", "fields": manager._context_fields(update)}]),
+            now, manager.ttl_seconds, manager._field_names(fields)
+        )
+        pairs = ["state", "BOOKING", "timestamp", now, "last_activity", now]
+        for key in fields:
+            pairs += ["ctx:" + key, json.dumps(context[key])]
+        hash_reply = [1, pairs]
+
+        context_bytes = len(json.dumps(context, separators=(",", ":")))
+        json_total = sum(len(chunk) for chunk in json_request) + _resp_bytes(json_reply)
+        hash_total = sum(len(chunk) for chunk in hash_request) + _resp_bytes(hash_reply)
+        print(
+            f"{turns:>6} {context_bytes:>10,} {json_total:>11,} {hash_total:>11,}"
+            f" {json_total / hash_total:>7.1f}x"
+        )
+
+
+class _GlobalGenerationManager(StateManager):
+    """The original single invalidation counter, kept as the comparison baseline."""
+
+    def _local_token(self, call_id):
+        return self._epoch, 0
+
+    def _local_invalidate(self, call_id):
+        self._epoch += 1
+        return self._local.pop(call_id, None) is not None
+
+
+def _poisson(rng: random.Random, mean: float) -> int:
+    """Poisson-distributed count (Knuth), for writes arriving during one read."""
+    limit, count, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def bench_cache(args):
+    """
+    Local state cache hit rate while other workers write other calls.
+
+    Each turn reads its call three times (get_state, get_fields, the prompt)
+    and then writes it. Meanwhile writes to random active calls arrive at the
+    given mean per read; any that land while a miss is being filled from
+    Redis decide whether the fill may be cached. The best possible rate is
+    2/3, since the turn's first read follows its own last write.
+    """
+    calls = [f"call-{i}" for i in range(args.calls)]
+    now = datetime.utcnow().isoformat()
+    ctx = CallContext(state="BOOKING", context=_lead_context(10), timestamp=now, last_activity=now)
+    reads_per_turn, turns = 3, 5000
+
+    print(f"{args.calls} active calls, {turns:,} turns")
+    print(f"{'writes/read':>12} {'global':>8} {'per-call':>9}")
+    for rate in (0, 0.25, 1, 4, 16):
+        rates = []
+        for cls in (_GlobalGenerationManager, StateManager):
+            rng = random.Random(7)
+            manager = cls(storage="hash", local_cache_size=len(calls))
+            manager._tracking = True  # Driven directly, as the tracking loop would
+            for _ in range(turns):
+                call_id = rng.choice(calls)
+                for _ in range(reads_per_turn):
+                    cached = manager._local_get(call_id)
+                    token = manager._local_token(call_id)
+                    for _ in range(_poisson(rng, rate)):
+                        manager._local_invalidate(rng.choice(calls))
+                    if not cached:
+                        manager._local_put(call_id, ctx, token)
+                manager._local_evict(call_id)
+            stats = manager.cache_stats
+            rates.append(stats["hits"] / (stats["hits"] + stats["misses"]))
+        print(f"{rate:>12} {rates[0]:>8.1%} {rates[1]:>9.1%}")
+
+# ──────────────────────────────────────────────────────────────────
+# Prompt rendering
+# ──────────────────────────────────────────────────────────────────
+
+def _legacy_render(template: str, context: dict) -> str:
+    """The original replace-per-key rendering, kept as the comparison baseline."""
+    prompt = template.replace("{{CONTEXT}}", json.dumps(context))
+    for key, value in context.items():
+        placeholder = f"{{{{{key}}}}}"
+        if placeholder in prompt:
+            prompt = prompt.replace(placeholder, str(value))
+    return prompt
+
+
+def bench_prompts(args):
+    """Replace loop vs. compiled template vs. the memoizing registry, per render."""
+    registry = PromptRegistry(STATE_PROMPTS)
+    renders = 1_000
+
+    def per_render_us(fn) -> float:
+        return _best_ms(lambda: [fn() for _ in range(renders)], args.repeat) * 1000 / renders
+
+    async def registry_us(state: str, context: dict, context_key=None) -> float:
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for _ in range(renders):
+                await registry.render(state, context, context_key=context_key)
+            best = min(best, time.perf_counter() - start)
+        return best * 1e6 / renders
+
+    print(
+        f"{'state':>13} {'turns':>6} {'legacy us':>10} {'compiled us':>12}"
+        f" {'registry us':>12} {'versioned us':>13}  same result"
+    )
+    for state in ("BOOKING", "CONFIRMATION"):
+        source = STATE_PROMPTS[state]
+        template = PromptTemplate(source)
+        for turns in (0, 50, 200):
+            context = {**_lead_context(turns), "selected_time": "Tuesday 3pm"}
+            same = _legacy_render(source, context) == template.render(context)
+
+            legacy_us = per_render_us(lambda: _legacy_render(source, context))
+            compiled_us = per_render_us(lambda: template.render(context))
+            # Registry: memo keyed by a context hash, or by a cheap version key
+            hashed_us = asyncio.run(registry_us(state, context))
+            versioned_us = asyncio.run(registry_us(state, context, ("call", turns)))
+            print(
+                f"{state:>13} {turns:>6} {legacy_us:>10.1f} {compiled_us:>12.1f}"
+                f" {hashed_us:>12.1f} {versioned_us:>13.1f}  {same}"
+            )
+
+# ──────────────────────────────────────────────────────────────────
+# Webhook decoding
+# ──────────────────────────────────────────────────────────────────
+
+class _LegacyWebhookRequest(BaseModel):
+    """The old whole-body union (without the discriminator it could not declare)."""
+    message: Union[
+        VapiAssistantRequestMessage,
+        VapiToolCallListMessage,
+        VapiEndOfCallReportMessage,
+        Dict[str, Any]
+    ]
+
+
+def _end_of_call_payload(target_kb: int = 200, seed: int = 7) -> bytes:
+    """An end-of-call-report shaped like Vapi's, padded with turns to ~target_kb."""
+    rng = random.Random(seed)
+    words = "budget timeline scottsdale pool schools condo house tuesday showing mortgage".split()
+    messages, transcript = [], []
+    elapsed = 0.0
+    while len(" ".join(transcript)) < target_kb * 180:
+        role = "user" if len(messages) % 2 else "bot"
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(8, 30)))
+        elapsed += rng.uniform(1, 6)
+        messages.append({
+            "role": role, "message": text, "time": 1_700_000_000_000 + int(elapsed * 1000),
+            "endTime": 1_700_000_000_000 + int(elapsed * 1000) + 900,
+            "secondsFromStart": round(elapsed, 2), "duration": 900, "source": "",
+        })
+        transcript.append(f"{'User' if role == 'user' else 'AI'}: {text}")
+
+    return orjson.dumps({
+        "message": {
+            "type": "end-of-call-report",
+            "endedReason": "customer-ended-call",
+            "call": {"id": "3f0c6c2e-5f42-4c8e-9d4c-2b0d3c1e7a10", "orgId": "org-1", "type": "inboundPhoneCall"},
+            "transcript": "\n".join(transcript),
+            "summary": "Lead qualified; showing booked for Tuesday 3pm.",
+            "messages": messages,
+            "analysis": {"summary": "Qualified lead", "successEvaluation": "true", "structuredData": {"budget": 450000}},
+            "artifact": {"messages": messages, "transcript": "\n".join(transcript)},
+            "recordingUrl": "https://storage.vapi.ai/recording.wav",
+            "durationSeconds": round(elapsed, 1),
+        }
+    })
+
+
+def bench_webhook(args):
+    """Legacy json + full-union Pydantic vs. lazy orjson decode for end-of-call reports."""
+    body = _end_of_call_payload()
+    requests = 500
+
+    def legacy():
+        request = _LegacyWebhookRequest.model_validate(json.loads(body))
+        if isinstance(request.message, VapiEndOfCallReportMessage):
+            return json.dumps(jsonable_encoder({"status": "processed"})).encode()
+
+    def fast():
+        if isinstance(decode_webhook(body), VapiEndOfCallReportMessage):
+            return orjson.dumps({"status": "processed"})
+
+    print(f"end-of-call-report body: {len(body) / 1024:.0f} KB, {requests} requests each")
+    print(f"{'path':>8} {'p50 ms':>8} {'p99 ms':>8} {'cpu ms/req':>11}")
+    for label, fn in (("legacy", legacy), ("orjson", fast)):
+        assert fn() is not None
+        samples = []
+        cpu_start = time.process_time()
+        for _ in range(requests):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        cpu_ms = (time.process_time() - cpu_start) * 1000 / requests
+        samples.sort()
+        p50, p99 = samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+        print(f"{label:>8} {p50:>8.2f} {p99:>8.2f} {cpu_ms:>11.2f}")
+
+# ──────────────────────────────────────────────────────────────────
+# Main
+# ──────────────────────────────────────────────────────────────────
+
+BENCHMARKS = {
+    "slots": bench_slots,
+    "batch": bench_batch,
+    "state": bench_state,
+    "cache": bench_cache,
+    "prompts": bench_prompts,
+    "webhook": bench_webhook,
+}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--density", type=float, default=0.6, help="Share of slots busy (slots, batch)")
+    parser.add_argument("--blocks", type=int, default=400, help="Busy blocks per agent (batch)")
+    parser.add_argument("--calls", type=int, default=200, help="Active calls (cache)")
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args)
+
+if __name__ == "__main__":
+    main()
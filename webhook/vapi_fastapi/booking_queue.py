@@ -0,0 +1,294 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+import redis.asyncio as redis
+from redis.exceptions import ResponseError
+from .slot_manager import SlotManager
+from .redis_pool import RedisFactory
+
+# write(booking, event_id) -> calendar event id. Must be idempotent for a
+# given event_id; an exception with retryable=False fails the booking at once.
+BookingWrite = Callable[[Dict[str, Any], str], Awaitable[str]]
+
+BOOKING_STREAM = "vapi:bookings"
+BOOKING_GROUP = "booking-workers"
+
+QUEUED, CONFIRMED, FAILED = "queued", "confirmed", "failed"
+
+# Record the booking and queue it in one step, unless call_id+slot was already
+# queued (a failed one is queued again). KEYS[1] = booking hash, KEYS[2] = stream
+# ARGV[1] = booking_id, ARGV[2] = payload JSON, ARGV[3] = record TTL, ARGV[4] = now
+ENQUEUE_SCRIPT = """
+local status = redis.call('HGET', KEYS[1], 'status')
+if status and status ~= 'failed' then
+    return {0, status, redis.call('HGET', KEYS[1], 'event_id') or ''}
+end
+redis.call('HDEL', KEYS[1], 'error', 'event_id')
+redis.call('HSET', KEYS[1], 'status', 'queued', 'payload', ARGV[2], 'attempts', 0, 'updated_at', ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('XADD', KEYS[2], '*', 'booking_id', ARGV[1])
+return {1, 'queued', ''}
+"""
+
+
+class BookingHoldLost(Exception):
+    """The slot hold lapsed, so the slot may already belong to someone else."""
+    retryable = False
+
+
+class BookingQueue:
+    """
+    Durable calendar writes for bookings whose slot hold is already secured.
+
+    The caller hears back as soon as the booking is queued on a Redis stream;
+    a consumer-group worker on every replica then writes the event. The hold
+    is kept alive until the event is confirmed and only then released. A
+    failed write stays pending on the stream and is reclaimed for another
+    attempt (on any worker) after RETRY_IDLE_MS; a permanent failure releases
+    the hold and marks the booking failed.
+
+    Settled entries are acked and deleted together, so the stream only ever
+    holds bookings still waiting for a write.
+
+    Retries are idempotent: the booking id is derived from call_id and slot,
+    and doubles as the Google event id, so a repeated write finds the event
+    it already created instead of adding a second one.
+    """
+
+    RETRY_IDLE_MS = 20000  # Unacked entries older than this are retried
+    BLOCK_MS = 5000
+    BATCH_SIZE = 10
+
+    def __init__(
+        self,
+        slot_manager: SlotManager,
+        write: BookingWrite,
+        redis_url: Optional[str] = None,
+        max_attempts: Optional[int] = None,
+        redis_factory: Optional[RedisFactory] = None
+    ):
+        """
+        Args:
+            slot_manager: Holds the slots being booked
+            write: Coroutine creating the calendar event
+            redis_url: Redis connection string
+            max_attempts: Writes tried before giving up (defaults to BOOKING_MAX_ATTEMPTS, 5)
+            redis_factory: Shared Redis connections (defaults to a private one for redis_url)
+        """
+        self.slot_manager = slot_manager
+        self.write = write
+        self.redis_url = redis_url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.redis_factory = redis_factory or RedisFactory(self.redis_url)
+        self._owns_factory = redis_factory is None
+        self.redis_client: Optional[redis.Redis] = None
+        self.max_attempts = int(max_attempts or os.getenv("BOOKING_MAX_ATTEMPTS", "5"))
+        self.write_timeout = 15.0
+        # Hold lifetime while queued or being written; renewed every attempt
+        self.hold_seconds = 120
+        self.ttl_seconds = 86400  # Booking records outlive the call for status lookups
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._worker_task: Optional[asyncio.Task] = None
+        self._blocking_client: Optional[redis.Redis] = None
+        self._enqueue = None
+        self.stats = {"queued": 0, "duplicates": 0, "confirmed": 0, "retried": 0, "reclaimed": 0, "failed": 0}
+
+    async def connect(self):
+        """Initialize Redis connection and the stream's consumer group."""
+        if not self.redis_client:
+            self.redis_client = self.redis_factory.client()
+            # XREADGROUP BLOCK idles on a connection, so it gets one without a read timeout
+            self._blocking_client = self.redis_factory.client(subscriber=True)
+            self._enqueue = self.redis_client.register_script(ENQUEUE_SCRIPT)
+            try:
+                await self.redis_client.xgroup_create(BOOKING_STREAM, BOOKING_GROUP, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def disconnect(self):
+        """Stop the worker and close Redis connection (unacked bookings stay queued)."""
+        await self.stop_worker()
+        if self._blocking_client:
+            await self._blocking_client.close()
+        if self.redis_client:
+            await self.redis_client.close()
+        if self._owns_factory:
+            await self.redis_factory.close()
+
+    def start_worker(self):
+        """Start consuming bookings in the background."""
+        if not self._worker_task or self._worker_task.done():
+            self._worker_task = asyncio.create_task(self._work())
+
+    async def stop_worker(self):
+        if self._worker_task:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+
+    @staticmethod
+    def booking_id(call_id: str, slot_id: str) -> str:
+        """
+        Stable id for a call's booking of a slot.
+
+        Hex digits are valid base32hex, so this is also the Google event id.
+        """
+        return hashlib.sha1(f"{call_id}|{slot_id}".encode()).hexdigest()
+
+    def _get_key(self, booking_id: str) -> str:
+        """Redis key naming: vapi:booking:{booking_id}"""
+        return f"vapi:booking:{booking_id}"
+
+    async def enqueue(self, booking: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Queue the calendar write for a held slot.
+
+        Args:
+            booking: Must include call_id, slot_id and hold_id; the rest is
+                passed to write()
+
+        Returns:
+            (queued, record): queued is False when call_id+slot was already
+            queued, in which case record is the existing booking's status
+        """
+        if not self.redis_client:
+            await self.connect()
+
+        booking_id = self.booking_id(booking["call_id"], booking["slot_id"])
+        # Cover the time spent waiting in the queue
+        await self._keep_hold(booking)
+
+        created, status, event_id = await self._enqueue(
+            keys=[self._get_key(booking_id), BOOKING_STREAM],
+            args=[booking_id, json.dumps(booking), self.ttl_seconds, time.time()]
+        )
+        self.stats["queued" if created else "duplicates"] += 1
+        return bool(created), {"booking_id": booking_id, "status": status, "event_id": event_id or None}
+
+    async def get(self, booking_id: str) -> Optional[Dict[str, Any]]:
+        """Status of a booking, or None if unknown or expired."""
+        if not self.redis_client:
+            await self.connect()
+        record = await self.redis_client.hmget(
+            self._get_key(booking_id), "status", "event_id", "error", "attempts"
+        )
+        if record[0] is None:
+            return None
+        status, event_id, error, attempts = record
+        return {
+            "booking_id": booking_id,
+            "status": status,
+            "event_id": event_id,
+            "error": error,
+            "attempts": int(attempts or 0),
+        }
+
+    async def _keep_hold(self, booking: Dict[str, Any]):
+        """
+        Extend the booking's hold. Raises BookingHoldLost only when Redis says
+        the hold is gone; a Redis error propagates and the attempt is retried.
+        """
+        if not await self.slot_manager.extend_hold(
+            booking["slot_id"], booking["hold_id"],
+            extra_seconds=self.hold_seconds, max_extend_seconds=self.hold_seconds
+        ):
+            raise BookingHoldLost("Slot hold expired before the event was written")
+
+    async def _work(self):
+        """Consume new bookings, then any left unacked by failed or crashed attempts."""
+        while True:
+            try:
+                entries = await self._reclaim()
+                if entries:
+                    self.stats["reclaimed"] += len(entries)
+                else:
+                    streams = await self._blocking_client.xreadgroup(
+                        BOOKING_GROUP, self.consumer, {BOOKING_STREAM: ">"},
+                        count=self.BATCH_SIZE, block=self.BLOCK_MS
+                    )
+                    entries = streams[0][1] if streams else []
+                await asyncio.gather(*[
+                    self._process(entry_id, fields.get("booking_id")) for entry_id, fields in entries
+                ])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Booking worker error, retrying: {e}")
+                await asyncio.sleep(1)
+
+    async def _reclaim(self) -> List[Tuple[str, Dict[str, str]]]:
+        result = await self.redis_client.xautoclaim(
+            BOOKING_STREAM, BOOKING_GROUP, self.consumer,
+            min_idle_time=self.RETRY_IDLE_MS, start_id="0-0", count=self.BATCH_SIZE
+        )
+        # Skip entries deleted while still pending (only by hand: _ack deletes
+        # an entry together with its ack)
+        return [entry for entry in result[1] if entry[1]]
+
+    async def _ack(self, entry_id: str):
+        """Settle a stream entry: ack it and delete it so the stream stays bounded."""
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.xack(BOOKING_STREAM, BOOKING_GROUP, entry_id)
+            pipe.xdel(BOOKING_STREAM, entry_id)
+            await pipe.execute()
+
+    async def _process(self, entry_id: str, booking_id: Optional[str]):
+        key = self._get_key(booking_id or "")
+        record = await self.redis_client.hgetall(key)
+        if record.get("status") != QUEUED:
+            # Already settled (or expired): a redelivery after the worker crashed
+            await self._ack(entry_id)
+            return
+
+        booking = json.loads(record["payload"])
+        attempts = await self.redis_client.hincrby(key, "attempts", 1)
+        if attempts > 1:
+            self.stats["retried"] += 1
+
+        try:
+            await self._keep_hold(booking)
+            event_id = await asyncio.wait_for(self.write(booking, booking_id), self.write_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            retryable = getattr(e, "retryable", True)
+            if retryable and attempts < self.max_attempts:
+                # Left pending: reclaimed and retried after RETRY_IDLE_MS
+                logging.warning(f"Booking {booking_id} attempt {attempts} failed, will retry: {e}")
+                await self.redis_client.hset(key, mapping={"error": str(e), "updated_at": time.time()})
+                return
+            await self._compensate(entry_id, booking_id, booking, e)
+            return
+
+        await self.redis_client.hset(key, mapping={
+            "status": CONFIRMED, "event_id": event_id, "error": "", "updated_at": time.time()
+        })
+        await self.slot_manager.release_hold(booking["slot_id"], booking["hold_id"])
+        await self._ack(entry_id)
+        self.stats["confirmed"] += 1
+
+    async def _compensate(self, entry_id: str, booking_id: str, booking: Dict[str, Any], error: Exception):
+        """Give the slot back and record why the booking could not be made."""
+        logging.error(f"Booking {booking_id} failed permanently: {error}")
+        await self.redis_client.hset(self._get_key(booking_id), mapping={
+            "status": FAILED, "error": str(error), "updated_at": time.time()
+        })
+        await self.slot_manager.release_hold(booking["slot_id"], booking["hold_id"])
+        await self._ack(entry_id)
+        self.stats["failed"] += 1
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Pipeline counters plus the stream backlog for /metrics."""
+        try:
+            pending = (await self.redis_client.xpending(BOOKING_STREAM, BOOKING_GROUP))["pending"]
+        except Exception:
+            pending = None
+        return {"pending": pending, **self.stats}
@@ -1,16 +1,30 @@
 from datetime import datetime, timedelta, timezone as dt_timezone
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
+import asyncio
 import json
+import logging
 import os
 import aiohttp
-from google.oauth2 import service_account
-from google.auth.transport.requests import Request
 from dataclasses import dataclass
+from .token_manager import TokenManager
+from .redis_pool import RedisFactory
 
 # Constants
 GOOGLE_CALENDAR_API = "https://www.googleapis.com/calendar/v3"
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
-TOKEN_CACHE_FILE = "/tmp/google_calendar_token.json"
+FREEBUSY_MAX_CALENDARS = 50  # Google's per-request limit for freebusy items
+
+class CalendarAPIError(Exception):
+    """Google Calendar API returned an error status."""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self) -> bool:
+        """Rate limits and server errors are worth retrying; other 4xx are not."""
+        return self.status == 429 or self.status >= 500
 
 @dataclass
 class FreeBusyBlock:
@@ -25,37 +39,40 @@ class GoogleCalendarClient:
     Async Google Calendar API client with token caching and batch queries.
     """
     
-    def __init__(self, credentials_json_path: str, agent_email: str):
+    def __init__(
+        self,
+        credentials_json_path: str,
+        agent_email: str,
+        cache: Optional[Any] = None,
+        redis_url: Optional[str] = None,
+        calendars: Optional[List[str]] = None,
+        redis_factory: Optional[RedisFactory] = None
+    ):
+        """
+        Args:
+            credentials_json_path: Service account key file
+            agent_email: Default calendar to query and book into
+            cache: Optional AvailabilityCache shared across workers
+            redis_url: Optional Redis for sharing the access token across workers
+            calendars: Agent pool for multi-calendar queries (defaults to agent_email)
+            redis_factory: Shared Redis connections for the token (instead of redis_url)
+        """
         self.credentials_path = credentials_json_path
         self.agent_email = agent_email
-        self.token: Optional[str] = None
-        self.token_expiry: Optional[datetime] = None
+        self.calendars = calendars or [agent_email]
+        self.cache = cache
+        self.token_manager = TokenManager(
+            credentials_json_path, SCOPES, redis_url=redis_url, redis_factory=redis_factory
+        )
         self._session: Optional[aiohttp.ClientSession] = None
     
     async def _get_valid_token(self) -> str:
-        """Get valid OAuth2 access token (cached when possible)."""
-        now = datetime.now(dt_timezone.utc)
-        
-        # Check in-memory cache
-        if self.token and self.token_expiry and now < self.token_expiry:
-            return self.token
-        
-        # Check file cache logic skipped for brevity, standard implementation
-        
-        # Fetch new token (Synchronous call wrapped in async if needed, but google-auth is blocking)
-        # In high-concurrency, consider running this in an executor
-        try:
-            creds = service_account.Credentials.from_service_account_file(
-                self.credentials_path, scopes=SCOPES
-            )
-            creds.refresh(Request())
-            
-            self.token = creds.token
-            self.token_expiry = creds.expiry
-            return self.token
-        except Exception as e:
-             raise Exception(f"Failed to refresh Google Auth token: {str(e)}")
+        """Get valid OAuth2 access token (refreshed off the event loop)."""
+        return await self.token_manager.get_token()
 
+    async def warm_up(self):
+        """Fetch the first token at startup so no request waits on it."""
+        await self.token_manager.start()
     
     async def _get_session(self) -> aiohttp.ClientSession:
         """Get or create async HTTP session with connection pooling."""
@@ -70,16 +87,76 @@ class GoogleCalendarClient:
         timezone: str = "America/Phoenix"
     ) -> List[FreeBusyBlock]:
         """
-        Get free/busy blocks for agent's calendar.
+        Get free/busy blocks for agent's calendar (served from cache when possible).
+        """
+        if self.cache:
+            return await self.cache.get_or_fetch(
+                self.agent_email,
+                start_date,
+                end_date,
+                lambda: self._fetch_freebusy(start_date, end_date, timezone)
+            )
+        return await self._fetch_freebusy(start_date, end_date, timezone)
+
+    async def _fetch_freebusy(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        timezone: str
+    ) -> List[FreeBusyBlock]:
+        """Query the freebusy API directly for the agent's calendar."""
+        busy_by_calendar = await self._fetch_freebusy_batch([self.agent_email], start_date, end_date, timezone)
+        return busy_by_calendar.get(self.agent_email, [])
+
+    async def get_availability_multi(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        calendars: Optional[List[str]] = None,
+        timezone: str = "America/Phoenix"
+    ) -> Dict[str, List[FreeBusyBlock]]:
+        """
+        Get free/busy blocks for many calendars at once.
+
+        Cached calendars are served from Redis and misses share the cache's
+        single-flight with every other lookup (see AvailabilityCache); the
+        rest are split into freebusy requests of FREEBUSY_MAX_CALENDARS issued
+        concurrently. Calendars Google reports errors for are left out of the result.
         """
+        calendars = list(dict.fromkeys(calendars or self.calendars))
+
+        async def fetch(missing: List[str]) -> Dict[str, List[FreeBusyBlock]]:
+            batches = [
+                missing[i:i + FREEBUSY_MAX_CALENDARS]
+                for i in range(0, len(missing), FREEBUSY_MAX_CALENDARS)
+            ]
+            results = await asyncio.gather(*[
+                self._fetch_freebusy_batch(batch, start_date, end_date, timezone)
+                for batch in batches
+            ])
+            return {c: blocks for result in results for c, blocks in result.items()}
+
+        if self.cache:
+            return await self.cache.get_many_or_fetch(calendars, start_date, end_date, fetch)
+        return await fetch(calendars)
+
+    async def _fetch_freebusy_batch(
+        self,
+        calendars: List[str],
+        start_date: datetime,
+        end_date: datetime,
+        timezone: str
+    ) -> Dict[str, List[FreeBusyBlock]]:
+        """One freebusy POST for up to FREEBUSY_MAX_CALENDARS calendars."""
         token = await self._get_valid_token()
         session = await self._get_session()
         
         request_body = {
-            "items": [{"id": self.agent_email}],
+            "items": [{"id": calendar_id} for calendar_id in calendars],
             "timeMin": start_date.isoformat(),
             "timeMax": end_date.isoformat(),
             "timeZone": timezone,
+            "calendarExpansionMax": len(calendars),
         }
         
         headers = {
@@ -98,10 +175,16 @@ class GoogleCalendarClient:
             
             data = await resp.json()
             
-            # Extract busy blocks
+        # Extract busy blocks per calendar
+        busy_by_calendar: Dict[str, List[FreeBusyBlock]] = {}
+        for calendar_id in calendars:
+            calendar_data = data.get("calendars", {}).get(calendar_id, {})
+
+            if calendar_data.get("errors"):
+                logging.warning(f"Free/busy unavailable for {calendar_id}: {calendar_data['errors']}")
+                continue
+
             busy_blocks: List[FreeBusyBlock] = []
-            calendar_data = data.get("calendars", {}).get(self.agent_email, {})
-            
             for busy_period in calendar_data.get("busy", []):
                 start_str = busy_period.get("start")
                 end_str = busy_period.get("end")
@@ -111,8 +194,9 @@ class GoogleCalendarClient:
                         start=datetime.fromisoformat(start_str),
                         end=datetime.fromisoformat(end_str),
                     ))
+            busy_by_calendar[calendar_id] = busy_blocks
             
-            return busy_blocks
+        return busy_by_calendar
     
     async def create_event(
         self,
@@ -121,11 +205,19 @@ class GoogleCalendarClient:
         end: datetime,
         attendees: List[str],
         description: str = "",
-        timezone: str = "America/Phoenix"
+        timezone: str = "America/Phoenix",
+        calendar_id: Optional[str] = None,
+        event_id: Optional[str] = None
     ) -> str:
         """
-        Create calendar event.
+        Create calendar event (on calendar_id, defaulting to the agent's calendar).
+
+        With an event_id (base32hex, 5-1024 chars) the create is idempotent:
+        a retry that finds the event already exists returns the same id. An
+        existing event that was since cancelled (deleted) raises instead, as
+        Google never lets its id be reused.
         """
+        calendar_id = calendar_id or self.agent_email
         token = await self._get_valid_token()
         session = await self._get_session()
         
@@ -142,6 +234,8 @@ class GoogleCalendarClient:
             "attendees": [{"email": email} for email in attendees],
             "description": description,
         }
+        if event_id:
+            event_body["id"] = event_id
         
         headers = {
             "Authorization": f"Bearer {token}",
@@ -149,19 +243,36 @@ class GoogleCalendarClient:
         }
         
         async with session.post(
-            f"{GOOGLE_CALENDAR_API}/calendars/{self.agent_email}/events",
+            f"{GOOGLE_CALENDAR_API}/calendars/{calendar_id}/events",
             json=event_body,
             headers=headers
         ) as resp:
-            if resp.status not in [200, 201]:
+            conflict = bool(event_id) and resp.status == 409
+            if not conflict and resp.status not in [200, 201]:
                 text = await resp.text()
-                raise Exception(f"Event creation failed {resp.status}: {text}")
-            
-            data = await resp.json()
-            return data["id"]
+                raise CalendarAPIError(f"Event creation failed {resp.status}: {text}", resp.status)
+            data = None if conflict else await resp.json()
+
+        if conflict:
+            # Created by an earlier attempt, unless that event was cancelled since
+            async with session.get(
+                f"{GOOGLE_CALENDAR_API}/calendars/{calendar_id}/events/{event_id}",
+                headers=headers
+            ) as resp:
+                if resp.status != 200:
+                    text = await resp.text()
+                    raise CalendarAPIError(f"Existing event lookup failed {resp.status}: {text}", resp.status)
+                data = await resp.json()
+            if data.get("status") == "cancelled":
+                raise CalendarAPIError(f"Event {event_id} already exists and was cancelled", 409)
+
+        if self.cache:
+            await self.cache.invalidate(calendar_id)
+        return data["id"]
     
-    async def delete_event(self, event_id: str) -> None:
+    async def delete_event(self, event_id: str, calendar_id: Optional[str] = None) -> None:
         """Delete calendar event."""
+        calendar_id = calendar_id or self.agent_email
         token = await self._get_valid_token()
         session = await self._get_session()
         
@@ -170,13 +281,17 @@ class GoogleCalendarClient:
         }
         
         async with session.delete(
-            f"{GOOGLE_CALENDAR_API}/calendars/{self.agent_email}/events/{event_id}",
+            f"{GOOGLE_CALENDAR_API}/calendars/{calendar_id}/events/{event_id}",
             headers=headers
         ) as resp:
             if resp.status not in [200, 204, 404]:
                 raise Exception(f"Delete failed: {resp.status}")
 
+        if self.cache:
+            await self.cache.invalidate(calendar_id)
+
     async def close(self):
-        """Close session."""
+        """Close session and stop token renewal."""
+        await self.token_manager.close()
         if self._session:
             await self._session.close()
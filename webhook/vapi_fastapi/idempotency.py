@@ -0,0 +1,169 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import json
+import logging
+import os
+import redis.asyncio as redis
+from .redis_pool import RedisFactory
+
+PENDING = "pending"
+
+# Drop a stored result, but never another request's pending claim
+# KEYS[1] = idempotency key; ARGV[1] = pending status
+FORGET_SCRIPT = """
+local data = redis.call('GET', KEYS[1])
+if data and cjson.decode(data).status ~= ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class IdempotencyStore:
+    """
+    Runs an operation once per key, however many times the request is retried.
+
+    The first request claims the key in Redis (SET NX) as pending, runs the
+    operation and stores its result under the key. Duplicates, on any worker,
+    wait for that result instead of running the operation again. Only
+    successful results are kept; a failure frees the key so a retry can try
+    again. A pending claim expires on its own if its worker dies.
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        ttl_seconds: Optional[int] = None,
+        wait_seconds: float = 10.0,
+        redis_factory: Optional[RedisFactory] = None
+    ):
+        """
+        Args:
+            redis_url: Redis connection string
+            ttl_seconds: How long results are replayed (defaults to IDEMPOTENCY_TTL, 3600)
+            wait_seconds: How long a duplicate waits for an in-flight result
+            redis_factory: Shared Redis connections (defaults to a private one for redis_url)
+        """
+        self.redis_url = redis_url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.redis_factory = redis_factory or RedisFactory(self.redis_url)
+        self._owns_factory = redis_factory is None
+        self.redis_client: Optional[redis.Redis] = None
+        self._forget_script = None
+        self.ttl_seconds = int(ttl_seconds or os.getenv("IDEMPOTENCY_TTL", "3600"))
+        self.wait_seconds = wait_seconds
+        self.pending_ttl_seconds = 30  # Longer than any single attempt
+        self.poll_interval = 0.05
+        # Operations running on this worker, so local duplicates need not poll
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"executed": 0, "replayed": 0, "joined": 0, "wait_timeouts": 0}
+
+    async def connect(self):
+        """Initialize Redis connection."""
+        if not self.redis_client:
+            self.redis_client = self.redis_factory.client()
+            self._forget_script = self.redis_client.register_script(FORGET_SCRIPT)
+
+    async def disconnect(self):
+        """Close Redis connection."""
+        if self.redis_client:
+            await self.redis_client.close()
+        if self._owns_factory:
+            await self.redis_factory.close()
+
+    def _get_key(self, key: str) -> str:
+        """Redis key naming: vapi:idempotency:{key}"""
+        return f"vapi:idempotency:{key}"
+
+    async def run(
+        self,
+        key: str,
+        operation: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """
+        Result of operation for this key, running it only if no request has.
+
+        Results are dicts with a "success" flag; replayed ones are marked
+        "duplicate": True.
+        """
+        if not self.redis_client:
+            await self.connect()
+
+        inflight = self._inflight.get(key)
+        if inflight:
+            self.stats["joined"] += 1
+            return {**await asyncio.shield(inflight), "duplicate": True}
+
+        # Registered before touching Redis so local duplicates always join
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            redis_key = self._get_key(key)
+            result = None
+            while result is None:
+                claimed = await self.redis_client.set(
+                    redis_key, json.dumps({"status": PENDING}), nx=True, ex=self.pending_ttl_seconds
+                )
+                if claimed:
+                    result = await self._execute(key, redis_key, operation)
+                else:
+                    # None: the other request failed or its claim lapsed, so claim again
+                    result = await self._wait(redis_key)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved here in case no duplicate is waiting
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def forget(self, key: str) -> bool:
+        """
+        Drop the stored result for key, so the next request runs the
+        operation again (e.g. once the work it started has failed later).
+        """
+        if not self.redis_client:
+            await self.connect()
+        return bool(await self._forget_script(keys=[self._get_key(key)], args=[PENDING]))
+
+    async def _execute(self, key: str, redis_key: str,
+                       operation: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Run the operation under our claim and publish its result."""
+        try:
+            result = await operation()
+        except BaseException:
+            try:
+                await self.redis_client.delete(redis_key)
+            except Exception as e:
+                logging.warning(f"Idempotency key {key} not released: {e}")
+            raise
+
+        if result.get("success"):
+            await self.redis_client.set(
+                redis_key, json.dumps({"status": "done", "result": result}), ex=self.ttl_seconds
+            )
+        else:
+            await self.redis_client.delete(redis_key)
+        self.stats["executed"] += 1
+        return result
+
+    async def _wait(self, redis_key: str) -> Optional[Dict[str, Any]]:
+        """Poll for the result of a request running on another worker."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_seconds
+        while loop.time() < deadline:
+            data = await self.redis_client.get(redis_key)
+            if data is None:
+                return None
+            entry = json.loads(data)
+            if entry["status"] != PENDING:
+                self.stats["replayed"] += 1
+                return {**entry["result"], "duplicate": True}
+            await asyncio.sleep(self.poll_interval)
+
+        self.stats["wait_timeouts"] += 1
+        return {"success": False, "error": "Request already in progress", "duplicate": True}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Idempotency counters for /metrics."""
+        return {"inflight": len(self._inflight), **self.stats}
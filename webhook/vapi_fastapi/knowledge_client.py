@@ -0,0 +1,56 @@
+from typing import Any, Dict, Optional
+import aiohttp
+
+
+class KnowledgeClient:
+    """
+    Async client for the search-knowledge Supabase Edge Function (hybrid RAG search).
+    """
+
+    def __init__(self, search_url: str, api_key: Optional[str] = None):
+        """
+        Args:
+            search_url: Full URL of the search-knowledge function
+            api_key: Supabase anon/publishable key sent as the bearer token
+        """
+        self.search_url = search_url
+        self.api_key = api_key
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Get or create async HTTP session with connection pooling."""
+        if not self._session or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def search(self, query: str, topic: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Run a knowledge search.
+
+        Returns the function's {"answer", "sources", "confidence"} payload.
+        """
+        session = await self._get_session()
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+
+        body: Dict[str, Any] = {"query": query}
+        if topic:
+            body["topic"] = topic
+
+        async with session.post(self.search_url, json=body, headers=headers) as resp:
+            if resp.status != 200:
+                text = await resp.text()
+                raise Exception(f"Knowledge search error {resp.status}: {text}")
+            data = await resp.json()
+
+        return {
+            "answer": data.get("answer", ""),
+            "sources": data.get("sources", []),
+            "confidence": data.get("confidence", 0),
+        }
+
+    async def close(self):
+        """Close session."""
+        if self._session:
+            await self._session.close()
@@ -1,51 +1,121 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
-from pydantic import BaseModel, EmailStr, Field
-from typing import List, Dict, Any, Optional, Union, Literal
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse
+from functools import lru_cache
+from pydantic import BaseModel, EmailStr, ValidationError
+from typing import List, Dict, Any, Optional, Literal, Tuple
 import json
+import orjson
 import os
 import logging
 import aiohttp
-from datetime import datetime
-from .state_manager import state_manager
-from .calendar_client import GoogleCalendarClient
+import itertools
+from datetime import datetime, timedelta, timezone
+from .state_manager import StateManager
+from .redis_pool import RedisFactory
+from .calendar_client import GoogleCalendarClient, FreeBusyBlock
+from .availability_cache import AvailabilityCache
+from .availability_prefetch import AvailabilityPrefetcher
+from .slot_cache import SlotCache
 from .slot_manager import SlotManager
+from .booking_queue import BookingQueue
+from .idempotency import IdempotencyStore
+from .knowledge_client import KnowledgeClient
+from .prompt_templates import PromptRegistry, PromptTemplate, STATE_PROMPTS
+from .tool_dispatcher import ToolDispatcher, error_result
+from .vapi_messages import (
+    decode_webhook, VapiAssistantRequestMessage, VapiToolCallListMessage, VapiEndOfCallReportMessage
+)
 from .timezone_utils import (
     TimeSlot, parse_caller_time, validate_business_hours, 
-    get_next_available_slots, ARIZONA_TZ, UTC_TZ
+    get_next_available_slots, get_available_slots_batch, ARIZONA_TZ, UTC_TZ, MAX_SEARCH_DAYS
 )
 
 # Config
 GOOGLE_CREDS_PATH = os.getenv("GOOGLE_CREDS_PATH")
 AGENT_EMAIL = os.getenv("AGENT_EMAIL")
+# Comma-separated agent pool for brokerage mode (defaults to the single agent)
+AGENT_EMAILS = [e.strip() for e in os.getenv("AGENT_EMAILS", AGENT_EMAIL or "").split(",") if e.strip()]
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+BOOKING_SLOT_COUNT = int(os.getenv("BOOKING_SLOT_COUNT", "3"))  # Slots injected into the BOOKING prompt
+SUPABASE_PROJECT_URL = os.getenv("SUPABASE_PROJECT_URL")
+KNOWLEDGE_SEARCH_URL = os.getenv(
+    "KNOWLEDGE_SEARCH_URL",
+    f"{SUPABASE_PROJECT_URL}/functions/v1/search-knowledge" if SUPABASE_PROJECT_URL else None
+)
+SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY") or os.getenv("SUPABASE_PUBLISHABLE_TOKEN")
 
 # Security Check
 if not GOOGLE_CREDS_PATH or not AGENT_EMAIL:
     logging.warning("⚠️ Critical secrets missing: GOOGLE_CREDS_PATH or AGENT_EMAIL not set.")
 
-# Global Clients
+# Global Clients (built in lifespan, sharing one Redis connection factory)
+redis_factory: Optional[RedisFactory] = None
+state_manager: Optional[StateManager] = None
+prompt_registry: Optional[PromptRegistry] = None
 calendar_client: Optional[GoogleCalendarClient] = None
 slot_manager: Optional[SlotManager] = None
+booking_queue: Optional[BookingQueue] = None
+booking_idempotency: Optional[IdempotencyStore] = None
+availability_cache: Optional[AvailabilityCache] = None
+availability_prefetcher: Optional[AvailabilityPrefetcher] = None
+slot_cache: Optional[SlotCache] = None
+knowledge_client: Optional[KnowledgeClient] = (
+    KnowledgeClient(KNOWLEDGE_SEARCH_URL, SUPABASE_ANON_KEY) if KNOWLEDGE_SEARCH_URL else None
+)
 
 # Lifespan manager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global calendar_client, slot_manager
+    global redis_factory, state_manager, prompt_registry
+    global calendar_client, slot_manager, booking_queue, booking_idempotency, availability_cache, availability_prefetcher, slot_cache
+    
+    redis_factory = RedisFactory(REDIS_URL)
+    state_manager = StateManager(REDIS_URL, redis_factory=redis_factory)
+    # Compiled once; tenants (Vapi orgs) can override prompts in Redis
+    prompt_registry = PromptRegistry(STATE_PROMPTS, REDIS_URL, redis_factory=redis_factory)
     
     # Initialize implementation clients
     try:
         await state_manager.connect()
+        await prompt_registry.connect()
+        
+        availability_cache = AvailabilityCache(REDIS_URL, redis_factory=redis_factory)
+        await availability_cache.connect()
+        
+        availability_prefetcher = AvailabilityPrefetcher(REDIS_URL, redis_factory=redis_factory)
+        await availability_prefetcher.connect()
         
         if GOOGLE_CREDS_PATH and os.path.exists(GOOGLE_CREDS_PATH):
-            calendar_client = GoogleCalendarClient(GOOGLE_CREDS_PATH, AGENT_EMAIL)
+            calendar_client = GoogleCalendarClient(
+                GOOGLE_CREDS_PATH, AGENT_EMAIL, cache=availability_cache,
+                calendars=AGENT_EMAILS, redis_factory=redis_factory
+            )
+            try:
+                await calendar_client.warm_up()
+            except Exception as e:
+                logging.warning(f"Calendar token warm-up failed, retrying on first request: {e}")
+            
+            # Keep each agent's next slots computed for the BOOKING prompt
+            slot_cache = SlotCache(AGENT_EMAILS, compute_agent_slots, REDIS_URL, redis_factory=redis_factory)
+            await slot_cache.connect()
         else:
             logging.warning("Google Calendar credentials not found. Calendar features disabled.")
         
-        slot_manager = SlotManager(REDIS_URL)
+        slot_manager = SlotManager(REDIS_URL, redis_factory=redis_factory)
         await slot_manager.connect()
         
+        if calendar_client:
+            # Calendar writes for held slots, consumed by every replica
+            booking_queue = BookingQueue(slot_manager, write_booking, REDIS_URL, redis_factory=redis_factory)
+            await booking_queue.connect()
+            booking_queue.start_worker()
+            
+            # Absorbs Vapi retries of the same booking
+            booking_idempotency = IdempotencyStore(REDIS_URL, redis_factory=redis_factory)
+            await booking_idempotency.connect()
+        
         print("✅ Services initialized")
     except Exception as e:
         logging.error(f"⚠️ Service initialization warning: {e}", exc_info=True)
@@ -53,13 +123,27 @@ async def lifespan(app: FastAPI):
     yield
     
     # Shutdown
+    if booking_queue:
+        await booking_queue.disconnect()
+    if booking_idempotency:
+        await booking_idempotency.disconnect()
     if calendar_client:
         await calendar_client.close()
     if slot_manager:
         await slot_manager.disconnect()
+    if availability_cache:
+        await availability_cache.disconnect()
+    if availability_prefetcher:
+        await availability_prefetcher.disconnect()
+    if slot_cache:
+        await slot_cache.disconnect()
+    if knowledge_client:
+        await knowledge_client.close()
+    await prompt_registry.disconnect()
     await state_manager.disconnect()
+    await redis_factory.close()
 
-app = FastAPI(title="Vapi State Manager & Calendar", lifespan=lifespan)
+app = FastAPI(title="Vapi State Manager & Calendar", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # --- Models ---
 
@@ -67,50 +151,175 @@ class CheckAvailabilityRequest(BaseModel):
     date_start: str # ISO 8601 UTC
     date_end: str   # ISO 8601 UTC
     caller_timezone: str = "EST"
+    mode: Literal["agent", "pool"] = "agent"
+    assignment: Literal["round_robin", "least_loaded"] = "round_robin" # Pool mode only
+    agent_pool: Optional[List[str]] = None # Pool mode only, defaults to AGENT_EMAILS
 
 class BookAppointmentRequest(BaseModel):
     slot_time: str # ISO 8601 Arizona TZ
     call_id: str
+    agent_email: Optional[str] = None # Defaults to AGENT_EMAIL
     lead_name: str
     lead_email: EmailStr
     lead_phone: str
     confirmation_sms: str = ""
 
-# Vapi Models
-class VapiCall(BaseModel):
-    id: str
-    orgId: str
+# --- Calendar Endpoints ---
 
-class VapiAssistantRequestMessage(BaseModel):
-    type: Literal["assistant-request"]
-    call: VapiCall
+# Round-robin cursor for pool assignment (per worker)
+_pool_rotation = itertools.count()
 
-class VapiToolCall(BaseModel):
-    id: str
-    type: Literal["function"]
-    function: Dict[str, Any] 
+def _to_busy_slots(busy_blocks: List[FreeBusyBlock]) -> List[TimeSlot]:
+    """Convert busy blocks to Arizona TimeSlots for logic"""
+    return [TimeSlot.from_range(block.start, block.end) for block in busy_blocks]
 
-class VapiToolCallListMessage(BaseModel):
-    type: Literal["tool-calls"]
-    call: VapiCall
-    toolCallList: List[Dict[str, Any]] # Vapi sends tool calls as a list of dicts
+def assign_pool_slots(
+    busy_by_agent: Dict[str, List[FreeBusyBlock]],
+    count: int,
+    assignment: str
+) -> List[Tuple[TimeSlot, str]]:
+    """
+    Earliest slots across an agent pool, each assigned to one free agent.
+    """
+    agents = list(busy_by_agent)
+    if not agents:
+        return []
+
+    # Any globally-earliest slot is within each free agent's own first `count`
+    free_by_agent = {
+        agent: {slot.start: slot for slot in slots}
+        for agent, slots in get_available_slots_batch(
+            {agent: _to_busy_slots(blocks) for agent, blocks in busy_by_agent.items()}, count=count
+        ).items()
+    }
+    earliest = sorted({start for free in free_by_agent.values() for start in free})[:count]
 
-class VapiEndOfCallReportMessage(BaseModel):
-    type: Literal["end-of-call-report"]
-    call: VapiCall
+    # Least-loaded ranks agents by booked minutes in the window
+    load = {
+        agent: sum((b.end - b.start).total_seconds() for b in blocks) / 60
+        for agent, blocks in busy_by_agent.items()
+    }
 
-class VapiWebhookRequest(BaseModel):
+    picks: List[Tuple[TimeSlot, str]] = []
+    for start in earliest:
+        candidates = [agent for agent in agents if start in free_by_agent[agent]]
+        if assignment == "least_loaded":
+            agent = min(candidates, key=lambda a: load[a])
+        else:
+            offset = next(_pool_rotation) % len(agents)
+            rotated = agents[offset:] + agents[:offset]
+            agent = next(a for a in rotated if a in candidates)
+
+        slot = free_by_agent[agent][start]
+        load[agent] += (slot.end - slot.start).total_seconds() / 60
+        picks.append((slot, agent))
+    return picks
+
+async def find_slots(req: CheckAvailabilityRequest) -> List[Dict]:
     """
-    Strictly typed Vapi webhook wrapper.
+    Next 3 open slots for the agent (or pool), shared by the REST endpoint and the tool.
+
+    Raises:
+        ValueError: Dates are not ISO 8601, or agent_pool names no known agent
     """
-    message: Union[
-        VapiAssistantRequestMessage,
-        VapiToolCallListMessage,
-        VapiEndOfCallReportMessage,
-        Dict[str, Any] # Fallback for other message types
-    ] = Field(..., discriminator='type')
+    start_utc = datetime.fromisoformat(req.date_start.replace('Z', '+00:00'))
+    end_utc = datetime.fromisoformat(req.date_end.replace('Z', '+00:00'))
+    
+    if req.mode == "pool":
+        # One or two batched freebusy requests for the whole pool
+        pool = [a for a in req.agent_pool if a in AGENT_EMAILS] if req.agent_pool else AGENT_EMAILS
+        if not pool:
+            # An empty list would make the client fall back to the whole pool
+            raise ValueError(f"No known agents in agent_pool: {req.agent_pool}")
+        busy_by_agent = await calendar_client.get_availability_multi(start_utc, end_utc, pool)
+        picks = assign_pool_slots(busy_by_agent, count=3, assignment=req.assignment)
+        
+        return [
+            {
+                "start_iso": slot.to_iso(),
+                "voice_string": slot.to_voice_string(),
+                "agent_email": agent
+            } for slot, agent in picks
+        ]
+    
+    # Get busy blocks
+    busy_blocks = await calendar_client.get_availability(start_utc, end_utc)
+    
+    # Calculate available slots
+    available = get_next_available_slots(_to_busy_slots(busy_blocks), count=3)
+    
+    return [
+        {
+            "start_iso": slot.to_iso(),
+            "voice_string": slot.to_voice_string()
+        } for slot in available
+    ]
+
+def availability_window() -> Tuple[datetime, datetime]:
+    """
+    Free/busy window covering the next MAX_SEARCH_DAYS days, from the top of
+    the hour to a whole UTC day, so lookups made within the same hour share
+    one cache entry and single-flight key, and later ones that day still hit it.
+    """
+    now = datetime.now(timezone.utc)
+    start = now.replace(minute=0, second=0, microsecond=0)
+    end = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=MAX_SEARCH_DAYS + 1)
+    return start, end
+
+async def compute_agent_slots(agent_emails: List[str]) -> Dict[str, List[TimeSlot]]:
+    """Each agent's next open slots from one batched free/busy read, with spares for ones that become too soon."""
+    busy_by_agent = await calendar_client.get_availability_multi(*availability_window(), agent_emails)
+    return get_available_slots_batch(
+        {agent: _to_busy_slots(busy_by_agent.get(agent, [])) for agent in agent_emails},
+        count=BOOKING_SLOT_COUNT * 2 + 2
+    )
+
+def booking_slot_id(agent_email: str, slot: TimeSlot) -> str:
+    """Hold key for an agent's slot (Arizona start time)."""
+    return f"{agent_email}_{slot.start.strftime('%Y%m%d_%H%M')}"
+
+async def offer_booking_slots(call_id: str, pool: List[str]) -> Tuple[List[Tuple[TimeSlot, str]], int]:
+    """
+    Precomputed slots across the agent pool for the BOOKING prompt, held for
+    this call while read out.
 
-# --- Calendar Endpoints ---
+    Each start time is offered once, by the next agent in rotation who is
+    free then. Slots other callers are holding are skipped, so every time
+    offered can still be booked when the caller picks it.
+
+    Returns:
+        (offered (slot, agent) pairs, number of open slots considered)
+    """
+    by_start: Dict[datetime, List[Tuple[TimeSlot, str]]] = {}
+    for agent in pool:
+        for slot in (slot_cache.get(agent, BOOKING_SLOT_COUNT * 2) if slot_cache else []):
+            by_start.setdefault(slot.start, []).append((slot, agent))
+    offset = next(_pool_rotation) % len(pool) if pool else 0
+    rank = {agent: (i - offset) % len(pool) for i, agent in enumerate(pool)}
+    candidates = [
+        min(by_start[start], key=lambda pick: rank[pick[1]])
+        for start in sorted(by_start)[:BOOKING_SLOT_COUNT * 2]
+    ]
+    if not candidates or not slot_manager:
+        return candidates[:BOOKING_SLOT_COUNT], len(candidates)
+
+    by_id = {booking_slot_id(agent, slot): (slot, agent) for slot, agent in candidates}
+    try:
+        _, held = await slot_manager.hold_offer(call_id, list(by_id), limit=BOOKING_SLOT_COUNT)
+    except Exception as e:
+        logging.warning(f"Could not hold offered slots for {call_id}: {e}")
+        return candidates[:BOOKING_SLOT_COUNT], len(candidates)
+    return [by_id[slot_id] for slot_id in held], len(candidates)
+
+def booking_slots_text(slots: List[Tuple[TimeSlot, str]], candidates: int) -> str:
+    """Offered slots as prompt lines (no calendar call on the request path)."""
+    if not slots and candidates:
+        return "- The next open times are on hold for other callers: ask which day suits, then call check_availability"
+    if not slots:
+        return "- No times loaded yet: call check_availability to get open slots"
+    return "\n".join(
+        f"- {slot.to_voice_string()} (start_iso {slot.to_iso()}, agent_email {agent})" for slot, agent in slots
+    )
 
 @app.post("/check-availability")
 async def check_availability(req: CheckAvailabilityRequest):
@@ -118,115 +327,134 @@ async def check_availability(req: CheckAvailabilityRequest):
         raise HTTPException(503, "Calendar service not configured")
         
     try:
-        start_utc = datetime.fromisoformat(req.date_start.replace('Z', '+00:00'))
-        end_utc = datetime.fromisoformat(req.date_end.replace('Z', '+00:00'))
-        
-        # Get busy blocks
-        busy_blocks = await calendar_client.get_availability(start_utc, end_utc)
-        
-        # Convert busy blocks to Arizona TimeSlots for logic
-        busy_slots = [
-            TimeSlot(block.start.astimezone(ARIZONA_TZ), duration_minutes=1) 
-            for block in busy_blocks
-        ]
-        
-        # Calculate available slots
-        available = get_next_available_slots(busy_slots, count=3)
-        
-        return {
-            "available_slots": [
-                {
-                    "start_iso": slot.to_iso(),
-                    "voice_string": slot.to_voice_string()
-                } for slot in available
-            ]
-        }
+        return {"available_slots": await find_slots(req)}
     except ValueError as e:
-        raise HTTPException(400, f"Invalid date format: {e}")
+        raise HTTPException(400, f"Invalid availability request: {e}")
     except Exception as e:
         logging.error(f"Availability error: {e}", exc_info=True)
         raise HTTPException(500, "Internal server error")
 
-@app.post("/book-appointment")
-async def book_appointment(req: BookAppointmentRequest, background_tasks: BackgroundTasks):
-    if not calendar_client or not slot_manager:
-        raise HTTPException(503, "Booking services not configured")
+async def book_slot(req: BookAppointmentRequest) -> Dict:
+    """
+    Hold the slot and queue its calendar write (REST endpoint and tool).
 
+    Idempotent per call_id and slot: a retried request waits for the first
+    one's result instead of competing for its hold, and gets the booking's
+    current status (with the event_id once written). Once the booking has
+    failed, the next retry books it afresh.
+    """
     try:
         # 1. Parse slot
         slot_dt = datetime.fromisoformat(req.slot_time)
         slot = TimeSlot(slot_dt)
         
-        # 2. Acquire Redis Hold
-        slot_id = f"{AGENT_EMAIL}_{slot_dt.strftime('%Y%m%d_%H%M')}"
-        acquired, hold_id = await slot_manager.acquire_hold(slot_id, req.call_id, req.lead_email)
+        agent_email = req.agent_email or AGENT_EMAIL
+        if agent_email not in AGENT_EMAILS:
+            return {"success": False, "error": f"Unknown agent: {agent_email}"}
         
-        if not acquired:
-            return {"success": False, "error": f"Slot unavailable: {hold_id}"}
-            
-        # 3. Create Calendar Event
-        try:
-            event_id = await calendar_client.create_event(
-                summary=f"Tour: {req.lead_name}",
-                start=slot.start.astimezone(UTC_TZ),
-                end=slot.end.astimezone(UTC_TZ),
-                attendees=[req.lead_email],
-                description=f"Phone: {req.lead_phone}\n\n{req.confirmation_sms}"
-            )
-        except Exception as e:
-            await slot_manager.release_hold(slot_id, hold_id)
-            raise e
-            
-        # 4. Release Hold (Booking confirmed)
-        await slot_manager.release_hold(slot_id, hold_id)
+        slot_id = booking_slot_id(agent_email, slot)
+        booking_id = BookingQueue.booking_id(req.call_id, slot_id)
+        result = await booking_idempotency.run(
+            booking_id, lambda: hold_and_queue(req, slot, agent_email, slot_id)
+        )
         
-        return {"success": True, "event_id": event_id, "message": f"Confirmed for {slot.to_voice_string()}"}
+        if result.get("duplicate") and result.get("booking_id"):
+            # The replayed answer may predate the calendar write
+            booking = await booking_queue.get(result["booking_id"])
+            if booking:
+                result = {**result, "booking_status": booking["status"], "event_id": booking["event_id"]}
+                if booking["status"] == "failed":
+                    # Stop replaying it, so a retry holds the slot and queues it again
+                    await booking_idempotency.forget(booking_id)
+                    result = {**result, "success": False, "error": booking["error"] or "Booking could not be completed"}
+        return result
 
     except Exception as e:
         logging.error(f"Booking error: {e}", exc_info=True)
         return {"success": False, "error": str(e)}
 
-# System prompts for each state
-STATE_PROMPTS = {
-    "QUALIFICATION": """You are a real estate lead qualifier. Your goal is to extract:
-
-- Budget range (convert to number)
-- Timeline ("3 months", "6 months", etc.)
-- Property type preference (house, condo, etc.)
-- Location preference
-
-Ask ONE question at a time. When you have budget AND timeline, call update_system_prompt(new_state="BOOKING").
-
-Current context: {{CONTEXT}}""",
-
-    "BOOKING": """You are a real estate appointment scheduler. Offer 3 specific time slots:
-
-- Tuesday 3pm, Wednesday 10am, Thursday 2pm (or similar)
-- Confirm availability before booking
-
-When user confirms a time, call update_system_prompt(new_state="CONFIRMATION") with {selected_time: "Tuesday 3pm"}.
-
-Lead context: Budget ${{budget}}, Timeline: {{timeline}}""",
-
-    "CONFIRMATION": """You are confirming a real estate showing appointment. Read back:
+async def hold_and_queue(req: BookAppointmentRequest, slot: TimeSlot, agent_email: str, slot_id: str) -> Dict:
+    # 2. Keep the hold from the slots offered to this call, or acquire one
+    hold_id = await slot_manager.commit_offer(req.call_id, slot_id)
+    if not hold_id:
+        acquired, hold_id = await slot_manager.acquire_hold(slot_id, req.call_id, req.lead_email)
+        
+        if not acquired:
+            return {"success": False, "error": f"Slot unavailable: {hold_id}"}
+        
+    # 3. Queue the calendar write; the hold stays until the worker confirms it
+    try:
+        queued, booking = await booking_queue.enqueue({
+            **req.model_dump(), "agent_email": agent_email, "slot_id": slot_id, "hold_id": hold_id
+        })
+    except Exception as e:
+        await slot_manager.release_hold(slot_id, hold_id)
+        raise e
+    
+    if not queued:
+        # This call already booked the slot; our new hold isn't needed
+        await slot_manager.release_hold(slot_id, hold_id)
+    
+    result = {
+        "booking_id": booking["booking_id"],
+        "booking_status": booking["status"],
+        "event_id": booking["event_id"],
+    }
+    if booking["status"] == "failed":
+        return {"success": False, "error": "Booking could not be completed", **result}
+    return {"success": True, **result, "message": f"Reserved {slot.to_voice_string()}, confirmation to follow"}
+
+async def write_booking(booking: Dict, event_id: str) -> str:
+    """Create the calendar event for a queued booking (idempotent per event_id)."""
+    slot = TimeSlot(datetime.fromisoformat(booking["slot_time"]))
+    return await calendar_client.create_event(
+        summary=f"Tour: {booking['lead_name']}",
+        start=slot.start.astimezone(UTC_TZ),
+        end=slot.end.astimezone(UTC_TZ),
+        attendees=[booking["lead_email"]],
+        description=f"Phone: {booking['lead_phone']}\n\n{booking['confirmation_sms']}",
+        calendar_id=booking["agent_email"],
+        event_id=event_id
+    )
 
-- Date and time
-- Property preferences
-- Contact information
+@app.post("/book-appointment")
+async def book_appointment(req: BookAppointmentRequest):
+    """Responds once the slot is held; poll /bookings/{booking_id} for the event."""
+    if not calendar_client or not slot_manager or not booking_queue or not booking_idempotency:
+        raise HTTPException(503, "Booking services not configured")
 
-Be concise and professional. Do not transition to other states.
+    return await book_slot(req)
 
-Appointment: {{selected_time}}
-Lead details: {{CONTEXT}}"""
-}
+@app.get("/bookings/{booking_id}")
+async def booking_status(booking_id: str):
+    if not booking_queue:
+        raise HTTPException(503, "Booking services not configured")
 
-async def handle_assistant_request(call_id: str) -> Dict:
-    """Initialize call state and return starting prompt"""
-    # Initialize state (await is now required)
-    await state_manager.init_call(call_id, initial_state="QUALIFICATION")
+    booking = await booking_queue.get(booking_id)
+    if booking is None:
+        raise HTTPException(404, "Booking not found")
+    return booking
 
-    # Return initial assistant config
+@app.get("/metrics")
+async def metrics():
+    """Operational counters for tuning caches and upstream load."""
     return {
+        "availability": await availability_cache.get_stats() if availability_cache else {},
+        "redis": redis_factory.get_stats() if redis_factory else {},
+        "state_cache": state_manager.get_cache_stats(),
+        "prompts": prompt_registry.get_stats(),
+        "tools": tool_dispatcher.get_stats(),
+        "prefetch": availability_prefetcher.get_stats() if availability_prefetcher else {},
+        "bookings": await booking_queue.get_stats() if booking_queue else {},
+        "booking_idempotency": booking_idempotency.get_stats() if booking_idempotency else {},
+        "slot_cache": slot_cache.get_stats() if slot_cache else {},
+        "slot_contention": await slot_manager.get_contention_stats() if slot_manager else [],
+    }
+
+@lru_cache(maxsize=256)
+def _assistant_config(template: PromptTemplate) -> bytes:
+    """Assistant config for a QUALIFICATION prompt, encoded once per template."""
+    return orjson.dumps({
         "assistant": {
             "firstMessage": "Hello! I'm excited to help you find your perfect home. To get started, what's your budget range?",
             "model": {
@@ -235,114 +463,231 @@ async def handle_assistant_request(call_id: str) -> Dict:
                 "messages": [
                     {
                         "role": "system",
-                        "content": STATE_PROMPTS["QUALIFICATION"].replace(
-                            "{{CONTEXT}}", 
-                            "No data collected yet."
-                        )
+                        "content": template.render({}, context_json="No data collected yet.")
+                    }
+                ]
+            }
+        }
+    })
+
+def default_availability_request(**overrides) -> CheckAvailabilityRequest:
+    """Availability over the next MAX_SEARCH_DAYS days, as a BOOKING turn asks for it."""
+    start, end = availability_window()
+    return CheckAvailabilityRequest(**{
+        "date_start": start.isoformat(),
+        "date_end": end.isoformat(),
+        **overrides,
+    })
+
+async def _prefetch_slots(call_id: str) -> Optional[List[Dict]]:
+    """Slots for a call still in QUALIFICATION (None once it has moved on)."""
+    call_state = await state_manager.get_state(call_id)
+    if not call_state or call_state.state != "QUALIFICATION":
+        return None
+    return await find_slots(default_availability_request())
+
+def prefetch_availability(call_id: str):
+    """Speculatively fetch slots in the background; BOOKING almost always follows."""
+    if calendar_client and availability_prefetcher:
+        availability_prefetcher.start(call_id, lambda: _prefetch_slots(call_id))
+
+async def handle_assistant_request(call_id: str, org_id: Optional[str] = None) -> Response:
+    """Initialize call state and return starting prompt"""
+    # Initialize state (await is now required)
+    await state_manager.init_call(call_id, initial_state="QUALIFICATION")
+    prefetch_availability(call_id)
+
+    # Return initial assistant config (pre-encoded; it only varies by tenant prompt)
+    template = await prompt_registry.template("QUALIFICATION", org_id)
+    return Response(content=_assistant_config(template), media_type="application/json")
+
+async def tool_update_system_prompt(call_id: str, parameters: Dict, org_id: Optional[str] = None) -> Dict:
+    """Move the call to a new state and swap in that state's prompt"""
+    # Extract parameters
+    new_state = parameters.get("new_state")
+    context_update = parameters.get("context") or {}
+    if not isinstance(context_update, dict):
+        return error_result("context must be an object of key/value pairs")
+    
+    # Attempt state transition (returns the updated state in the same round-trip),
+    # reading back only the context keys the next prompt renders
+    template = await prompt_registry.template(new_state, org_id)
+    call_state = await state_manager.transition(
+        call_id, new_state, context_update, fields=template.fields if template else None
+    )
+    
+    if not call_state:
+        # Invalid transition
+        return error_result(f"Invalid transition to {new_state}")
+
+    # Generate new system prompt with injected context
+    if new_state == "BOOKING":
+        # Real slots go straight into the prompt, saving a tool round-trip;
+        # they aren't part of the stored context, so the version key can't be used
+        new_prompt = await prompt_registry.render(
+            new_state,
+            {**call_state.context, "available_slots": booking_slots_text(*await offer_booking_slots(call_id, AGENT_EMAILS))},
+            org_id
+        )
+    else:
+        new_prompt = await prompt_registry.render(
+            new_state, call_state.context, org_id,
+            context_key=(call_id, call_state.last_activity)
+        )
+    
+    # Return success with prompt override
+    return {
+        "result": json.dumps({"status": "success", "new_state": new_state}),
+        "assistantOverride": {
+            "model": {
+                "messages": [
+                    {
+                        "role": "system",
+                        "content": new_prompt
                     }
                 ]
             }
         }
     }
 
-async def handle_tool_calls(call_id: str, tool_calls_data: List[Dict]) -> Dict:
-    """Process state transition tool calls"""
+def tool_result(payload: Dict) -> Dict:
+    """Tool result entry with a JSON payload for the model."""
+    return {"result": json.dumps(payload)}
+
+async def tool_check_availability(call_id: str, parameters: Dict, org_id: Optional[str] = None) -> Dict:
+    """In-process /check-availability (defaults to the next MAX_SEARCH_DAYS days)"""
+    if not calendar_client:
+        return error_result("Calendar service not configured")
+
+    # A plain "what's open?" is usually answered by the QUALIFICATION prefetch
+    if not parameters and availability_prefetcher:
+        slots = await availability_prefetcher.get(call_id)
+        if slots is not None:
+            return tool_result({"status": "success", "available_slots": slots})
+
+    try:
+        slots = await find_slots(default_availability_request(**parameters))
+    except (ValidationError, ValueError) as e:
+        return error_result(f"Invalid availability request: {e}")
+    return tool_result({"status": "success", "available_slots": slots})
+
+# Fallbacks: the slow call keeps running in the background and its result is
+# what a repeat of the same tool call gets (the dispatcher's result cache, or
+# the booking's idempotency entry), so the model is told to ask again
+
+async def fallback_check_availability(call_id: str, parameters: Dict, org_id: Optional[str] = None) -> Dict:
+    return tool_result({
+        "status": "pending",
+        "message": "Calendar is slow right now. Ask the caller to hold a moment, "
+                   "then call check_availability again with the same request."
+    })
+
+async def tool_book_appointment(call_id: str, parameters: Dict, org_id: Optional[str] = None) -> Dict:
+    """In-process /book-appointment for the current call"""
+    if not calendar_client or not slot_manager or not booking_queue or not booking_idempotency:
+        return error_result("Booking services not configured")
+
+    try:
+        req = BookAppointmentRequest(**{**parameters, "call_id": call_id})
+    except ValidationError as e:
+        return error_result(f"Missing booking details: {e}")
+    booking = await book_slot(req)
+    return tool_result({"status": "success" if booking["success"] else "error", **booking})
+
+async def fallback_book_appointment(call_id: str, parameters: Dict, org_id: Optional[str] = None) -> Dict:
+    pending = {
+        "status": "pending",
+        "message": "Booking is still being confirmed. Tell the caller it's in progress, "
+                   "then call book_appointment again with the same details for the result."
+    }
+    try:
+        slot = TimeSlot(datetime.fromisoformat(parameters["slot_time"]))
+        agent_email = parameters.get("agent_email") or AGENT_EMAIL
+        # Same id book_slot uses, so GET /bookings/{booking_id} can follow it too
+        pending["booking_id"] = BookingQueue.booking_id(call_id, booking_slot_id(agent_email, slot))
+    except (KeyError, TypeError, ValueError):
+        pass
+    return tool_result(pending)
+
+async def tool_search_knowledge(call_id: str, parameters: Dict, org_id: Optional[str] = None) -> Dict:
+    """Knowledge base lookup via the search-knowledge Edge Function"""
+    if not knowledge_client:
+        return error_result("Knowledge search not configured")
+
+    query = (parameters.get("query") or "").strip()
+    if not query:
+        return error_result("Query required")
+    found = await knowledge_client.search(query, parameters.get("topic"))
+    return tool_result({"status": "success", **found})
+
+async def fallback_search_knowledge(call_id: str, parameters: Dict, org_id: Optional[str] = None) -> Dict:
+    return tool_result({
+        "status": "pending",
+        "message": "Lookup is taking a moment. Ask the caller to hold on, "
+                   "then call search_knowledge again with the same query."
+    })
+
+def _knowledge_cache_key(parameters: Dict) -> Optional[Tuple[str, str]]:
+    query = " ".join(str(parameters.get("query") or "").lower().split())
+    return (query, str(parameters.get("topic") or "")) if query else None
+
+def _availability_cache_key(parameters: Dict) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in parameters.items()))
+
+# Tools the model can call inside the webhook, with latency budgets (seconds)
+# after which the caller gets a cached or degraded answer instead of silence
+tool_dispatcher = ToolDispatcher()
+tool_dispatcher.register("update_system_prompt", tool_update_system_prompt, touches_state=True, timeout=2.0)
+tool_dispatcher.register(
+    "check_availability", tool_check_availability, timeout=8.0, budget=1.5,
+    fallback=fallback_check_availability, cache_key=_availability_cache_key
+)
+tool_dispatcher.register(
+    "book_appointment", tool_book_appointment, touches_state=True, timeout=15.0, budget=2.5,
+    fallback=fallback_book_appointment
+)
+tool_dispatcher.register(
+    "search_knowledge", tool_search_knowledge, timeout=5.0, budget=1.2,
+    fallback=fallback_search_knowledge, cache_key=_knowledge_cache_key
+)
+
+async def handle_tool_calls(call_id: str, tool_calls_data: List[Dict], org_id: Optional[str] = None) -> Dict:
+    """Process tool calls (independent tools run concurrently)"""
     if not tool_calls_data:
         return {"results": []}
 
-    results = []
-    
-    for tool_call in tool_calls_data:
-        tool_name = tool_call.get("function", {}).get("name")
-        tool_id = tool_call.get("id")
-        
-        # Tool parameters string parsing (Vapi sends as json string sometimes, but let's assume dict for now if parsed)
-        # Actually Vapi usually sends 'arguments' as a JSON string inside 'function'. 
-        arguments = tool_call.get("function", {}).get("arguments", "{}")
-        if isinstance(arguments, str):
-            try:
-                parameters = json.loads(arguments)
-            except:
-                parameters = {}
-        else:
-            parameters = arguments
-        
-        if tool_name == "update_system_prompt":
-            # Extract parameters
-            new_state = parameters.get("new_state")
-            context_update = parameters.get("context", {})
-            
-            # Attempt state transition
-            success = await state_manager.transition_state(call_id, new_state, context_update)
-            
-            if success:
-                # Get updated state
-                call_state = await state_manager.get_state(call_id)
-                
-                # Generate new system prompt with injected context
-                prompt_template = STATE_PROMPTS.get(new_state, "")
-                context_str = json.dumps(call_state.context) if call_state else "{}"
-                new_prompt = prompt_template.replace("{{CONTEXT}}", context_str)
-                
-                # Replace placeholders for specific keys if they exist in context (simple templating)
-                if call_state:
-                     for key, value in call_state.context.items():
-                         placeholder = f"{{{{{key}}}}}" # {{key}}
-                         if placeholder in new_prompt:
-                             new_prompt = new_prompt.replace(placeholder, str(value))
-                
-                # Return success with prompt override
-                results.append({
-                    "toolCallId": tool_id,
-                    "result": json.dumps({"status": "success", "new_state": new_state}),
-                    "assistantOverride": {
-                        "model": {
-                            "messages": [
-                                {
-                                    "role": "system",
-                                    "content": new_prompt
-                                }
-                            ]
-                        }
-                    }
-                })
-            else:
-                # Invalid transition
-                results.append({
-                    "toolCallId": tool_id,
-                    "result": json.dumps({
-                        "status": "error", 
-                        "message": f"Invalid transition to {new_state}"
-                    })
-                })
-        else:
-            # Unknown tool
-            results.append({
-                "toolCallId": tool_id,
-                "result": json.dumps({
-                    "status": "error",
-                    "message": f"Unknown tool: {tool_name}"
-                })
-            })
-    
-    return {"results": results}
+    # Still qualifying? Keep a slot answer warm for the BOOKING turn
+    prefetch_availability(call_id)
+    return {"results": await tool_dispatcher.dispatch(call_id, tool_calls_data, org_id)}
 
 async def handle_end_of_call(call_id: str):
     """Cleanup call state when call ends"""
+    if availability_prefetcher:
+        await availability_prefetcher.cancel(call_id)
+    if slot_manager:
+        await slot_manager.release_offer(call_id)
     await state_manager.cleanup_call(call_id)
 
 @app.post("/vapi/state-webhook")
-async def handle_vapi_webhook(request: VapiWebhookRequest):
+async def handle_vapi_webhook(request: Request):
     """
     Main webhook endpoint for Vapi
+
+    The body is decoded lazily: only message.type and the fields its
+    handler uses are validated, so large end-of-call reports stay cheap.
     """
-    msg = request.message
+    try:
+        msg = decode_webhook(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
     
     if isinstance(msg, VapiAssistantRequestMessage):
-        return await handle_assistant_request(msg.call.id)
+        return await handle_assistant_request(msg.call.id, msg.call.orgId)
     
     elif isinstance(msg, VapiToolCallListMessage):
-        return await handle_tool_calls(msg.call.id, msg.toolCallList)
+        return await handle_tool_calls(msg.call.id, msg.toolCallList, msg.call.orgId)
     
     elif isinstance(msg, VapiEndOfCallReportMessage):
         await handle_end_of_call(msg.call.id)
@@ -0,0 +1,269 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import re
+import redis.asyncio as redis
+from .redis_pool import RedisFactory
+
+# {{name}} placeholders; {{CONTEXT}} renders the whole context as JSON
+PLACEHOLDER = re.compile(r"\{\{(\w+)\}\}")
+CONTEXT_PLACEHOLDER = "CONTEXT"
+
+# Org ids published here when their overrides change ("*" = all)
+PROMPT_UPDATES_CHANNEL = "vapi:prompts:updated"
+LISTENER_RETRY_SECONDS = 1
+
+_template_ids = itertools.count()
+
+# System prompts for each state
+STATE_PROMPTS = {
+    "QUALIFICATION": """You are a real estate lead qualifier. Your goal is to extract:
+
+- Budget range (convert to number)
+- Timeline ("3 months", "6 months", etc.)
+- Property type preference (house, condo, etc.)
+- Location preference
+
+Ask ONE question at a time. When you have budget AND timeline, call update_system_prompt(new_state="BOOKING").
+
+Current context: {{CONTEXT}}""",
+
+    "BOOKING": """You are a real estate appointment scheduler. Offer these open time slots (read the spoken time, book with its start_iso and agent_email):
+
+{{available_slots}}
+
+- Confirm availability before booking
+
+When user confirms a time, call update_system_prompt(new_state="CONFIRMATION") with {selected_time: "Tuesday 3pm"}.
+
+Lead context: Budget ${{budget}}, Timeline: {{timeline}}""",
+
+    "CONFIRMATION": """You are confirming a real estate showing appointment. Read back:
+
+- Date and time
+- Property preferences
+- Contact information
+
+Be concise and professional. Do not transition to other states.
+
+Appointment: {{selected_time}}
+Lead details: {{CONTEXT}}"""
+}
+
+
+class PromptTemplate:
+    """
+    A system prompt compiled once into literal segments and placeholder slots.
+
+    Rendering fills the slots and does a single join. Placeholders with no
+    matching context key are left as written, like the old replace loop.
+    """
+
+    __slots__ = ("source", "fields", "template_id", "_segments", "_slots")
+
+    def __init__(self, source: str):
+        self.source = source
+        self.template_id = next(_template_ids)  # Unique per compile, for memo keys
+        # split() alternates literal text and captured placeholder names
+        self._segments: List[str] = PLACEHOLDER.split(source)
+        self._slots: List[Tuple[int, str]] = [
+            (i, self._segments[i]) for i in range(1, len(self._segments), 2)
+        ]
+        names = [name for _, name in self._slots]
+        # Context keys the prompt reads (None = all of them, via {{CONTEXT}})
+        self.fields: Optional[List[str]] = (
+            None if CONTEXT_PLACEHOLDER in names else list(dict.fromkeys(names))
+        )
+
+    def render(self, context: Dict[str, Any], context_json: Optional[str] = None) -> str:
+        """
+        Args:
+            context: Call context supplying {{key}} values
+            context_json: Text for {{CONTEXT}} (defaults to json.dumps(context))
+        """
+        parts = self._segments.copy()
+        for i, name in self._slots:
+            if name == CONTEXT_PLACEHOLDER:
+                if context_json is None:
+                    context_json = json.dumps(context)
+                parts[i] = context_json
+            elif name in context:
+                parts[i] = str(context[name])
+            else:
+                parts[i] = "{{" + name + "}}"
+        return "".join(parts)
+
+
+class PromptRegistry:
+    """
+    Compiled STATE_PROMPTS plus per-tenant overrides from Redis.
+
+    Overrides live in a hash per Vapi org (state -> template) and are loaded
+    on first use. Publishing the org id on PROMPT_UPDATES_CHANNEL makes every
+    worker reload it, so prompts change without a restart.
+    """
+
+    def __init__(self, defaults: Dict[str, str], redis_url: Optional[str] = None, memo_size: int = 1024,
+                 redis_factory: Optional[RedisFactory] = None):
+        """
+        Args:
+            defaults: State -> prompt template used when a tenant has no override
+            redis_url: Redis holding tenant overrides (None = defaults only)
+            memo_size: Rendered prompts kept, keyed by template and context hash
+            redis_factory: Shared Redis connections (used instead of redis_url)
+        """
+        self.defaults = {state: PromptTemplate(source) for state, source in defaults.items()}
+        self.redis_url = redis_url
+        self.redis_factory = redis_factory or (RedisFactory(redis_url) if redis_url else None)
+        self._owns_factory = redis_factory is None
+        self.redis_client: Optional[redis.Redis] = None
+        self.memo_size = memo_size
+        self._tenants: Dict[str, Dict[str, PromptTemplate]] = {}
+        self._memo: "OrderedDict[Tuple[int, Hashable], str]" = OrderedDict()
+        self._listener_task: Optional[asyncio.Task] = None
+        self._generation = 0  # Bumped on every update; guards in-flight loads
+        self.stats = {"renders": 0, "memo_hits": 0, "tenant_loads": 0, "tenant_reloads": 0}
+
+    async def connect(self):
+        """Initialize Redis connection and start listening for override updates."""
+        if self.redis_factory and not self.redis_client:
+            self.redis_client = self.redis_factory.client()
+            self._listener_task = asyncio.create_task(self._listen_for_updates())
+
+    async def disconnect(self):
+        """Stop the update listener and close Redis connection."""
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self.redis_client:
+            await self.redis_client.close()
+        if self.redis_factory and self._owns_factory:
+            await self.redis_factory.close()
+
+    def _get_key(self, org_id: str) -> str:
+        """Redis key naming: vapi:prompts:{org_id}"""
+        return f"vapi:prompts:{org_id}"
+
+    async def _listen_for_updates(self):
+        """Drop a tenant's compiled overrides whenever they are republished."""
+        while True:
+            try:
+                async with self.redis_factory.client(subscriber=True).pubsub() as pubsub:
+                    await pubsub.subscribe(PROMPT_UPDATES_CHANNEL)
+                    # Anything cached before the subscription may be stale
+                    self._generation += 1
+                    self._tenants.clear()
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        org_id = message["data"]
+                        self._generation += 1
+                        if org_id == "*":
+                            self._tenants.clear()
+                        else:
+                            self._tenants.pop(org_id, None)
+                        self.stats["tenant_reloads"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Prompt update listener lost, retrying: {e}")
+                self._generation += 1
+                self._tenants.clear()
+            await asyncio.sleep(LISTENER_RETRY_SECONDS)
+
+    async def _load_tenant(self, org_id: str) -> Dict[str, PromptTemplate]:
+        """Compile a tenant's overrides (an empty dict when it has none)."""
+        generation = self._generation
+        try:
+            sources = await self.redis_client.hgetall(self._get_key(org_id))
+        except Exception as e:
+            logging.warning(f"Prompt overrides unavailable for {org_id}, using defaults: {e}")
+            return {}
+
+        overrides = {state: PromptTemplate(source) for state, source in sources.items()}
+        if generation == self._generation:
+            self._tenants[org_id] = overrides
+        self.stats["tenant_loads"] += 1
+        return overrides
+
+    async def template(self, state: str, org_id: Optional[str] = None) -> Optional[PromptTemplate]:
+        """The compiled prompt for a state, preferring the tenant's override."""
+        if org_id and self.redis_client:
+            overrides = self._tenants.get(org_id)
+            if overrides is None:
+                overrides = await self._load_tenant(org_id)
+            if state in overrides:
+                return overrides[state]
+        return self.defaults.get(state)
+
+    async def render(
+        self,
+        state: str,
+        context: Dict[str, Any],
+        org_id: Optional[str] = None,
+        context_json: Optional[str] = None,
+        context_key: Optional[Hashable] = None
+    ) -> str:
+        """
+        Render the prompt for a state.
+
+        Prompts embedding {{CONTEXT}} are memoized by (template, context hash);
+        prompts with only {{key}} placeholders are cheaper to join than to hash.
+
+        Args:
+            state: Call state whose prompt to render
+            context: Call context
+            org_id: Vapi org for tenant overrides
+            context_json: Text for {{CONTEXT}} (defaults to json.dumps(context))
+            context_key: Cheap identity of this context version (e.g. call id and
+                last_activity), used instead of hashing the serialized context
+        """
+        template = await self.template(state, org_id)
+        if template is None:
+            return ""
+
+        self.stats["renders"] += 1
+        if template.fields is not None:
+            return template.render(context)
+
+        if context_key is None:
+            if context_json is None:
+                context_json = json.dumps(context)
+            context_key = hashlib.blake2b(context_json.encode(), digest_size=16).digest()
+        # A reloaded override gets a new template_id, so old entries just age out
+        memo_key = (template.template_id, context_key)
+
+        rendered = self._memo.get(memo_key)
+        if rendered is not None:
+            self._memo.move_to_end(memo_key)
+            self.stats["memo_hits"] += 1
+            return rendered
+
+        rendered = template.render(context, context_json)
+        self._memo[memo_key] = rendered
+        if len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        return rendered
+
+    async def set_override(self, org_id: str, state: str, source: Optional[str]):
+        """
+        Store (or with source=None remove) a tenant's prompt and notify all workers.
+        """
+        key = self._get_key(org_id)
+        if source is None:
+            await self.redis_client.hdel(key, state)
+        else:
+            await self.redis_client.hset(key, state, source)
+        await self.redis_client.publish(PROMPT_UPDATES_CHANNEL, org_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Render counters for /metrics."""
+        return {"tenants_loaded": len(self._tenants), "memo_size": len(self._memo), **self.stats}
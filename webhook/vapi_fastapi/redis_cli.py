@@ -2,8 +2,10 @@ import os
 import sys
 import asyncio
 import shlex
-import redis.asyncio as redis
 from dotenv import load_dotenv
+from .redis_pool import RedisFactory
+
+# Usage: python -m vapi_fastapi.redis_cli [command args...]  (no args = interactive)
 
 # Load environment variables
 load_dotenv()
@@ -85,22 +87,22 @@ async def execute_command(client, cmd_parts):
 async def main():
     print(f"Connecting to Redis...")
     
+    # Same pool settings (timeouts, socket, protocol) as the service
+    factory = RedisFactory(REDIS_URL)
     try:
-        client = redis.from_url(
-            REDIS_URL, 
-            encoding="utf-8", 
-            decode_responses=True
-        )
+        client = factory.client()
         await client.ping()
         print(f"Connected to {REDIS_URL.split('@')[-1] if '@' in REDIS_URL else 'Redis'}")
     except Exception as e:
         print(f"Connection Failed: {e}")
+        await factory.close()
         return
 
     # If arguments provided, run single command
     if len(sys.argv) > 1:
         await execute_command(client, sys.argv[1:])
         await client.close()
+        await factory.close()
         return
 
     # Interactive Mode
@@ -125,6 +127,7 @@ async def main():
             print(f"Error: {e}")
 
     await client.close()
+    await factory.close()
 
 if __name__ == "__main__":
     if sys.platform == 'win32':
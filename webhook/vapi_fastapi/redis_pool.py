@@ -0,0 +1,221 @@
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import os
+import re
+import time
+import redis.asyncio as redis
+from redis import __version__ as REDIS_PY_VERSION
+from redis.asyncio.connection import BlockingConnectionPool, UnixDomainSocketConnection, async_timeout, parse_url
+from redis.utils import HIREDIS_AVAILABLE
+
+# Before redis-py 5.0.2, BlockingConnectionPool.get_connection connects a
+# new connection while holding the pool's (non-reentrant) lock and, if that
+# fails, releases it under the same lock: the caller stalls for the whole
+# pool timeout and gets "No connection available" instead of the real error.
+# 5.0.2 moved the connection check outside the lock; remove
+# InstrumentedConnectionPool._checkout once older versions are unsupported.
+CONNECTS_UNDER_POOL_LOCK = tuple(int(part) for part in re.findall(r"\d+", REDIS_PY_VERSION)[:3]) < (5, 0, 2)
+
+
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    """
+    BlockingConnectionPool that records how often and how long callers wait
+    for a connection (including connecting it, when one had to be waited for).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = {"checkouts": 0, "waits": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0, "timeouts": 0}
+
+    async def get_connection(self, command_name, *keys, **options):
+        saturated = not self.can_get_connection()
+        started = time.perf_counter()
+        try:
+            if CONNECTS_UNDER_POOL_LOCK:
+                connection = await self._checkout()
+            else:
+                connection = await super().get_connection(command_name, *keys, **options)
+        except redis.ConnectionError as err:
+            if isinstance(err.__cause__, asyncio.TimeoutError):
+                self.wait_stats["timeouts"] += 1
+            raise
+
+        self.wait_stats["checkouts"] += 1
+        if saturated:
+            waited = (time.perf_counter() - started) * 1000
+            self.wait_stats["waits"] += 1
+            self.wait_stats["wait_ms_total"] += waited
+            self.wait_stats["wait_ms_max"] = max(self.wait_stats["wait_ms_max"], waited)
+        return connection
+
+    async def _checkout(self):
+        """get_connection as redis-py 5.0.2 does it, for older versions (see CONNECTS_UNDER_POOL_LOCK)."""
+        try:
+            async with async_timeout(self.timeout):
+                async with self._condition:
+                    await self._condition.wait_for(self.can_get_connection)
+                    try:
+                        connection = self._available_connections.pop()
+                    except IndexError:
+                        connection = self.make_connection()
+                    self._in_use_connections.add(connection)
+        except asyncio.TimeoutError as err:
+            raise redis.ConnectionError("No connection available.") from err
+
+        try:
+            await self.ensure_connection(connection)
+        except BaseException:
+            await self.release(connection)
+            raise
+        return connection
+
+    def snapshot(self) -> Dict[str, Any]:
+        in_use = len(self._in_use_connections)
+        return {
+            "max_connections": self.max_connections,
+            "in_use": in_use,
+            "idle": len(self._available_connections),
+            "saturation": round(in_use / self.max_connections, 3),
+            **self.wait_stats,
+            "wait_ms_total": round(self.wait_stats["wait_ms_total"], 1),
+            "wait_ms_max": round(self.wait_stats["wait_ms_max"], 1),
+        }
+
+
+class RedisFactory:
+    """
+    The process's Redis connections, shared by every manager.
+
+    Commands go through one bounded pool: when all max_connections are busy,
+    callers queue for up to pool_timeout seconds instead of opening more
+    sockets, so each uvicorn worker has a known ceiling (size Redis maxclients
+    for workers x instances x (max_connections + subscriber_connections)).
+    Pub/sub listeners and blocking reads use a small separate pool without a
+    read timeout, since they sit idle for long stretches.
+
+    Settings default to the environment:
+        REDIS_URL                  redis://, rediss:// or unix:///path.sock?db=0
+        REDIS_SOCKET_PATH          Unix socket overriding the URL's host/port
+        REDIS_MAX_CONNECTIONS      Command pool size (20)
+        REDIS_POOL_TIMEOUT         Seconds to wait for a free connection (2)
+        REDIS_CONNECT_TIMEOUT      Socket connect timeout (2)
+        REDIS_SOCKET_TIMEOUT       Command read/write timeout (10; must exceed blocking reads)
+        REDIS_PROTOCOL             2, or 3 for RESP3
+        REDIS_PARSER               auto (hiredis when installed), hiredis or python
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        max_connections: Optional[int] = None,
+        pool_timeout: Optional[float] = None,
+        socket_connect_timeout: Optional[float] = None,
+        socket_timeout: Optional[float] = None,
+        socket_path: Optional[str] = None,
+        protocol: Optional[int] = None,
+        parser: Optional[str] = None,
+        subscriber_connections: int = 4
+    ):
+        self.redis_url = redis_url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.max_connections = int(max_connections or os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+        self.pool_timeout = float(pool_timeout or os.getenv("REDIS_POOL_TIMEOUT", "2"))
+        self.socket_connect_timeout = float(socket_connect_timeout or os.getenv("REDIS_CONNECT_TIMEOUT", "2"))
+        self.socket_timeout = float(socket_timeout or os.getenv("REDIS_SOCKET_TIMEOUT", "10"))
+        self.socket_path = socket_path or os.getenv("REDIS_SOCKET_PATH")
+        self.protocol = int(protocol or os.getenv("REDIS_PROTOCOL", "2"))
+        self.parser = (parser or os.getenv("REDIS_PARSER", "auto")).lower()
+        self.subscriber_connections = subscriber_connections
+        self._pool: Optional[InstrumentedConnectionPool] = None
+        self._subscriber_pool: Optional[InstrumentedConnectionPool] = None
+        self.dedicated_opened = 0
+
+    def _parser_name(self) -> str:
+        """Parser the connections use: hiredis whenever installed, unless REDIS_PARSER=python."""
+        if self.parser == "hiredis" and not HIREDIS_AVAILABLE:
+            logging.warning("REDIS_PARSER=hiredis but hiredis is not installed; using the Python parser")
+        return "hiredis" if self.parser != "python" and HIREDIS_AVAILABLE else "python"
+
+    def _connection_kwargs(self, **overrides) -> Dict[str, Any]:
+        kwargs = {
+            "encoding": "utf-8",
+            "decode_responses": True,
+            "health_check_interval": 30,
+            "socket_connect_timeout": self.socket_connect_timeout,
+            "socket_timeout": self.socket_timeout,
+            "protocol": self.protocol,
+        }
+        if self._parser_name() == "python" and HIREDIS_AVAILABLE:
+            # redis-py only picks the Python parser itself when hiredis is
+            # missing, and exposes no public name for it. It switches to the
+            # RESP3 variant on its own after HELLO 3.
+            from redis._parsers import _AsyncRESP2Parser
+            kwargs["parser_class"] = _AsyncRESP2Parser
+        if self.socket_path:
+            kwargs["connection_class"] = UnixDomainSocketConnection
+            kwargs["path"] = self.socket_path
+        kwargs.update(overrides)
+        return kwargs
+
+    def _make_pool(self, max_connections: int, **overrides) -> InstrumentedConnectionPool:
+        kwargs = self._connection_kwargs(**overrides)
+        if self.socket_path:
+            # The URL still supplies db and credentials
+            url_kwargs = parse_url(self.redis_url)
+            for key in ("db", "username", "password"):
+                if url_kwargs.get(key) is not None:
+                    kwargs.setdefault(key, url_kwargs[key])
+            return InstrumentedConnectionPool(max_connections=max_connections, timeout=self.pool_timeout, **kwargs)
+        return InstrumentedConnectionPool.from_url(
+            self.redis_url, max_connections=max_connections, timeout=self.pool_timeout, **kwargs
+        )
+
+    def client(self, subscriber: bool = False) -> redis.Redis:
+        """
+        A client on the shared pool (cheap; close() leaves the pool open).
+
+        Args:
+            subscriber: For pub/sub and blocking reads, which must not time
+                out while idle
+        """
+        if subscriber:
+            if self._subscriber_pool is None:
+                self._subscriber_pool = self._make_pool(self.subscriber_connections, socket_timeout=None)
+            return redis.Redis(connection_pool=self._subscriber_pool)
+        if self._pool is None:
+            self._pool = self._make_pool(self.max_connections)
+        return redis.Redis(connection_pool=self._pool)
+
+    def dedicated_connection(self, **overrides):
+        """
+        A raw connection outside both pools, for protocol-level work such as
+        CLIENT TRACKING. Always RESP2, no health checks; the caller connects
+        and disconnects it.
+        """
+        if self._pool is None:
+            self._pool = self._make_pool(self.max_connections)
+        kwargs = {
+            **self._pool.connection_kwargs,
+            "protocol": 2,
+            "health_check_interval": 0,
+            **overrides,
+        }
+        self.dedicated_opened += 1
+        return self._pool.connection_class(**kwargs)
+
+    async def close(self):
+        """Disconnect every pooled connection (at shutdown, after the managers)."""
+        for pool in (self._pool, self._subscriber_pool):
+            if pool is not None:
+                await pool.disconnect()
+        self._pool = self._subscriber_pool = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Pool saturation and wait times for /metrics."""
+        return {
+            "protocol": self.protocol,
+            "parser": self._parser_name(),
+            "commands": self._pool.snapshot() if self._pool else {},
+            "subscribers": self._subscriber_pool.snapshot() if self._subscriber_pool else {},
+            "dedicated_opened": self.dedicated_opened,
+        }
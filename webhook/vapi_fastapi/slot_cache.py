@@ -0,0 +1,219 @@
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+import redis.asyncio as redis
+from .availability_cache import INVALIDATION_CHANNEL
+from .timezone_utils import TimeSlot, ARIZONA_TZ, MIN_ADVANCE_MINUTES
+from .redis_pool import RedisFactory
+
+# agent emails -> each agent's next open slots (one batched calendar read)
+SlotCompute = Callable[[List[str]], Awaitable[Dict[str, List[TimeSlot]]]]
+
+# Published after a worker stores freshly computed slots
+SLOTS_UPDATED_CHANNEL = "slots:precomputed:updated"
+
+LISTENER_RETRY_SECONDS = 1
+
+
+class SlotCache:
+    """
+    Per-agent precomputed open slots, ready before anyone asks.
+
+    One worker at a time (whoever takes the refresh lease) recomputes every
+    agent with a single batched free/busy read, stores the result in Redis
+    and announces it; every worker loads that copy into memory. Refreshes
+    run on a fixed interval and immediately after a calendar changes
+    (AvailabilityCache.invalidate on INVALIDATION_CHANNEL). Reads never
+    touch the calendar or Redis: they return the last loaded slots, minus
+    any that have become too soon to book.
+    """
+
+    def __init__(
+        self,
+        agents: List[str],
+        compute: SlotCompute,
+        redis_url: Optional[str] = None,
+        refresh_seconds: Optional[float] = None,
+        redis_factory: Optional[RedisFactory] = None
+    ):
+        """
+        Args:
+            agents: Agent calendars to keep warm
+            compute: Coroutine returning the next open slots of each agent given
+            redis_url: Redis holding the shared slots and carrying change notifications
+            refresh_seconds: Recompute interval (defaults to SLOT_CACHE_REFRESH,
+                capped at FREEBUSY_CACHE_TTL, 30)
+            redis_factory: Shared Redis connections (defaults to a private one for redis_url)
+        """
+        self.agents = list(dict.fromkeys(agents))
+        self.compute = compute
+        self.redis_url = redis_url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.redis_factory = redis_factory or RedisFactory(self.redis_url)
+        self._owns_factory = redis_factory is None
+        self.redis_client: Optional[redis.Redis] = None
+        # Recomputing less often than free/busy entries expire would offer
+        # slots from calendar reads older than the cache itself allows
+        freebusy_ttl = float(os.getenv("FREEBUSY_CACHE_TTL", "30"))
+        self.refresh_seconds = min(float(refresh_seconds or os.getenv("SLOT_CACHE_REFRESH", freebusy_ttl)), freebusy_ttl)
+        self.max_age_seconds = self.refresh_seconds * 5  # Never offer slots older than this
+        self.lease_ms = 15000  # Longer than one batched free/busy read
+        self._slots: Dict[str, Tuple[float, List[TimeSlot]]] = {}
+        self._refreshing: Optional[asyncio.Task] = None
+        self._dirty = False
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "loads": 0, "invalidations": 0, "failures": 0}
+
+    async def connect(self):
+        """Initialize Redis connection and start the refresh and change-listener loops."""
+        if not self.redis_client:
+            self.redis_client = self.redis_factory.client()
+            self._tasks = [
+                asyncio.create_task(self._refresh_loop()),
+                asyncio.create_task(self._listen_for_changes()),
+            ]
+
+    async def disconnect(self):
+        """Stop background work and close Redis connection."""
+        tasks = self._tasks + ([self._refreshing] if self._refreshing else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        if self.redis_client:
+            await self.redis_client.close()
+        if self._owns_factory:
+            await self.redis_factory.close()
+
+    def _get_key(self) -> str:
+        """Redis key naming: slots:precomputed (every agent's slots, one JSON document)"""
+        return "slots:precomputed"
+
+    def _get_lease_key(self) -> str:
+        """Redis key naming: slots:precomputed:lease"""
+        return "slots:precomputed:lease"
+
+    def get(self, agent_email: str, count: int = 3) -> List[TimeSlot]:
+        """
+        The agent's next `count` open slots, without waiting on the calendar.
+
+        Returns an empty list while the agent is still cold; stale entries
+        are served (within max_age_seconds) while a refresh runs.
+        """
+        entry = self._slots.get(agent_email)
+        age = time.time() - entry[0] if entry else None
+        if age is None or age > self.refresh_seconds:
+            self.refresh_soon()
+        if age is None or age > self.max_age_seconds:
+            self.stats["misses"] += 1
+            return []
+
+        cutoff = datetime.now(ARIZONA_TZ) + timedelta(minutes=MIN_ADVANCE_MINUTES)
+        self.stats["hits"] += 1
+        return [slot for slot in entry[1] if slot.start >= cutoff][:count]
+
+    def refresh_soon(self, changed: bool = False):
+        """
+        Bring the slots up to date in the background (coalesced).
+
+        Args:
+            changed: A calendar changed, so slots computed before now are
+                stale however recent they are
+        """
+        if self._refreshing:
+            # A change landed mid-refresh; run again once it finishes
+            self._dirty = self._dirty or changed
+            return
+        self._refreshing = asyncio.create_task(self._refresh(changed))
+        self._refreshing.add_done_callback(lambda _: setattr(self, "_refreshing", None))
+
+    async def _refresh(self, changed: bool):
+        while True:
+            self._dirty = False
+            try:
+                if changed or not await self._load_fresh():
+                    await self._recompute()
+            except Exception as e:
+                self.stats["failures"] += 1
+                logging.warning(f"Slot precompute failed: {e}")
+            if not self._dirty:
+                return
+            changed = True
+
+    async def _load_fresh(self) -> bool:
+        """Load the shared slots; True if they were computed within the refresh interval."""
+        data = await self.redis_client.get(self._get_key())
+        if not data:
+            return False
+        entry = json.loads(data)
+        computed_at = entry["computed_at"]
+        if not self._slots or computed_at > min(at for at, _ in self._slots.values()):
+            self._slots = {
+                agent: (computed_at, [TimeSlot(datetime.fromisoformat(start)) for start in starts])
+                for agent, starts in entry["agents"].items()
+            }
+            self.stats["loads"] += 1
+        return time.time() - computed_at <= self.refresh_seconds
+
+    async def _recompute(self):
+        """
+        Compute every agent in one batch and share the result, unless another
+        worker holds the lease. That worker saw the same calendar change (all
+        workers receive it) and will store and announce its own result.
+        """
+        lease_key = self._get_lease_key()
+        if not await self.redis_client.set(lease_key, str(uuid.uuid4()), nx=True, px=self.lease_ms):
+            return
+        try:
+            computed_at = time.time()
+            slots = await self.compute(self.agents)
+            entry = {
+                "computed_at": computed_at,
+                "agents": {agent: [slot.to_iso() for slot in agent_slots] for agent, agent_slots in slots.items()},
+            }
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.set(self._get_key(), json.dumps(entry), ex=int(self.max_age_seconds) + 1)
+                pipe.publish(SLOTS_UPDATED_CHANNEL, str(computed_at))
+                await pipe.execute()
+            self._slots = {agent: (computed_at, agent_slots) for agent, agent_slots in slots.items()}
+            self.stats["refreshes"] += 1
+        finally:
+            try:
+                await self.redis_client.delete(lease_key)
+            except Exception:
+                pass  # Lease expires on its own
+
+    async def _refresh_loop(self):
+        while True:
+            self.refresh_soon()
+            await asyncio.sleep(self.refresh_seconds)
+
+    async def _listen_for_changes(self):
+        """Recompute as soon as any worker reports a calendar change; load what others compute."""
+        while True:
+            try:
+                async with self.redis_factory.client(subscriber=True).pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL, SLOTS_UPDATED_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        if message["channel"] == SLOTS_UPDATED_CHANNEL:
+                            self.refresh_soon()
+                        elif message["data"] in self.agents:
+                            self.stats["invalidations"] += 1
+                            self.refresh_soon(changed=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Calendar change listener lost, retrying: {e}")
+            await asyncio.sleep(LISTENER_RETRY_SECONDS)
+            # Changes may have been missed while disconnected
+            self.refresh_soon(changed=True)
+
+    def get_stats(self) -> Dict[str, object]:
+        """Slot cache counters for /metrics."""
+        return {"agents_warm": len(self._slots), **self.stats}
@@ -1,42 +1,208 @@
 import uuid
 import asyncio
 from datetime import datetime, timedelta, timezone as dt_timezone
-from typing import Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 import logging
 import redis.asyncio as redis
+from .redis_pool import RedisFactory
+
+# Holds are hashes (hold_id, call_id, user_email, held_at) with a PX expiry.
+# Each operation is one script call, so a hold can't lapse and be re-taken by
+# another caller between our check and our write.
+
+# Whether KEYS[1] is still the hold ARGV[1]. Also reads the "hold_id:call|email|ts"
+# strings written before holds were hashes, until those expire.
+HOLD_OWNER_LUA = """
+local function owns(key, hold_id)
+    local kind = redis.call('TYPE', key)['ok']
+    if kind == 'hash' then
+        return redis.call('HGET', key, 'hold_id') == hold_id
+    elseif kind == 'string' then
+        local value = redis.call('GET', key)
+        return string.sub(value, 1, #hold_id + 1) == hold_id .. ':'
+    end
+    return false
+end
+"""
+
+# KEYS[1] = slot key; ARGV[1] = hold_id
+RELEASE_SCRIPT = HOLD_OWNER_LUA + """
+if owns(KEYS[1], ARGV[1]) then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS[1] = slot key; ARGV[1] = hold_id, ARGV[2] = new ttl_ms
+EXTEND_SCRIPT = HOLD_OWNER_LUA + """
+if owns(KEYS[1], ARGV[1]) then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Keep the chosen slot of the call's offer (as an ordinary hold) and release
+# the rest, reading the offer in the same step so a concurrent hold_offer
+# can't replace it in between. Slot keys are slot:SLOTID, as in ACQUIRE_SCRIPT.
+# KEYS[1] = offer key; ARGV[1] = chosen slot_id ('' = release everything)
+# Returns the hold_id now holding the chosen slot, or nil
+COMMIT_OFFER_SCRIPT = HOLD_OWNER_LUA + """
+local offer = redis.call('HMGET', KEYS[1], 'hold_id', 'slot_ids')
+if not offer[1] or not offer[2] then
+    return false
+end
+local committed = false
+for _, slot_id in ipairs(cjson.decode(offer[2])) do
+    local key = 'slot:' .. slot_id
+    if owns(key, offer[1]) then
+        if slot_id == ARGV[1] then
+            redis.call('HDEL', key, 'offered')
+            committed = offer[1]
+        else
+            redis.call('DEL', key)
+        end
+    end
+end
+redis.call('DEL', KEYS[1])
+return committed
+"""
+
+# Hold every free slot among KEYS[4..] (up to ARGV[8]) under one hold_id and
+# count attempts/contention per slot. As an offer (ARGV[7] = '1') the call may
+# re-take slots it was offered before, the slots of its previous offer that
+# weren't re-taken are released (their keys are slot:SLOTID, as _get_slot_key
+# builds them), and the held set is recorded in KEYS[3]. The counters are
+# today's sorted sets, trimmed to the ARGV[9] most attempted/contended slots
+# and expiring ARGV[6] seconds after the day's last attempt.
+# KEYS[1] = today's attempts zset, KEYS[2] = today's contended zset, KEYS[3] = offer key
+# ARGV = hold_id, call_id, user_email, held_at, ttl_ms, stats_ttl, offer, limit, stats_max, slot_ids...
+ACQUIRE_SCRIPT = HOLD_OWNER_LUA + """
+local held = {}
+local limit = tonumber(ARGV[8])
+for i = 4, #KEYS do
+    if #held >= limit then
+        break
+    end
+    local slot_id = ARGV[i + 6]
+    redis.call('ZINCRBY', KEYS[1], 1, slot_id)
+    local free = redis.call('EXISTS', KEYS[i]) == 0
+    if not free and ARGV[7] == '1' and redis.call('TYPE', KEYS[i])['ok'] == 'hash' then
+        local owner = redis.call('HMGET', KEYS[i], 'call_id', 'offered')
+        free = owner[1] == ARGV[2] and owner[2] == '1'
+    end
+    if free then
+        redis.call('DEL', KEYS[i])
+        redis.call('HSET', KEYS[i], 'hold_id', ARGV[1], 'call_id', ARGV[2], 'user_email', ARGV[3], 'held_at', ARGV[4])
+        if ARGV[7] == '1' then
+            redis.call('HSET', KEYS[i], 'offered', '1')
+        end
+        redis.call('PEXPIRE', KEYS[i], ARGV[5])
+        table.insert(held, slot_id)
+    else
+        redis.call('ZINCRBY', KEYS[2], 1, slot_id)
+    end
+end
+local stats_max = tonumber(ARGV[9])
+for i = 1, 2 do
+    redis.call('ZREMRANGEBYRANK', KEYS[i], 0, -stats_max - 1)
+    redis.call('EXPIRE', KEYS[i], ARGV[6])
+end
+if ARGV[7] == '1' then
+    local previous = redis.call('HMGET', KEYS[3], 'hold_id', 'slot_ids')
+    if previous[1] and previous[2] then
+        -- Re-taken slots carry the new hold_id now, so only the rest match
+        for _, slot_id in ipairs(cjson.decode(previous[2])) do
+            local key = 'slot:' .. slot_id
+            if owns(key, previous[1]) then
+                redis.call('DEL', key)
+            end
+        end
+    end
+    redis.call('DEL', KEYS[3])
+    if #held > 0 then
+        redis.call('HSET', KEYS[3], 'hold_id', ARGV[1], 'slot_ids', cjson.encode(held))
+        redis.call('PEXPIRE', KEYS[3], ARGV[5])
+    end
+end
+return held
+"""
 
 class SlotManager:
     """
-    Manages temporary slot holds using Redis SETNX (atomic SET if Not eXists).
+    Manages temporary slot holds, one atomic Lua script per operation.
     """
     
-    def __init__(self, redis_url: str = "redis://localhost:6379/0"):
+    def __init__(self, redis_url: str = "redis://localhost:6379/0", redis_factory: Optional[RedisFactory] = None):
         """
         Args:
             redis_url: Redis connection string
+            redis_factory: Shared Redis connections (defaults to a private one for redis_url)
         """
         self.redis_url = redis_url
+        self.redis_factory = redis_factory or RedisFactory(self.redis_url)
+        self._owns_factory = redis_factory is None
         self.redis_client: Optional[redis.Redis] = None
         self.hold_ttl_seconds = 60  # 60-second hold window for voice confirmation
+        # Contention is ranked per UTC day, so slots that are long past drop
+        # out with their day instead of crowding out new ones
+        self.stats_days = 7  # Days of rankings kept and reported
+        self.stats_max_slots = 1000  # Slots kept in each day's ranking
+        self._acquire_script = None
+        self._commit_offer_script = None
+        self._release_script = None
+        self._extend_script = None
     
     async def connect(self):
-        """Initialize Redis connection pool."""
-        self.redis_client = await redis.from_url(
-            self.redis_url,
-            encoding="utf-8",
-            decode_responses=True,
-            health_check_interval=30
-        )
+        """Initialize Redis connection pool and load the hold scripts."""
+        self.redis_client = self.redis_factory.client()
+        self._acquire_script = self.redis_client.register_script(ACQUIRE_SCRIPT)
+        self._release_script = self.redis_client.register_script(RELEASE_SCRIPT)
+        self._extend_script = self.redis_client.register_script(EXTEND_SCRIPT)
+        self._commit_offer_script = self.redis_client.register_script(COMMIT_OFFER_SCRIPT)
+        # SCRIPT LOAD up front so every hold operation is a single EVALSHA
+        # (a Redis restart is handled by the script's NOSCRIPT reload)
+        for script in (self._acquire_script, self._release_script, self._extend_script,
+                       self._commit_offer_script):
+            await self.redis_client.script_load(script.script)
     
     async def disconnect(self):
         """Close Redis connection."""
         if self.redis_client:
             await self.redis_client.close()
+        if self._owns_factory:
+            await self.redis_factory.close()
     
     def _get_slot_key(self, slot_id: str) -> str:
         """Redis key naming: slot:SLOTID"""
         return f"slot:{slot_id}"
     
+    def _get_offer_key(self, call_id: str) -> str:
+        """Redis key naming: slot:offer:CALLID"""
+        return f"slot:offer:{call_id}"
+    
+    def _stats_keys(self, day: datetime) -> List[str]:
+        """Redis key naming: slot:stats:attempts:YYYYMMDD, slot:stats:contended:YYYYMMDD (zset of slot_id by count)"""
+        return [f"slot:stats:{kind}:{day.strftime('%Y%m%d')}" for kind in ("attempts", "contended")]
+    
+    async def _acquire(
+        self,
+        slot_ids: List[str],
+        call_id: str,
+        user_email: str,
+        offer: bool,
+        limit: int
+    ) -> Tuple[str, List[str]]:
+        hold_id = str(uuid.uuid4())
+        now = datetime.now(dt_timezone.utc)
+        held = await self._acquire_script(
+            keys=self._stats_keys(now) + [self._get_offer_key(call_id)] + [self._get_slot_key(s) for s in slot_ids],
+            args=[
+                hold_id, call_id, user_email, int(now.timestamp()), self.hold_ttl_seconds * 1000,
+                self.stats_days * 86400, 1 if offer else 0, limit, self.stats_max_slots, *slot_ids
+            ]
+        )
+        return hold_id, held or []
+    
     async def acquire_hold(
         self, 
         slot_id: str, 
@@ -49,28 +215,14 @@ class SlotManager:
         if not self.redis_client:
              await self.connect()
 
-        key = self._get_slot_key(slot_id)
-        
-        # Create unique hold identifier
-        hold_id = str(uuid.uuid4())
-        hold_metadata = f"{call_id}|{user_email}|{int(datetime.now(dt_timezone.utc).timestamp())}"
-        
         try:
-            # Atomic: SET slot_id hold_metadata NX PX 60000
-            result = await self.redis_client.set(
-                key,
-                f"{hold_id}:{hold_metadata}",
-                nx=True,  # Only if not exists
-                px=self.hold_ttl_seconds * 1000  # TTL in milliseconds
-            )
+            hold_id, held = await self._acquire([slot_id], call_id, user_email, offer=False, limit=1)
             
-            if result:
+            if held:
                 # Success: acquired the hold
                 return True, hold_id
             else:
                 # Failed: slot already held
-                existing = await self.redis_client.get(key)
-                existing_call = existing.split("|")[0] if existing else "unknown"
                 return False, f"Slot already held by other caller"
         
         except Exception as e:
@@ -86,19 +238,8 @@ class SlotManager:
         key = self._get_slot_key(slot_id)
         
         try:
-            existing = await self.redis_client.get(key)
-            
-            if not existing:
-                return False
-            
-            # Verify hold_id matches
-            stored_hold_id = existing.split(":")[0]
-            if stored_hold_id != hold_id:
-                return False
-            
-            # Delete the key
-            await self.redis_client.delete(key)
-            return True
+            # Compare-and-delete: only our own hold
+            return bool(await self._release_script(keys=[key], args=[hold_id]))
         
         except Exception as e:
             logging.error(f"Error releasing hold: {str(e)}", exc_info=True)
@@ -108,35 +249,93 @@ class SlotManager:
         self, 
         slot_id: str, 
         hold_id: str,
-        extra_seconds: int = 30
+        extra_seconds: int = 30,
+        max_extend_seconds: int = 30
     ) -> bool:
         """
-        Extend a hold if user is still on call.
+        Extend a hold if user is still on call (or a booking is still being written).
+
+        Returns False only when the hold is gone or belongs to someone else;
+        Redis errors are raised, since the hold may well still be there.
         """
         if not self.redis_client:
              await self.connect()
 
         key = self._get_slot_key(slot_id)
-        max_extend_seconds = 30
         extend_seconds = min(extra_seconds, max_extend_seconds)
         
-        try:
-            existing = await self.redis_client.get(key)
-            
-            if not existing:
-                return False
-            
-            stored_hold_id = existing.split(":")[0]
-            if stored_hold_id != hold_id:
-                return False
-            
-            # Extend TTL
-            await self.redis_client.pexpire(
-                key, 
-                self.hold_ttl_seconds * 1000 + extend_seconds * 1000
-            )
-            return True
+        # Compare-and-extend: only our own hold
+        return bool(await self._extend_script(
+            keys=[key],
+            args=[hold_id, self.hold_ttl_seconds * 1000 + extend_seconds * 1000]
+        ))
+    
+    async def hold_offer(
+        self,
+        call_id: str,
+        slot_ids: List[str],
+        user_email: str = "",
+        limit: Optional[int] = None
+    ) -> Tuple[str, List[str]]:
+        """
+        Hold several candidate slots for a call while they are read out.
+        
+        Takes the free ones among slot_ids (in order, at most `limit`) under a
+        single hold_id in one atomic step, replacing the call's previous offer.
+        
+        Returns:
+            (hold_id, held slot_ids)
+        """
+        if not self.redis_client:
+             await self.connect()
+
+        return await self._acquire(slot_ids, call_id, user_email, offer=True, limit=limit or len(slot_ids))
+    
+    async def commit_offer(self, call_id: str, slot_id: str) -> Optional[str]:
+        """
+        Keep the slot the caller chose from their offer and release the others.
         
+        Returns the hold_id now holding slot_id, or None if it wasn't offered
+        to this call or its hold lapsed (the whole offer is released either way).
+        """
+        if not self.redis_client:
+             await self.connect()
+
+        return await self._commit_offer_script(keys=[self._get_offer_key(call_id)], args=[slot_id])
+    
+    async def release_offer(self, call_id: str):
+        """Release every slot still held by the call's offer (e.g. call ended)."""
+        try:
+            await self.commit_offer(call_id, "")
         except Exception as e:
-            logging.error(f"Error extending hold: {str(e)}", exc_info=True)
-            return False
+            logging.error(f"Error releasing offer: {str(e)}", exc_info=True)
+    
+    async def get_contention_stats(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Most contended slots over the last stats_days days: how often a hold
+        was refused because another caller had it, out of all attempts to hold it.
+        """
+        if not self.redis_client:
+             await self.connect()
+
+        today = datetime.now(dt_timezone.utc)
+        days = [self._stats_keys(today - timedelta(days=n)) for n in range(self.stats_days)]
+        contended = await self.redis_client.zunion([contended_key for _, contended_key in days], withscores=True)
+        ranked = sorted(contended, key=lambda entry: entry[1], reverse=True)[:limit]
+        if not ranked:
+            return []
+        slot_ids = [slot_id for slot_id, _ in ranked]
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for attempts_key, _ in days:
+                pipe.zmscore(attempts_key, slot_ids)
+            by_day = await pipe.execute()
+        attempts = [sum(day[i] or 0 for day in by_day) for i in range(len(slot_ids))]
+        return [
+            {
+                "slot_id": slot_id,
+                "contended": int(count),
+                "attempts": int(tried or count),
+                "contention_rate": round(count / max(tried or count, 1), 3),
+            }
+            for (slot_id, count), tried in zip(ranked, attempts)
+        ]
@@ -1,9 +1,15 @@
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, Optional, Any
-from pydantic import BaseModel
+from typing import Dict, Optional, Any, List, Tuple
+from pydantic import BaseModel, field_validator
+import asyncio
+import json
 import logging
 import redis.asyncio as redis
+from redis.exceptions import WatchError
 import os
+import time
+from .redis_pool import RedisFactory
 
 class CallContext(BaseModel):
     """Per-call context storage"""
@@ -12,6 +18,164 @@ class CallContext(BaseModel):
     timestamp: datetime
     last_activity: datetime
 
+    @field_validator("context", mode="before")
+    @classmethod
+    def _empty_context(cls, value):
+        # Documents written by the old Lua transition script: its cjson
+        # can't tell an empty object from an empty array
+        return {} if value == [] else value
+
+# ──────────────────────────────────────────────────────────────────
+# Hash storage: vapi:callh:{id} with top-level fields (state, timestamp,
+# last_activity) and one JSON-encoded "ctx:<key>" field per context key.
+# A call still stored as a legacy JSON document under vapi:call:{id}
+# (KEYS[2]) makes every script reply MIGRATE_REPLY without writing; the
+# caller migrates it (HASH_MIGRATE_SCRIPT) and runs the script again. The
+# values are re-encoded in Python because Lua's cjson turns nested empty
+# lists into objects.
+# ──────────────────────────────────────────────────────────────────
+
+MIGRATE_REPLY = "MIGRATE"
+
+HASH_COMMON_LUA = """
+-- 'hash' when the call's hash exists, 'legacy' when only its old JSON
+-- document does, nil when the call is unknown
+local function hash_status()
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return 'hash'
+    end
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        return 'legacy'
+    end
+    return nil
+end
+
+-- Whole hash, or only the named fields as name/value pairs
+local function read_hash(names)
+    if #names == 0 then
+        return redis.call('HGETALL', KEYS[1])
+    end
+    local values = redis.call('HMGET', KEYS[1], unpack(names))
+    local pairs_out = {}
+    for i, name in ipairs(names) do
+        if values[i] then
+            table.insert(pairs_out, name)
+            table.insert(pairs_out, values[i])
+        end
+    end
+    return pairs_out
+end
+"""
+
+# Moves a legacy document into the hash, keeping its remaining TTL, unless
+# it changed since the caller read it (the caller then reads it again).
+# KEYS[1] = hash key, KEYS[2] = legacy key
+# ARGV = ttl, legacy document as read, then field/value pairs to write
+HASH_MIGRATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 1
+end
+if redis.call('GET', KEYS[2]) ~= ARGV[2] then
+    return 0
+end
+local remaining = redis.call('TTL', KEYS[2])
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], remaining > 0 and remaining or tonumber(ARGV[1]))
+redis.call('DEL', KEYS[2])
+return 1
+"""
+
+# KEYS[1] = hash key, KEYS[2] = legacy key
+# ARGV = ttl, fields JSON (empty list = all)
+HASH_READ_SCRIPT = HASH_COMMON_LUA + """
+local status = hash_status()
+if status == 'legacy' then
+    return '""" + MIGRATE_REPLY + """'
+end
+if not status then
+    return {}
+end
+return read_hash(cjson.decode(ARGV[2]))
+"""
+
+# KEYS[1] = hash key, KEYS[2] = legacy key
+# ARGV = ttl, initial state, now
+HASH_INIT_SCRIPT = HASH_COMMON_LUA + """
+local status = hash_status()
+if status == 'legacy' then
+    return '""" + MIGRATE_REPLY + """'
+end
+if not status then
+    redis.call('HSET', KEYS[1], 'state', ARGV[2], 'timestamp', ARGV[3], 'last_activity', ARGV[3])
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+end
+return redis.call('HGETALL', KEYS[1])
+"""
+
+# KEYS[1] = hash key, KEYS[2] = legacy key
+# ARGV = ttl, then field/value pairs to write
+HASH_UPDATE_SCRIPT = HASH_COMMON_LUA + """
+local status = hash_status()
+if status == 'legacy' then
+    return '""" + MIGRATE_REPLY + """'
+end
+if not status then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+return 1
+"""
+
+# Validates a batch of transitions against the graph, writes the state,
+# last_activity and the context fields named in each step, and refreshes the
+# TTL in one server-side step; the reply carries only the requested fields.
+# KEYS[1] = hash key, KEYS[2] = legacy key
+# ARGV = transitions JSON, steps JSON, last_activity, ttl, fields JSON
+HASH_TRANSITION_SCRIPT = HASH_COMMON_LUA + """
+local status = hash_status()
+if status == 'legacy' then
+    return '""" + MIGRATE_REPLY + """'
+end
+if not status then
+    return {0, 'call not found'}
+end
+
+local state = redis.call('HGET', KEYS[1], 'state')
+local transitions = cjson.decode(ARGV[1])
+local updates = {}
+
+for _, step in ipairs(cjson.decode(ARGV[2])) do
+    local allowed = false
+    for _, target in ipairs(transitions[state] or {}) do
+        if target == step.state then
+            allowed = true
+        end
+    end
+    if not allowed then
+        return {0, state .. ' -> ' .. tostring(step.state)}
+    end
+
+    state = step.state
+    for _, value in ipairs(step.fields) do
+        table.insert(updates, value)
+    end
+end
+
+redis.call('HSET', KEYS[1], 'state', state, 'last_activity', ARGV[3], unpack(updates))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return {1, read_hash(cjson.decode(ARGV[5]))}
+"""
+
+# Prefix of the per-key context fields in hash storage
+CONTEXT_FIELD_PREFIX = "ctx:"
+
+# Pub/Sub channel Redis uses for RESP2 client-side caching invalidations
+INVALIDATE_CHANNEL = "__redis__:invalidate"
+TRACKING_PING_SECONDS = 10  # Liveness check for the tracking connections
+TRACKING_RETRY_SECONDS = 1
+GENERATION_LIMIT = 10000  # Per-call invalidation counters kept before starting a new epoch
+
 class StateManager:
     """
     Redis-backed state manager for Vapi calls.
@@ -27,34 +191,323 @@ class StateManager:
         "CONFIRMATION": set()  # Terminal state
     }
     
-    def __init__(self, redis_url: Optional[str] = None):
+    # Graph as shipped to the transition script
+    _TRANSITIONS_JSON = json.dumps({state: sorted(targets) for state, targets in TRANSITIONS.items()})
+    
+    STORAGE_MODES = {"json", "hash"}
+    
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        storage: Optional[str] = None,
+        local_cache_size: Optional[int] = None,
+        local_cache_ttl: Optional[float] = None,
+        redis_factory: Optional[RedisFactory] = None
+    ):
+        """
+        Args:
+            redis_url: Redis connection string
+            storage: "json" (one document per call) or "hash" (one field per
+                context key, partial updates); defaults to STATE_STORAGE
+            local_cache_size: Calls kept in the in-process LRU, 0 disables it
+                (defaults to STATE_LOCAL_CACHE_SIZE)
+            local_cache_ttl: Seconds a locally cached state may be served
+                (defaults to STATE_LOCAL_CACHE_TTL)
+            redis_factory: Shared Redis connections (defaults to a private one for redis_url)
+        """
         self.redis_url = redis_url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.redis_factory = redis_factory or RedisFactory(self.redis_url)
+        self._owns_factory = redis_factory is None
+        self.storage = (storage or os.getenv("STATE_STORAGE", "json")).lower()
+        if self.storage not in self.STORAGE_MODES:
+            raise ValueError(f"Unknown state storage: {self.storage}")
         self.redis_client: Optional[redis.Redis] = None
         self.ttl_seconds = 3600 # 1 hour TTL
+        self._hash_read_script = None
+        self._hash_init_script = None
+        self._hash_update_script = None
+        self._hash_transition_script = None
+        self._hash_migrate_script = None
+
+        # In-process LRU: call_id -> (expires_at, state), kept coherent by
+        # Redis client-side caching invalidations (CLIENT TRACKING BCAST)
+        self.local_cache_size = int(
+            local_cache_size if local_cache_size is not None else os.getenv("STATE_LOCAL_CACHE_SIZE", "0")
+        )
+        self.local_cache_ttl = float(
+            local_cache_ttl if local_cache_ttl is not None else os.getenv("STATE_LOCAL_CACHE_TTL", "30")
+        )
+        self._local: "OrderedDict[str, Tuple[float, CallContext]]" = OrderedDict()
+        self._tracking = False
+        # Per-call invalidation counters and a flush epoch; a fill is only
+        # cached if neither moved while its read was in flight
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        self._tracking_task: Optional[asyncio.Task] = None
+        self.cache_stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0, "flushes": 0}
         
     async def connect(self):
         """Initialize Redis connection."""
         if not self.redis_client:
-            self.redis_client = await redis.from_url(
-                self.redis_url,
-                encoding="utf-8",
-                decode_responses=True,
-                health_check_interval=30
-            )
+            self.redis_client = self.redis_factory.client()
+            # EVALSHA with automatic SCRIPT LOAD on first use
+            self._hash_read_script = self.redis_client.register_script(HASH_READ_SCRIPT)
+            self._hash_init_script = self.redis_client.register_script(HASH_INIT_SCRIPT)
+            self._hash_update_script = self.redis_client.register_script(HASH_UPDATE_SCRIPT)
+            self._hash_transition_script = self.redis_client.register_script(HASH_TRANSITION_SCRIPT)
+            self._hash_migrate_script = self.redis_client.register_script(HASH_MIGRATE_SCRIPT)
+
+            if self.local_cache_size > 0:
+                self._tracking_task = asyncio.create_task(self._track_invalidations())
 
     async def disconnect(self):
         """Close Redis connection."""
+        if self._tracking_task:
+            self._tracking_task.cancel()
+            try:
+                await self._tracking_task
+            except asyncio.CancelledError:
+                pass
+            self._tracking_task = None
         if self.redis_client:
             await self.redis_client.close()
+        if self._owns_factory:
+            await self.redis_factory.close()
+
+    # ──────────────────────────────────────────────────────────────
+    # In-process cache
+    # ──────────────────────────────────────────────────────────────
+
+    def _local_get(self, call_id: str) -> Optional[CallContext]:
+        """Serve a call's state from the LRU while invalidations are flowing."""
+        if not self._tracking:
+            self.cache_stats["misses"] += 1
+            return None
+
+        entry = self._local.get(call_id)
+        if entry and entry[0] > time.monotonic():
+            self._local.move_to_end(call_id)
+            self.cache_stats["hits"] += 1
+            return entry[1].model_copy(deep=True)
+
+        if entry:
+            del self._local[call_id]
+        self.cache_stats["misses"] += 1
+        return None
+
+    def _local_token(self, call_id: str) -> Tuple[int, int]:
+        """Taken before a read; _local_put drops the read if the call was written since."""
+        return self._epoch, self._generations.get(call_id, 0)
+
+    def _local_put(self, call_id: str, ctx: CallContext, token: Tuple[int, int]):
+        """Cache a state read, unless an invalidation of this call arrived while it was in flight."""
+        if not self._tracking or token != self._local_token(call_id):
+            return
+        self._local[call_id] = (time.monotonic() + self.local_cache_ttl, ctx.model_copy(deep=True))
+        self._local.move_to_end(call_id)
+        while len(self._local) > self.local_cache_size:
+            self._local.popitem(last=False)
+            self.cache_stats["evictions"] += 1
+
+    def _local_invalidate(self, call_id: str) -> bool:
+        """Drop a written call and any read of it still in flight. Returns whether it was cached."""
+        self._generations[call_id] = self._generations.get(call_id, 0) + 1
+        if len(self._generations) > max(GENERATION_LIMIT, 4 * self.local_cache_size):
+            # Forget old counters; the new epoch still rejects reads started before
+            self._generations.clear()
+            self._epoch += 1
+        return self._local.pop(call_id, None) is not None
+
+    def _local_evict(self, call_id: str):
+        """Drop a call after our own write (its invalidation may still be on the way)."""
+        self._local_invalidate(call_id)
+
+    def _local_flush(self):
+        """Drop everything; used whenever invalidations may have been missed."""
+        self._generations.clear()
+        self._epoch += 1
+        if self._local:
+            self.cache_stats["flushes"] += 1
+        self._local.clear()
+
+    def _state_key(self, call_id: str) -> str:
+        """Key holding the call's state for the active storage mode."""
+        return self._get_hash_key(call_id) if self.storage == "hash" else self._get_key(call_id)
+
+    async def _track_invalidations(self):
+        """
+        Keep the LRU coherent with Redis 6 client-side caching.
+
+        A listener connection subscribes to the invalidation channel and a
+        second connection enables BCAST tracking for the state key prefix,
+        redirected to it. Any write to a matching key, from any worker,
+        evicts that call. The cache is only served while both connections
+        are healthy; on any failure it is flushed and tracking re-established.
+        """
+        prefix = self._state_key("")
+        while True:
+            listener = tracker = None
+            try:
+                # Outside the pool: both are held for as long as tracking runs.
+                # RESP2 without health checks, whose PINGs would be misread
+                # in subscribed mode
+                listener = self.redis_factory.dedicated_connection()
+                tracker = self.redis_factory.dedicated_connection()
+                for conn in (listener, tracker):
+                    await conn.connect()
+
+                await listener.send_command("CLIENT", "ID")
+                listener_id = await listener.read_response()
+                await listener.send_command("SUBSCRIBE", INVALIDATE_CHANNEL)
+                await listener.read_response()
+                await tracker.send_command(
+                    "CLIENT", "TRACKING", "ON", "REDIRECT", listener_id, "BCAST", "PREFIX", prefix
+                )
+                await tracker.read_response()
+
+                self._local_flush()
+                self._tracking = True
+                logging.info(f"State cache tracking {prefix}* (up to {self.local_cache_size} calls)")
+
+                awaiting_pong = False
+                while True:
+                    message = await listener.read_response(timeout=TRACKING_PING_SECONDS)
+                    if message is None:
+                        # Idle: make sure both ends are still there
+                        if awaiting_pong:
+                            raise ConnectionError("invalidation listener stopped responding")
+                        await tracker.send_command("PING")
+                        if await tracker.read_response(timeout=TRACKING_PING_SECONDS) is None:
+                            raise ConnectionError("tracking connection stopped responding")
+                        await listener.send_command("PING")
+                        awaiting_pong = True
+                        continue
+                    if message[0] == "pong":
+                        awaiting_pong = False
+                    if message[0] != "message":
+                        continue
+
+                    keys = message[2]
+                    if keys is None:
+                        # FLUSHDB/FLUSHALL or tracking table overflow
+                        self._local_flush()
+                        continue
+                    for key in keys:
+                        if self._local_invalidate(key[len(prefix):]):
+                            self.cache_stats["invalidations"] += 1
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"State cache tracking lost, serving from Redis: {e}")
+            finally:
+                self._tracking = False
+                self._local_flush()
+                for conn in (listener, tracker):
+                    if conn:
+                        await conn.disconnect()
+
+            await asyncio.sleep(TRACKING_RETRY_SECONDS)
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Local cache counters for /metrics."""
+        return {
+            "enabled": self.local_cache_size > 0,
+            "tracking": self._tracking,
+            "size": len(self._local),
+            **self.cache_stats,
+        }
 
     def _get_key(self, call_id: str) -> str:
         return f"vapi:call:{call_id}"
 
+    def _get_hash_key(self, call_id: str) -> str:
+        """Redis key naming: vapi:callh:{call_id} (hash storage)"""
+        return f"vapi:callh:{call_id}"
+
+    def _hash_keys(self, call_id: str) -> List[str]:
+        """Hash key plus the legacy JSON key it migrates from."""
+        return [self._get_hash_key(call_id), self._get_key(call_id)]
+
+    @staticmethod
+    def _field_names(fields: Optional[List[str]]) -> str:
+        """Hash fields to read for the given context keys (None = everything)."""
+        if fields is None:
+            return "[]"
+        return json.dumps(
+            ["state", "timestamp", "last_activity"] + [CONTEXT_FIELD_PREFIX + key for key in fields]
+        )
+
+    @staticmethod
+    def _context_fields(update: Optional[Dict]) -> List[str]:
+        """Flattened field/value pairs for a context update."""
+        if update is not None and not isinstance(update, dict):
+            raise TypeError(f"Context update must be a dict, not {type(update).__name__}")
+        fields: List[str] = []
+        for key, value in (update or {}).items():
+            fields.append(CONTEXT_FIELD_PREFIX + key)
+            fields.append(json.dumps(value))
+        return fields
+
+    async def _run_hash_script(self, script, call_id: str, args: List[Any]) -> Any:
+        """Run a hash-storage script, migrating a legacy JSON document first if it asks."""
+        for _ in range(3):
+            reply = await script(keys=self._hash_keys(call_id), args=args)
+            if reply != MIGRATE_REPLY:
+                return reply
+            await self._migrate_legacy(call_id)
+        raise RuntimeError(f"Legacy state for {call_id} kept changing during migration")
+
+    async def _migrate_legacy(self, call_id: str):
+        """
+        Move a legacy JSON document into hash storage. Values are re-encoded
+        here rather than in Lua, whose cjson turns nested [] into {}.
+        """
+        raw = await self.redis_client.get(self._get_key(call_id))
+        if raw is None:
+            return
+        doc = json.loads(raw)
+        fields = ["state", doc["state"], "timestamp", doc["timestamp"], "last_activity", doc["last_activity"]]
+        if isinstance(doc.get("context"), dict):
+            fields += self._context_fields(doc["context"])
+        await self._hash_migrate_script(keys=self._hash_keys(call_id), args=[self.ttl_seconds, raw, *fields])
+
+    @staticmethod
+    def _from_hash(pairs: List[str]) -> Optional[CallContext]:
+        """Build a CallContext from flat HGETALL-style name/value pairs."""
+        if not pairs:
+            return None
+        data = dict(zip(pairs[::2], pairs[1::2]))
+        prefix_len = len(CONTEXT_FIELD_PREFIX)
+        return CallContext(
+            state=data["state"],
+            context={
+                name[prefix_len:]: json.loads(value)
+                for name, value in data.items()
+                if name.startswith(CONTEXT_FIELD_PREFIX)
+            },
+            timestamp=data["timestamp"],
+            last_activity=data["last_activity"]
+        )
+
     async def init_call(self, call_id: str, initial_state: str = "QUALIFICATION") -> CallContext:
         """Initialize call state in Redis."""
         if not self.redis_client:
             await self.connect()
 
+        if self.local_cache_size:
+            cached = self._local_get(call_id)
+            if cached:
+                return cached
+
+        if self.storage == "hash":
+            pairs = await self._run_hash_script(
+                self._hash_init_script, call_id,
+                [self.ttl_seconds, initial_state, datetime.utcnow().isoformat()]
+            )
+            self._local_evict(call_id)
+            return self._from_hash(pairs)
+
         key = self._get_key(call_id)
         
         # Check if exists
@@ -75,13 +528,33 @@ class StateManager:
             ctx.model_dump_json(),
             ex=self.ttl_seconds
         )
+        self._local_evict(call_id)
         return ctx
     
     async def get_state(self, call_id: str) -> Optional[CallContext]:
-        """Retrieve state from Redis."""
+        """Retrieve state (from the local cache when enabled, else Redis)."""
         if not self.redis_client:
             await self.connect()
 
+        if self.local_cache_size:
+            cached = self._local_get(call_id)
+            if cached:
+                return cached
+
+        token = self._local_token(call_id)
+        ctx = await self._load_state(call_id)
+        if ctx and self.local_cache_size:
+            self._local_put(call_id, ctx, token)
+        return ctx
+
+    async def _load_state(self, call_id: str) -> Optional[CallContext]:
+        """Retrieve state from Redis."""
+        if self.storage == "hash":
+            pairs = await self._run_hash_script(
+                self._hash_read_script, call_id, [self.ttl_seconds, self._field_names(None)]
+            )
+            return self._from_hash(pairs)
+
         key = self._get_key(call_id)
         data = await self.redis_client.get(key)
         
@@ -89,50 +562,173 @@ class StateManager:
             ctx = CallContext.model_validate_json(data)
             return ctx
         return None
+
+    async def get_fields(self, call_id: str, fields: Optional[List[str]] = None) -> Optional[CallContext]:
+        """
+        Retrieve state with only the named context keys (all when None).
+
+        Served from the local cache when possible; otherwise hash storage
+        reads just those fields and JSON storage filters the full document.
+        """
+        if not self.redis_client:
+            await self.connect()
+
+        if fields is None or self.storage == "json" or (self.local_cache_size and call_id in self._local):
+            ctx = await self.get_state(call_id)
+            if ctx and fields is not None:
+                ctx.context = {key: ctx.context[key] for key in fields if key in ctx.context}
+            return ctx
+
+        pairs = await self._run_hash_script(
+            self._hash_read_script, call_id, [self.ttl_seconds, self._field_names(fields)]
+        )
+        return self._from_hash(pairs)
+
+    async def update_context(self, call_id: str, context_update: Dict) -> bool:
+        """
+        Merge keys into the call context without changing state.
+
+        Hash storage writes only the given fields in one step; JSON storage
+        rewrites the document.
+        """
+        if not self.redis_client:
+            await self.connect()
+
+        if self.storage == "hash":
+            fields = self._context_fields(context_update) + ["last_activity", datetime.utcnow().isoformat()]
+            updated = await self._run_hash_script(
+                self._hash_update_script, call_id, [self.ttl_seconds, *fields]
+            )
+            self._local_evict(call_id)
+            return bool(updated)
+
+        ctx = await self._load_state(call_id)
+        if not ctx:
+            return False
+        ctx.context.update(context_update)
+        ctx.last_activity = datetime.utcnow()
+        await self.redis_client.set(self._get_key(call_id), ctx.model_dump_json(), ex=self.ttl_seconds)
+        self._local_evict(call_id)
+        return True
     
     async def transition_state(self, call_id: str, new_state: str, 
                         context_update: Optional[Dict] = None) -> bool:
         """
         Validate and execute state transition.
         """
+        return await self.transition(call_id, new_state, context_update) is not None
+
+    async def transition(self, call_id: str, new_state: str,
+                         context_update: Optional[Dict] = None,
+                         fields: Optional[List[str]] = None) -> Optional[CallContext]:
+        """
+        Atomically validate a transition, merge context and refresh the TTL.
+
+        Returns the updated CallContext, or None if the call is unknown or the
+        transition is not allowed. Hash storage does this in one round-trip,
+        and `fields` limits the returned context to the keys a prompt needs.
+        """
+        return await self.transition_many(call_id, [(new_state, context_update)], fields=fields)
+
+    async def transition_many(self, call_id: str,
+                              steps: List[Tuple[str, Optional[Dict]]],
+                              fields: Optional[List[str]] = None) -> Optional[CallContext]:
+        """
+        Apply several transitions for one call in a single atomic step.
+
+        Either every step is valid and applied, or nothing is written.
+        """
         if not self.redis_client:
             await self.connect()
 
+        for new_state, _ in steps:
+            if new_state not in self.VALID_STATES:
+                logging.warning(f"Invalid state: {new_state}")
+                return None
+
+        if self.storage == "hash":
+            ok, payload = await self._run_hash_script(
+                self._hash_transition_script, call_id,
+                [
+                    self._TRANSITIONS_JSON,
+                    json.dumps([{"state": state, "fields": self._context_fields(update)} for state, update in steps]),
+                    datetime.utcnow().isoformat(),
+                    self.ttl_seconds,
+                    self._field_names(fields),
+                ]
+            )
+        else:
+            ok, payload = await self._transition_json(call_id, steps)
+        self._local_evict(call_id)
+
+        if not ok:
+            logging.warning(f"Invalid transition for {call_id}: {payload}")
+            return None
+        if self.storage == "hash":
+            return self._from_hash(payload)
+        return payload
+
+    async def _transition_json(self, call_id: str,
+                               steps: List[Tuple[str, Optional[Dict]]]) -> Tuple[bool, Any]:
+        """
+        transition_many for JSON storage: read, apply and write the document
+        under WATCH, retrying if another writer got there first. The document
+        is decoded and encoded here rather than in Lua, whose cjson swaps
+        nested {} and [] and rounds large integers.
+
+        Returns (True, updated CallContext) or (False, reason).
+        """
+        for update in (update for _, update in steps):
+            if update is not None and not isinstance(update, dict):
+                raise TypeError(f"Context update must be a dict, not {type(update).__name__}")
+
         key = self._get_key(call_id)
-        
-        data = await self.redis_client.get(key)
-        if not data:
-            return False
-            
-        current_ctx = CallContext.model_validate_json(data)
-        
-        # Validate logic
-        if new_state not in self.VALID_STATES:
-            logging.warning(f"Invalid state: {new_state}")
-            return False
-            
-        if new_state not in self.TRANSITIONS.get(current_ctx.state, set()):
-             logging.warning(f"Invalid transition: {current_ctx.state} -> {new_state}")
-             return False
-        
-        # Update
-        current_ctx.state = new_state
-        if context_update:
-            current_ctx.context.update(context_update)
-        current_ctx.last_activity = datetime.utcnow()
-        
-        await self.redis_client.set(
-            key,
-            current_ctx.model_dump_json(),
-            ex=self.ttl_seconds
-        )
-        return True
+        for _ in range(3):
+            try:
+                async with self.redis_client.pipeline(transaction=True) as pipe:
+                    await pipe.watch(key)
+                    data = await pipe.get(key)
+                    if not data:
+                        return False, "call not found"
+
+                    ctx = CallContext.model_validate_json(data)
+                    for new_state, update in steps:
+                        if new_state not in self.TRANSITIONS.get(ctx.state, ()):
+                            return False, f"{ctx.state} -> {new_state}"
+                        ctx.state = new_state
+                        ctx.context.update(update or {})
+                    ctx.last_activity = datetime.utcnow()
+
+                    pipe.multi()
+                    pipe.set(key, ctx.model_dump_json(), ex=self.ttl_seconds)
+                    await pipe.execute()
+                    return True, ctx
+            except WatchError:
+                continue
+        raise RuntimeError(f"State for {call_id} kept changing during the transition")
+
+    async def migrate_json_keys(self, batch_size: int = 500) -> int:
+        """
+        Convert every legacy JSON call document to hash storage.
+
+        Calls are also migrated lazily on first access, so this is only
+        needed to finish a cutover eagerly. Returns the number migrated.
+        """
+        if not self.redis_client:
+            await self.connect()
+
+        migrated = 0
+        async for key in self.redis_client.scan_iter(match=self._get_key("*"), count=batch_size):
+            call_id = key[len(self._get_key("")):]
+            if await self._run_hash_script(
+                self._hash_read_script, call_id, [self.ttl_seconds, self._field_names([])]
+            ):
+                migrated += 1
+        return migrated
     
     async def cleanup_call(self, call_id: str):
         """Remove call state."""
         if not self.redis_client:
             await self.connect()
-        await self.redis_client.delete(self._get_key(call_id))
-
-# Singleton instance
-state_manager = StateManager()
+        await self.redis_client.delete(*self._hash_keys(call_id))
+        self._local_evict(call_id)
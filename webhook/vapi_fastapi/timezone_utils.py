@@ -1,7 +1,10 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, time
+from functools import lru_cache
 from zoneinfo import ZoneInfo
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Dict, Union
 import re
+import numpy as np
+from .availability_engine import BusinessHours, find_free_slots
 
 # Constants
 ARIZONA_TZ = ZoneInfo("America/Phoenix")  # MST, no DST
@@ -12,6 +15,19 @@ BUSINESS_START_HOUR = 8
 BUSINESS_END_HOUR = 18
 SLOT_DURATION_MINUTES = 30
 MIN_ADVANCE_MINUTES = 15  # Can't book in past or <15min away
+MAX_SEARCH_DAYS = 14  # Search up to 2 weeks ahead
+
+# Arizona never observes DST, so its UTC offset is a constant
+_ARIZONA_OFFSET = int(ARIZONA_TZ.utcoffset(datetime(2000, 1, 1)).total_seconds())
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+# (starts, ends) busy intervals as epoch-second arrays
+BusyArrays = Tuple[np.ndarray, np.ndarray]
+
+# Per-weekday opening hours (0=Monday); all days open by default
+BUSINESS_HOURS: BusinessHours = {
+    weekday: (time(BUSINESS_START_HOUR), time(BUSINESS_END_HOUR)) for weekday in range(7)
+}
 
 # Timezone mappings (common US zones)
 COMMON_TIMEZONES = {
@@ -27,61 +43,90 @@ COMMON_TIMEZONES = {
 }
 
 
+@lru_cache(maxsize=4096)
+def _render_voice_string(day: date, hour: int, minute: int, reference_day: date) -> str:
+    """Memoized voice rendering; slot lists repeat the same few keys all day."""
+    day_name = day.strftime("%A")
+    day_num = day.day
+    month_abbr = day.strftime("%b")
+    
+    # Ordinal suffix
+    if day_num in [1, 21, 31]:
+        suffix = "st"
+    elif day_num in [2, 22]:
+        suffix = "nd"
+    elif day_num in [3, 23]:
+        suffix = "rd"
+    else:
+        suffix = "th"
+    
+    am_pm = "am" if hour < 12 else "pm"
+    if hour > 12:
+        hour -= 12
+    elif hour == 0:
+        hour = 12
+    clock = f"{hour}:{minute:02d}" if minute else f"{hour}"
+    
+    # Add 'today' or 'tomorrow' if applicable
+    if day == reference_day:
+        relative_day = "Today, "
+    elif day == reference_day + timedelta(days=1):
+        relative_day = "Tomorrow, "
+    else:
+        relative_day = ""
+
+    return f"{relative_day}{day_name}, {month_abbr} {day_num}{suffix} at {clock}{am_pm}"
+
+
 class TimeSlot:
-    """Represents a bookable time slot in Arizona (MST)."""
+    """Represents a bookable time slot (or busy interval) in Arizona (MST)."""
+    
+    __slots__ = ("start", "end", "_iso")
     
-    def __init__(self, start: datetime, duration_minutes: int = SLOT_DURATION_MINUTES):
+    def __init__(
+        self,
+        start: datetime,
+        duration_minutes: int = SLOT_DURATION_MINUTES,
+        end: Optional[datetime] = None
+    ):
         """
         Args:
             start: Datetime in Arizona TZ
-            duration_minutes: Length of slot (default 30)
+            duration_minutes: Length of slot (default 30), ignored when end is given
+            end: Real end time, e.g. of a busy block
         """
-        self.start = start.astimezone(ARIZONA_TZ) if start.tzinfo else start.replace(tzinfo=ARIZONA_TZ)
-        self.end = self.start + timedelta(minutes=duration_minutes)
-    
-    def to_voice_string(self) -> str:
-        """Convert to voice-friendly format: 'Tuesday, Jan 23rd at 3pm'"""
-        day_name = self.start.strftime("%A")
-        day_num = self.start.day
-        month_abbr = self.start.strftime("%b")
-        
-        # Ordinal suffix
-        if day_num in [1, 21, 31]:
-            suffix = "st"
-        elif day_num in [2, 22]:
-            suffix = "nd"
-        elif day_num in [3, 23]:
-            suffix = "rd"
-        else:
-            suffix = "th"
-        
-        hour = self.start.hour
-        am_pm = "am" if hour < 12 else "pm"
-        if hour > 12:
-            hour -= 12
-        elif hour == 0:
-            hour = 12
-        
-        # Add 'today' or 'tomorrow' if applicable
-        now = datetime.now(ARIZONA_TZ)
-        if self.start.date() == now.date():
-            relative_day = "Today, "
-        elif self.start.date() == (now + timedelta(days=1)).date():
-            relative_day = "Tomorrow, "
-        else:
-            relative_day = ""
-
-        return f"{relative_day}{day_name}, {month_abbr} {day_num}{suffix} at {hour}{am_pm}"
+        self.start = _to_arizona(start)
+        self.end = _to_arizona(end) if end else self.start + timedelta(minutes=duration_minutes)
+        self._iso: Optional[str] = None
+    
+    @classmethod
+    def from_range(cls, start: datetime, end: datetime) -> "TimeSlot":
+        """Slot spanning an exact interval, e.g. a Google busy block."""
+        return cls(start, end=end)
+    
+    def to_voice_string(self, reference_day: Optional[date] = None) -> str:
+        """Convert to voice-friendly format: 'Tuesday, Jan 23rd at 3pm' (or '3:30pm')"""
+        reference_day = reference_day or datetime.now(ARIZONA_TZ).date()
+        start = self.start
+        return _render_voice_string(start.date(), start.hour, start.minute, reference_day)
     
     def to_iso(self) -> str:
         """ISO 8601 in Arizona TZ"""
-        return self.start.isoformat()
+        if self._iso is None:
+            self._iso = self.start.isoformat()
+        return self._iso
     
     def overlaps(self, other: "TimeSlot") -> bool:
         """Check if two slots overlap"""
         return self.start < other.end and other.start < self.end
 
 
+def _to_arizona(dt: datetime) -> datetime:
+    if dt.tzinfo is ARIZONA_TZ:
+        return dt
+    return dt.astimezone(ARIZONA_TZ) if dt.tzinfo else dt.replace(tzinfo=ARIZONA_TZ)
+
+
 def parse_caller_time(user_input: str, caller_timezone_abbr: str = "EST") -> datetime:
     """
     Parse user voice input like "3pm" and convert to Arizona time.
@@ -147,11 +192,8 @@ def validate_business_hours(slot: TimeSlot) -> Tuple[bool, Optional[str]]:
     return True, None
 
 
-def get_next_available_slots(blocked_times: list[TimeSlot], count: int = 3) -> list[TimeSlot]:
-    """
-    Generate next available 30-minute slots, excluding blocked times.
-    """
-    slots: list[TimeSlot] = []
+def _first_search_time() -> datetime:
+    """Earliest bookable start: now + advance notice, aligned to the slot grid."""
     current_time = datetime.now(ARIZONA_TZ)
     search_time = current_time + timedelta(minutes=MIN_ADVANCE_MINUTES)
     
@@ -172,35 +214,168 @@ def get_next_available_slots(blocked_times: list[TimeSlot], count: int = 3) -> l
         search_time = search_time.replace(hour=search_time.hour + 1, minute=0, second=0, microsecond=0)
     else:
         search_time = search_time.replace(minute=minute_block, second=0, microsecond=0)
+    return search_time
 
-    
-    max_search_days = 14  # Search up to 2 weeks ahead
-    days_searched = 0
-    
-    while len(slots) < count and days_searched < max_search_days:
-        # Generate slots for this day
-        current_slot_time = search_time
-        
-        # Iterate through the day until end of business hours
-        while (current_slot_time.hour < BUSINESS_END_HOUR and 
-               len(slots) < count):
-            
-            # Additional check: Don't schedule exactly at closing time if duration pushes past it
-            
-            slot = TimeSlot(current_slot_time)
-            
-            # Check if slot conflicts with any blocked time
-            conflicts = any(slot.overlaps(blocked) for blocked in blocked_times)
-            
-            if not conflicts:
-                slots.append(slot)
-            
-            current_slot_time += timedelta(minutes=SLOT_DURATION_MINUTES)
-        
-        # Move to next day start
-        search_time = (search_time + timedelta(days=1)).replace(
-            hour=BUSINESS_START_HOUR, minute=0
+
+def get_next_available_slots(
+    blocked_times: list[TimeSlot],
+    count: int = 3,
+    duration_minutes: int = SLOT_DURATION_MINUTES,
+    buffer_minutes: int = 0,
+    hours: Optional[BusinessHours] = None
+) -> list[TimeSlot]:
+    """
+    Generate next available slots (30 minutes by default), excluding blocked times.
+    """
+    starts = find_free_slots(
+        blocked_times,
+        _first_search_time(),
+        hours or BUSINESS_HOURS,
+        count=count,
+        slot_minutes=duration_minutes,
+        step_minutes=SLOT_DURATION_MINUTES,
+        buffer_minutes=buffer_minutes,
+        max_days=MAX_SEARCH_DAYS
+    )
+    return [TimeSlot(start, duration_minutes=duration_minutes) for start in starts]
+
+
+def _slot_grid(
+    search_from: datetime,
+    hours: BusinessHours,
+    days: int,
+    duration_minutes: int
+) -> np.ndarray:
+    """Candidate slot starts over the horizon as int64 epoch minutes."""
+    step = SLOT_DURATION_MINUTES
+    first = int(search_from.timestamp()) // 60
+    day_grids = []
+
+    for day_offset in range(days):
+        day = search_from.date() + timedelta(days=day_offset)
+        window = hours.get(day.weekday())
+        if not window:
+            continue
+
+        open_min = int(datetime.combine(day, window[0], tzinfo=ARIZONA_TZ).timestamp()) // 60
+        close_min = int(datetime.combine(day, window[1], tzinfo=ARIZONA_TZ).timestamp()) // 60
+        if first > open_min:
+            open_min += -((open_min - first) // step) * step  # Round up onto the grid
+        day_grids.append(np.arange(open_min, close_min - duration_minutes + 1, step, dtype=np.int64))
+
+    return np.concatenate(day_grids) if day_grids else np.empty(0, dtype=np.int64)
+
+
+def busy_to_epoch_arrays(blocks: list) -> BusyArrays:
+    """
+    Busy blocks (anything with .start/.end) as float64 epoch-second arrays.
+
+    Arizona has a fixed UTC offset, so Arizona datetimes are converted with
+    plain wall-clock arithmetic instead of the much slower .timestamp().
+    """
+    def to_epoch(dts):
+        return np.fromiter(
+            (
+                (dt.toordinal() - _EPOCH_ORDINAL) * 86400 + dt.hour * 3600 + dt.minute * 60 + dt.second - _ARIZONA_OFFSET
+                if dt.tzinfo is ARIZONA_TZ else dt.timestamp()
+                for dt in dts
+            ),
+            dtype=np.float64,
+            count=len(blocks)
         )
-        days_searched += 1
-    
-    return slots
+
+    return to_epoch(b.start for b in blocks), to_epoch(b.end for b in blocks)
+
+
+def get_available_slots_batch(
+    busy_by_agent: Dict[str, Union[list, BusyArrays]],
+    count: int = 3,
+    days: int = MAX_SEARCH_DAYS,
+    duration_minutes: int = SLOT_DURATION_MINUTES,
+    buffer_minutes: int = 0,
+    hours: Optional[BusinessHours] = None
+) -> Dict[str, list[TimeSlot]]:
+    """
+    First `count` free slots for every agent, all searched from the same start.
+
+    Each agent's busy blocks are either a list of objects with .start/.end or
+    (starts, ends) epoch-second arrays from busy_to_epoch_arrays. Block lists
+    go through the per-agent sweep (find_free_slots), which only filters the
+    blocks of its first run of days for a short offer; converting every block
+    to numbers first costs several times more. Epoch arrays, already
+    numeric, are answered in one vectorized pass: slot grid and blocks become
+    int64 epoch minutes, each agent's blocks are shifted into a disjoint range
+    so one sorted array answers "does any block overlap this slot" for the
+    whole agent x slot matrix with a single searchsorted, and only the
+    returned slots are turned back into TimeSlots.
+    Matches get_next_available_slots per agent.
+    """
+    search_from = _first_search_time()
+    hours = hours or BUSINESS_HOURS
+    results: Dict[str, list[TimeSlot]] = {}
+    arrays_by_agent: Dict[str, BusyArrays] = {}
+    for agent, busy in busy_by_agent.items():
+        if isinstance(busy, tuple):
+            arrays_by_agent[agent] = busy
+            continue
+        starts = find_free_slots(
+            busy, search_from, hours, count=count, slot_minutes=duration_minutes,
+            step_minutes=SLOT_DURATION_MINUTES, buffer_minutes=buffer_minutes, max_days=days
+        )
+        results[agent] = [TimeSlot(start, duration_minutes=duration_minutes) for start in starts]
+    if arrays_by_agent:
+        results.update(_slots_from_arrays(arrays_by_agent, search_from, count, days, duration_minutes,
+                                          buffer_minutes, hours))
+    return {agent: results[agent] for agent in busy_by_agent}
+
+
+def _slots_from_arrays(
+    busy_by_agent: Dict[str, BusyArrays],
+    search_from: datetime,
+    count: int,
+    days: int,
+    duration_minutes: int,
+    buffer_minutes: int,
+    hours: BusinessHours
+) -> Dict[str, list[TimeSlot]]:
+    """get_available_slots_batch for epoch arrays, vectorized across agents."""
+    agents = list(busy_by_agent)
+    grid = _slot_grid(search_from, hours, days, duration_minutes)
+    if not len(grid):
+        return {agent: [] for agent in agents}
+
+    base = int(grid[0])
+    span = int(grid[-1]) - base
+    # Clamp blocks just outside the horizon so agents' ranges stay disjoint
+    low = -buffer_minutes - 1
+    high = span + duration_minutes + buffer_minutes + 1
+    stride = high - low + 1
+
+    arrays = list(busy_by_agent.values())
+    offsets = np.arange(len(agents), dtype=np.int64) * stride
+    block_offsets = np.repeat(offsets, [len(agent_starts) for agent_starts, _ in arrays])
+
+    # Floor starts / ceil ends to whole minutes (conservative for odd seconds)
+    starts = np.concatenate([np.asarray(a[0], dtype=np.float64) for a in arrays] + [np.empty(0)])
+    ends = np.concatenate([np.asarray(a[1], dtype=np.float64) for a in arrays] + [np.empty(0)])
+    starts = np.clip(np.floor(starts / 60).astype(np.int64) - base, low, high) + block_offsets
+    ends = np.clip(np.ceil(ends / 60).astype(np.int64) - base, low, high) + block_offsets
+
+    order = np.argsort(starts, kind="stable")
+    starts = starts[order]
+    # Running max of ends: the latest any block starting at or before here reaches
+    reach = np.concatenate(([np.iinfo(np.int64).min], np.maximum.accumulate(ends[order])))
+
+    slot_starts = (grid - base)[None, :] + offsets[:, None]  # agents x slots
+    blocks_before = np.searchsorted(starts, slot_starts + duration_minutes + buffer_minutes, side="left")
+    free = reach[blocks_before] <= slot_starts - buffer_minutes
+
+    # Keep each agent's first `count` free slots; nonzero returns them row by row, in time order
+    picked_agents, picked_slots = np.nonzero(free & (np.cumsum(free, axis=1) <= count))
+
+    results: Dict[str, list[TimeSlot]] = {agent: [] for agent in agents}
+    for idx, slot in zip(picked_agents.tolist(), picked_slots.tolist()):
+        results[agents[idx]].append(
+            TimeSlot(datetime.fromtimestamp(int(grid[slot]) * 60, ARIZONA_TZ), duration_minutes=duration_minutes)
+        )
+    return results
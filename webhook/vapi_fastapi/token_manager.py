@@ -0,0 +1,186 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Optional, List, Tuple
+import asyncio
+import json
+import logging
+import os
+import random
+import redis.asyncio as redis
+from google.oauth2 import service_account
+from google.auth.transport.requests import Request
+from .redis_pool import RedisFactory
+
+TOKEN_CACHE_FILE = "/tmp/google_calendar_token.json"
+
+class TokenManager:
+    """
+    Keeps a valid Google OAuth2 access token ready without blocking the event loop.
+
+    The service account key is read once, refreshes run in the default executor
+    with at most one in flight per worker, and a background task renews the
+    token before it expires. Tokens are shared across workers through Redis
+    (when configured) and TOKEN_CACHE_FILE, so a worker that starts or wakes up
+    late reuses a sibling's token instead of refreshing its own.
+    """
+
+    REFRESH_MARGIN = timedelta(minutes=5)  # Renew this long before expiry
+    REFRESH_JITTER_SECONDS = 60  # Spread worker refreshes so one wins and the rest reuse it
+
+    def __init__(
+        self,
+        credentials_path: str,
+        scopes: List[str],
+        redis_url: Optional[str] = None,
+        cache_file: str = TOKEN_CACHE_FILE,
+        redis_factory: Optional[RedisFactory] = None
+    ):
+        self.credentials_path = credentials_path
+        self.scopes = scopes
+        self.redis_url = redis_url
+        self.redis_factory = redis_factory or (RedisFactory(redis_url) if redis_url else None)
+        self._owns_factory = redis_factory is None
+        self.redis_client: Optional[redis.Redis] = None
+        self.cache_file = cache_file
+        self.token: Optional[str] = None
+        self.token_expiry: Optional[datetime] = None
+        self._credentials: Optional[service_account.Credentials] = None
+        self._request: Optional[Request] = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _get_key(self) -> str:
+        """Redis key naming: google:token:CREDENTIALS_FILE"""
+        return f"google:token:{os.path.basename(self.credentials_path)}"
+
+    def _is_fresh(self, expiry: Optional[datetime], margin: timedelta = timedelta(0)) -> bool:
+        return expiry is not None and datetime.now(dt_timezone.utc) + margin < expiry
+
+    async def start(self):
+        """Fetch a token up front and start proactive renewal."""
+        await self.get_token()
+
+    async def close(self):
+        """Stop background renewal and close Redis connection."""
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self.redis_client:
+            await self.redis_client.close()
+        if self.redis_factory and self._owns_factory:
+            await self.redis_factory.close()
+
+    async def get_token(self) -> str:
+        """
+        Return a valid access token; only waits when no usable token exists yet.
+        """
+        if self.token and self._is_fresh(self.token_expiry):
+            return self.token
+
+        await self._refresh()
+        return self.token
+
+    async def _refresh(self, force: bool = False):
+        """Adopt a shared token or refresh, keeping a single refresh in flight."""
+        async with self._lock:
+            # Whoever held the lock before us may already have renewed it
+            if not force and self.token and self._is_fresh(self.token_expiry, self.REFRESH_MARGIN):
+                return
+
+            shared = await self._load_shared()
+            if shared and self._is_fresh(shared[1], self.REFRESH_MARGIN):
+                self.token, self.token_expiry = shared
+            else:
+                try:
+                    loop = asyncio.get_running_loop()
+                    self.token, self.token_expiry = await loop.run_in_executor(None, self._refresh_blocking)
+                except Exception as e:
+                    raise Exception(f"Failed to refresh Google Auth token: {str(e)}")
+                await self._store_shared()
+
+            self._schedule_refresh()
+
+    def _refresh_blocking(self) -> Tuple[str, datetime]:
+        """Runs in the executor: load the key once, then refresh over HTTP."""
+        if not self._credentials:
+            self._credentials = service_account.Credentials.from_service_account_file(
+                self.credentials_path, scopes=self.scopes
+            )
+            self._request = Request()
+
+        self._credentials.refresh(self._request)
+
+        # google-auth reports expiry as naive UTC
+        return self._credentials.token, self._credentials.expiry.replace(tzinfo=dt_timezone.utc)
+
+    def _schedule_refresh(self):
+        """(Re)arm the background renewal shortly before the token expires."""
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+
+        delay = (self.token_expiry - datetime.now(dt_timezone.utc) - self.REFRESH_MARGIN).total_seconds()
+        delay += random.uniform(0, self.REFRESH_JITTER_SECONDS)
+        self._refresh_task = asyncio.ensure_future(self._refresh_later(max(delay, 0)))
+
+    async def _refresh_later(self, delay: float):
+        await asyncio.sleep(delay)
+        try:
+            await self._refresh(force=True)
+        except Exception as e:
+            logging.error(f"Background token refresh failed: {e}", exc_info=True)
+            # Retry soon; the current token stays in use until it actually expires
+            self._refresh_task = asyncio.ensure_future(self._refresh_later(30))
+
+    async def _load_shared(self) -> Optional[Tuple[str, datetime]]:
+        """Read a token published by another worker (Redis first, then file)."""
+        raw = None
+        if self.redis_factory:
+            try:
+                if not self.redis_client:
+                    self.redis_client = self.redis_factory.client()
+                raw = await self.redis_client.get(self._get_key())
+            except Exception as e:
+                logging.warning(f"Shared token read failed: {e}")
+
+        if not raw:
+            raw = await asyncio.get_running_loop().run_in_executor(None, self._read_cache_file)
+
+        if not raw:
+            return None
+        try:
+            data = json.loads(raw)
+            return data["token"], datetime.fromisoformat(data["expiry"])
+        except (ValueError, KeyError):
+            return None
+
+    async def _store_shared(self):
+        """Publish the current token for other workers."""
+        raw = json.dumps({"token": self.token, "expiry": self.token_expiry.isoformat()})
+        ttl = int((self.token_expiry - datetime.now(dt_timezone.utc)).total_seconds())
+        if ttl <= 0:
+            return
+
+        if self.redis_client:
+            try:
+                await self.redis_client.set(self._get_key(), raw, ex=ttl)
+            except Exception as e:
+                logging.warning(f"Shared token write failed: {e}")
+
+        await asyncio.get_running_loop().run_in_executor(None, self._write_cache_file, raw)
+
+    def _read_cache_file(self) -> Optional[str]:
+        try:
+            with open(self.cache_file, "r") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_cache_file(self, raw: str):
+        # Write-then-rename so readers never see a partial file
+        tmp_path = f"{self.cache_file}.{os.getpid()}"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(raw)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            logging.warning(f"Token cache file write failed: {e}")
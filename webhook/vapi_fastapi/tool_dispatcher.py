@@ -0,0 +1,236 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+import weakref
+
+import orjson
+
+# handler(call_id, parameters, org_id) -> result entry without toolCallId,
+# e.g. {"result": "...", "assistantOverride": {...}}
+ToolHandler = Callable[[str, Dict[str, Any], Optional[str]], Awaitable[Dict[str, Any]]]
+
+# parameters -> key for reusing a recent result when the tool runs late
+CacheKey = Callable[[Dict[str, Any]], Optional[Hashable]]
+
+DEFAULT_TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT_SECONDS", "4"))
+RESULT_CACHE_SIZE = 512
+RESULT_CACHE_TTL = 300  # Seconds a result may stand in for a late tool
+
+# Upper bounds (ms) of the latency histogram buckets; the last is +Inf
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LatencyHistogram:
+    """Cumulative-bucket latency histogram, Prometheus style."""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.total += 1
+        self.sum_ms += ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative, buckets = 0, {}
+        for bound, count in zip(LATENCY_BUCKETS_MS + ("+Inf",), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets_ms": buckets, "count": self.total, "sum_ms": round(self.sum_ms, 1)}
+
+
+@dataclass
+class ToolSpec:
+    """A registered tool and how it may be scheduled."""
+    name: str
+    handler: ToolHandler
+    touches_state: bool = False  # Serialized with other state tools of the same call
+    timeout: float = DEFAULT_TOOL_TIMEOUT  # Hard limit; the tool is cancelled after this
+    budget: Optional[float] = None  # Seconds before the caller gets a cached/degraded answer
+    fallback: Optional[ToolHandler] = None  # Degraded answer when over budget with nothing cached
+    cache_key: Optional[CacheKey] = None  # Enables reusing recent results when over budget
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    outcomes: Dict[str, int] = field(default_factory=lambda: {
+        "ok": 0, "error": 0, "timeout": 0, "cached": 0, "degraded": 0
+    })
+
+
+def error_result(message: str) -> Dict[str, Any]:
+    """Tool result entry Vapi reads back to the model as an error."""
+    return {"result": json.dumps({"status": "error", "message": message})}
+
+
+class ToolDispatcher:
+    """
+    Tool registry that runs the tool calls of one Vapi tool-calls message concurrently.
+
+    Independent tools run together under asyncio.gather; tools that touch
+    call state take a per-call lock, so they apply one at a time in the
+    order the model emitted them. Results come back in toolCallList order
+    whatever order they finish in.
+
+    A tool that misses its latency budget keeps running in the background
+    (until its timeout) while the caller gets a recent cached result or the
+    tool's degraded fallback, so the voice agent is never left silent.
+    """
+
+    def __init__(self):
+        self.tools: Dict[str, ToolSpec] = {}
+        # call_id -> lock, dropped once no dispatch holds a reference
+        self._call_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        # (tool, cache key) -> (expires_at, result entry)
+        self._results: "OrderedDict[Tuple[str, Hashable], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._background: Set[asyncio.Task] = set()
+
+    def register(self, name: str, handler: ToolHandler, touches_state: bool = False,
+                 timeout: Optional[float] = None, budget: Optional[float] = None,
+                 fallback: Optional[ToolHandler] = None, cache_key: Optional[CacheKey] = None):
+        """
+        Args:
+            name: Function name the model calls
+            handler: Coroutine producing the tool's result entry
+            touches_state: Whether the tool reads or writes call state
+            timeout: Seconds before the call is abandoned (defaults to TOOL_TIMEOUT_SECONDS)
+            budget: Seconds the caller waits before getting a cached or degraded answer
+            fallback: Coroutine producing the degraded answer
+            cache_key: Maps parameters to a key under which results are reused
+        """
+        self.tools[name] = ToolSpec(
+            name, handler, touches_state, timeout or DEFAULT_TOOL_TIMEOUT, budget, fallback, cache_key
+        )
+
+    def tool(self, name: str, **options) -> Callable[[ToolHandler], ToolHandler]:
+        """Decorator form of register()."""
+        def decorator(handler: ToolHandler) -> ToolHandler:
+            self.register(name, handler, **options)
+            return handler
+        return decorator
+
+    def _call_lock(self, call_id: str) -> asyncio.Lock:
+        lock = self._call_locks.get(call_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._call_locks[call_id] = lock
+        return lock
+
+    @staticmethod
+    def _parameters(tool_call: Dict[str, Any]) -> Dict[str, Any]:
+        # Vapi usually sends 'arguments' as a JSON string inside 'function'
+        arguments = tool_call.get("function", {}).get("arguments", "{}")
+        if isinstance(arguments, (str, bytes)):
+            try:
+                arguments = orjson.loads(arguments)
+            except orjson.JSONDecodeError:
+                return {}
+        return arguments if isinstance(arguments, dict) else {}
+
+    def _cached(self, spec: ToolSpec, parameters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = spec.cache_key(parameters) if spec.cache_key else None
+        if key is None:
+            return None
+        entry = self._results.get((spec.name, key))
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def _store(self, spec: ToolSpec, parameters: Dict[str, Any], result: Dict[str, Any]):
+        key = spec.cache_key(parameters)
+        if key is None:
+            return
+        key = (spec.name, key)
+        self._results[key] = (time.monotonic() + RESULT_CACHE_TTL, result)
+        self._results.move_to_end(key)
+        if len(self._results) > RESULT_CACHE_SIZE:
+            self._results.popitem(last=False)
+
+    def _finished(self, spec: ToolSpec, parameters: Dict[str, Any], call_id: str,
+                  started: float, task: asyncio.Task):
+        """Record latency and outcome once the tool itself completes, even if late."""
+        spec.latency.observe((time.perf_counter() - started) * 1000)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if isinstance(error, asyncio.TimeoutError):
+            spec.outcomes["timeout"] += 1
+            logging.warning(f"Tool {spec.name} timed out after {spec.timeout}s for {call_id}")
+        elif error:
+            spec.outcomes["error"] += 1
+            logging.error(f"Tool {spec.name} failed for {call_id}: {error}", exc_info=error)
+        else:
+            spec.outcomes["ok"] += 1
+            if spec.cache_key:
+                self._store(spec, parameters, task.result())
+
+    async def _run(self, call_id: str, tool_call: Dict[str, Any], org_id: Optional[str],
+                   lock: asyncio.Lock) -> Dict[str, Any]:
+        """One tool call, always producing a result entry."""
+        tool_name = tool_call.get("function", {}).get("name")
+        spec = self.tools.get(tool_name)
+        if spec is None:
+            return error_result(f"Unknown tool: {tool_name}")
+
+        parameters = self._parameters(tool_call)
+
+        async def invoke():
+            if spec.touches_state:
+                async with lock:
+                    return await spec.handler(call_id, parameters, org_id)
+            return await spec.handler(call_id, parameters, org_id)
+
+        # The timeout includes any wait for the call's state lock
+        started = time.perf_counter()
+        task = asyncio.create_task(asyncio.wait_for(invoke(), spec.timeout))
+        task.add_done_callback(lambda t: self._finished(spec, parameters, call_id, started, t))
+
+        budget = spec.budget if spec.budget and spec.budget < spec.timeout else None
+        done, _ = await asyncio.wait({task}, timeout=budget)
+        if task in done:
+            if task.cancelled() or isinstance(task.exception(), asyncio.TimeoutError):
+                return error_result(f"{tool_name} timed out")
+            if task.exception():
+                return error_result(f"{tool_name} failed")
+            return task.result()
+
+        # Over budget: let it finish in the background (warming the cache)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+        cached = self._cached(spec, parameters)
+        if cached:
+            spec.outcomes["cached"] += 1
+            return cached
+
+        spec.outcomes["degraded"] += 1
+        if spec.fallback:
+            try:
+                return await spec.fallback(call_id, parameters, org_id)
+            except Exception as e:
+                logging.error(f"Fallback for {tool_name} failed: {e}", exc_info=True)
+        return error_result(f"{tool_name} is taking longer than expected")
+
+    async def dispatch(self, call_id: str, tool_calls: List[Dict[str, Any]],
+                       org_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Run a toolCallList and return its results in the same order."""
+        lock = self._call_lock(call_id)  # Held for the whole dispatch
+        entries = await asyncio.gather(*[
+            self._run(call_id, tool_call, org_id, lock) for tool_call in tool_calls
+        ])
+        return [
+            {"toolCallId": tool_call.get("id"), **entry}
+            for tool_call, entry in zip(tool_calls, entries)
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-tool latency histograms and outcome counters for /metrics."""
+        return {
+            name: {"latency": spec.latency.snapshot(), **spec.outcomes}
+            for name, spec in self.tools.items()
+        }
@@ -0,0 +1,56 @@
+from pydantic import BaseModel
+from typing import List, Dict, Any, Optional, Literal, Type
+import orjson
+
+# Vapi Models
+class VapiCall(BaseModel):
+    id: str
+    orgId: str
+
+class VapiAssistantRequestMessage(BaseModel):
+    type: Literal["assistant-request"]
+    call: VapiCall
+
+class VapiToolCall(BaseModel):
+    id: str
+    type: Literal["function"]
+    function: Dict[str, Any]
+
+class VapiToolCallListMessage(BaseModel):
+    type: Literal["tool-calls"]
+    call: VapiCall
+    toolCallList: List[Dict[str, Any]] # Vapi sends tool calls as a list of dicts
+
+class VapiEndOfCallReportMessage(BaseModel):
+    type: Literal["end-of-call-report"]
+    call: VapiCall
+
+# message.type -> the model holding just the fields its handler reads.
+# Everything else in the payload (transcripts, messages, analysis) is
+# never validated or copied into models.
+VAPI_MESSAGE_MODELS: Dict[str, Type[BaseModel]] = {
+    "assistant-request": VapiAssistantRequestMessage,
+    "tool-calls": VapiToolCallListMessage,
+    "end-of-call-report": VapiEndOfCallReportMessage,
+}
+
+def decode_webhook(body: bytes) -> Optional[BaseModel]:
+    """
+    Decode a Vapi webhook body, validating only what its handler needs.
+
+    Peeks at message.type and validates the matching model; returns None
+    for message types we don't handle.
+
+    Raises:
+        orjson.JSONDecodeError: Body is not JSON
+        pydantic.ValidationError: A handled message is missing required fields
+    """
+    payload = orjson.loads(body)
+    message = payload.get("message") if isinstance(payload, dict) else None
+    if not isinstance(message, dict):
+        return None
+
+    model = VAPI_MESSAGE_MODELS.get(message.get("type"))
+    if model is None:
+        return None
+    return model.model_validate(message)